@@ -0,0 +1,102 @@
+"""
+Benchmark of the spotify data cleaning, comparing the per-row cleaning with the
+vectorized cleaning engine over synthetic tracks.
+
+Usage: python -m benchmarks.cleaning_benchmark [n_rows] [rows_per_frame]
+"""
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from data_cleaning.cleaning_engine import CleaningEngine
+from data_cleaning.cleaning_functions import add_metadata, clean_music_name, make_cols_lowercase
+
+SONG_WORD_LIST = ['Love', 'Night', 'Heart', 'Dance', 'Fire', 'Blue', 'Summer', 'Dream', 'Money', 'Girl']
+SONG_SUFFIX_LIST = ['', '', '', ' (feat. Someone Else)', ' (with Another One)', ' - Remix']
+ARTIST_NAME_LIST = ['Taylor', 'DRAKE', 'Ariana', 'Bad Bunny', 'Dua Lipa', 'Beyoncé', 'Ørjan', 'Post Malone']
+
+
+def make_synthetic_spotify_data(n_rows, rows_per_frame, seed=0):
+    """
+    DESCRIPTION: Build synthetic spotify playlists dataframes
+    INPUT: n_rows (int), rows_per_frame (int), seed (int/optional)
+    OUTPUT: data_dict (dict of dataframes)
+    """
+    random_state = np.random.RandomState(seed)
+    song_name = (
+        pd.Series(random_state.choice(SONG_WORD_LIST, n_rows))
+        + ' ' + pd.Series(random_state.choice(SONG_WORD_LIST, n_rows))
+        + pd.Series(random_state.choice(SONG_SUFFIX_LIST, n_rows))
+    )
+    all_artists = (
+        pd.Series(random_state.choice(ARTIST_NAME_LIST, n_rows))
+        + '*' + pd.Series(random_state.choice(ARTIST_NAME_LIST, n_rows))
+    )
+    spotify_df = pd.DataFrame({
+        'song_name': song_name,
+        'all_artists': all_artists,
+        'position': np.arange(n_rows) % 50 + 1,
+    })
+
+    return {
+        'playlist_{0}'.format(i): spotify_df.iloc[i:i + rows_per_frame].reset_index(drop=True)
+        for i in range(0, n_rows, rows_per_frame)
+    }
+
+
+def clean_per_row(data_dict, metadata_dict):
+    """
+    DESCRIPTION: Previous cleaning, column by column and row by row
+    INPUT: data_dict (dict of dataframes), metadata_dict (dict)
+    OUTPUT: data_dict (dict of dataframes)
+    """
+    for key, data_df in data_dict.items():
+        data_df = make_cols_lowercase(data_df, ['all_artists', 'song_name'])
+        data_df = add_metadata(data_df, metadata_dict)
+        data_df['song_name'] = data_df['song_name'].apply(clean_music_name)
+        data_dict[key] = data_df
+
+    return data_dict
+
+
+def run_benchmark(n_rows=1000000, rows_per_frame=10000):
+    """
+    DESCRIPTION: Time both cleanings over the same synthetic data
+    INPUT: n_rows (int/optional), rows_per_frame (int/optional)
+    OUTPUT: results (dict)
+    """
+    metadata_dict = {'source_date': datetime(2020, 8, 1)}
+    results = {}
+
+    for name, clean_function in [
+            ('per_row', clean_per_row),
+            ('engine', lambda data_dict, metadata_dict: CleaningEngine().clean_source(
+                'spotify', data_dict, metadata_dict)),
+    ]:
+        data_dict = make_synthetic_spotify_data(n_rows, rows_per_frame)
+        start = time.perf_counter()
+        cleaned_data_dict = clean_function(data_dict, metadata_dict)
+        seconds = time.perf_counter() - start
+        results[name] = {
+            'seconds': seconds,
+            'rows_per_second': n_rows / seconds,
+            'sample': cleaned_data_dict['playlist_0']['song_name'].head(3).tolist(),
+        }
+
+    assert results['per_row']['sample'] == results['engine']['sample']
+    results['speedup'] = results['per_row']['seconds'] / results['engine']['seconds']
+
+    return results
+
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rows_per_frame = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    results = run_benchmark(n_rows, rows_per_frame)
+    for name in ['per_row', 'engine']:
+        print('{0}: {1:.2f}s ({2:,.0f} rows/s)'.format(
+            name, results[name]['seconds'], results[name]['rows_per_second']
+        ))
+    print('speedup: {0:.1f}x'.format(results['speedup']))
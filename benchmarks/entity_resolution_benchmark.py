@@ -0,0 +1,73 @@
+"""
+Benchmark of the fuzzy resolution of the chart names, over a synthetic index
+of artist names made of a few common words, so each name shares n-grams with
+many others (the worst case of the LSH candidates). The resolutions are checked
+and the mean and p99 latencies are compared with the target of the resolve.
+
+Usage: python -m benchmarks.entity_resolution_benchmark [n_names] [n_resolves]
+"""
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+from data_analysis.entity_resolution import EntityIndex
+
+# Latency target of one resolve (seconds), at the p99
+RESOLVE_TARGET_SECONDS = 0.002
+
+
+def make_overlapping_names(n_names, seed=0):
+    """
+    DESCRIPTION: Build distinct names of 3 words taken from 60 random words
+    INPUT: n_names (int), seed (int/optional)
+    OUTPUT: name_list (list)
+    """
+    random_generator = random.Random(seed)
+    word_list = [''.join(random_generator.choices(string.ascii_lowercase, k=6)) for _ in range(60)]
+    name_table = {}
+    while len(name_table) < n_names:
+        name_table[' '.join(random_generator.sample(word_list, 3))] = None
+
+    return list(name_table)
+
+
+def run_benchmark(n_names=5000, n_resolves=1000):
+    """
+    DESCRIPTION: Resolve misspelled names (the last letter dropped) of an index
+                 of overlapping names, one at a time
+    INPUT: n_names (int/optional), n_resolves (int/optional)
+    OUTPUT: results (dict)
+    """
+    name_list = make_overlapping_names(n_names)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        entity_index = EntityIndex(os.path.join(tmp_dir, 'entities.sqlite3'))
+        entity_index.add_entities('artist', [('a_{0}'.format(i), x, None) for i, x in enumerate(name_list)])
+
+        latency_list = []
+        for i, name in enumerate(name_list[:n_resolves]):
+            start = time.perf_counter()
+            artist_id, _ = entity_index.resolve_artist(name[:-1])
+            latency_list.append(time.perf_counter() - start)
+            assert artist_id == 'a_{0}'.format(i), (name, artist_id)
+        entity_index.connection.close()
+
+    latency_list.sort()
+    return {
+        'resolves': len(latency_list),
+        'mean_seconds': sum(latency_list) / len(latency_list),
+        'p99_seconds': latency_list[int(len(latency_list) * 0.99)],
+    }
+
+
+if __name__ == '__main__':
+    n_names = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_resolves = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    results = run_benchmark(n_names, n_resolves)
+    print('{0} resolves over {1} names: mean {2:.3f}ms, p99 {3:.3f}ms (target {4:.3f}ms)'.format(
+        results['resolves'], n_names, results['mean_seconds'] * 1000, results['p99_seconds'] * 1000,
+        RESOLVE_TARGET_SECONDS * 1000
+    ))
+    sys.exit(0 if results['p99_seconds'] < RESOLVE_TARGET_SECONDS else 1)
@@ -0,0 +1,153 @@
+"""
+Generator of the synthetic chart pages of benchmarks/fixtures. They are not
+saved Billboard and DJ Mag pages: each one has the chart markup the scrapers
+read (100 entries with the classes of the real charts) inside the weight of a
+real page (styles, an inline script, a navigation menu and ad slots), so the
+parsing benchmarks measure how the parsers deal with the markup they skip.
+
+Usage: python -m benchmarks.generate_chart_fixtures [seed]
+"""
+import os
+import random
+import sys
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+WORD_LIST = [
+    'love', 'night', 'heart', 'dance', 'fire', 'blue', 'summer', 'dream', 'money', 'girl',
+    'lonely', 'gold', 'again', 'city', 'forever', 'wild', 'light', 'home', 'party', 'rain',
+]
+NAME_LIST = ['Justin', 'Dua', 'Olivia', 'Luke', 'Billie', 'Roddy', 'Weeknd', 'Harry', 'Megan', 'Bad', 'Taylor', 'Ariana']
+N_CHART_ENTRIES = 100
+N_STYLE_CLASSES = 1500
+N_SCRIPT_VALUES = 4000
+N_NAV_ITEMS = 300
+N_AD_SLOTS = 600
+
+
+def get_words(random_state, n_words):
+    """
+    DESCRIPTION: Get a text of random words
+    INPUT: random_state (random.Random), n_words (int)
+    OUTPUT: text (str)
+    """
+    return ' '.join(random_state.choice(WORD_LIST) for _ in range(n_words))
+
+
+def make_page(random_state, chart_html):
+    """
+    DESCRIPTION: Wrap the markup of a chart in the styles, script, navigation
+                 menu and ad slots of a page
+    INPUT: random_state (random.Random), chart_html (str)
+    OUTPUT: page (str)
+    """
+    style_str = '\n'.join(
+        '.c{0}{{color:#{1:06x};margin:{2}px}}'.format(i, random_state.randrange(0x1000000), i % 20)
+        for i in range(N_STYLE_CLASSES)
+    )
+    script_str = ','.join(repr(random_state.random()) for _ in range(N_SCRIPT_VALUES))
+    nav_str = ''.join(
+        '<li class="nav-item"><a href="/n/{0}">{1}</a></li>'.format(i, random_state.choice(WORD_LIST))
+        for i in range(N_NAV_ITEMS)
+    )
+    ad_str = '\n'.join(
+        '<div class="ad-container ad-slot-{0}" data-ad="{0}"><div class="ad-inner">'
+        '<a href="/promo/{0}">{1}</a><p>{2}</p></div></div>'.format(
+            i, get_words(random_state, 6), get_words(random_state, 40)
+        )
+        for i in range(N_AD_SLOTS)
+    )
+
+    return (
+        '<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>Chart</title>'
+        '<style>{0}</style><script>var data = [{1}];</script></head><body>'
+        '<nav class="site-nav"><ul>{2}</ul></nav>{3}{4}</body></html>'
+    ).format(style_str, script_str, nav_str, chart_html, ad_str)
+
+
+def make_billboard_chart(random_state):
+    """
+    DESCRIPTION: Build the markup of a hot 100 chart
+    INPUT: random_state (random.Random)
+    OUTPUT: chart_html (str)
+    """
+    entry_list = []
+    for i in range(N_CHART_ENTRIES):
+        artist = '{0} {1}'.format(random_state.choice(NAME_LIST), random_state.choice(NAME_LIST))
+        if random_state.random() < 0.2:
+            artist += ' Featuring {0}'.format(random_state.choice(NAME_LIST))
+        entry_list.append(
+            '<li class="chart-list__element display--flex">\n'
+            '<button class="chart-element__wrapper display--flex flex--grow sort--this-week" '
+            'data-detail-target="{0}">\n'
+            '<span class="chart-element__rank flex--column flex--xy-center flex--no-shrink">'
+            '<span class="chart-element__rank__number">{0}</span>'
+            '<span class="chart-element__trend chart-element__trend--steady color--steady">=</span></span>\n'
+            '<span class="chart-element__image flex--no-shrink" '
+            'style="background-image: url(\'https://charts-static.billboard.com/img/{1}.jpg\');"></span>\n'
+            '<span class="chart-element__information">\n'
+            '<span class="chart-element__information__song text--truncate color--primary">{2}</span>\n'
+            '<span class="chart-element__information__artist text--truncate color--secondary">{3}</span>\n'
+            '<span class="chart-element__information__delta text--truncate">'
+            '<span class="chart-element__information__delta__text text--last">{4} weeks</span></span>\n'
+            '</span></button>\n'
+            '<div class="chart-element__extra-info">{5}</div></li>'.format(
+                i + 1, i, random_state.choice(WORD_LIST).title(), artist,
+                random_state.randint(1, 52), get_words(random_state, 30)
+            )
+        )
+
+    return (
+        '<main><div class="chart-details"><ol class="chart-list__elements">{0}</ol></div></main>'
+    ).format('\n'.join(entry_list))
+
+
+def make_dj_mag_chart(random_state):
+    """
+    DESCRIPTION: Build the markup of a top 100 djs poll
+    INPUT: random_state (random.Random)
+    OUTPUT: chart_html (str)
+    """
+    entry_list = []
+    for i in range(N_CHART_ENTRIES):
+        first_name, last_name = random_state.choice(NAME_LIST), random_state.choice(NAME_LIST)
+        entry_list.append(
+            '<div class="top100dj-item views-row views-row-{0}">\n'
+            '<div class="top100dj-position">{0}</div>\n'
+            '<div class="top100dj-image"><img src="/sites/default/files/top100/{1}.jpg" alt="DJ {1}"></div>\n'
+            '<div class="top100dj-name"><a href="/top100djs/2020/{0}/{2}-{3}">{4} {5}</a></div>\n'
+            '<div class="top100dj-movement"><span class="top100dj-movement-label">{6}</span></div>\n'
+            '<div class="top100dj-body">{7}</div></div>'.format(
+                i + 1, i, first_name.lower(), last_name.lower(), first_name, last_name.upper(),
+                random_state.choice(['Up 2', 'Down 1', 'Non Mover', 'New Entry']),
+                get_words(random_state, 60)
+            )
+        )
+
+    return '<div class="view-top100djs"><div class="view-content">{0}</div></div>'.format('\n'.join(entry_list))
+
+
+def write_fixtures(seed=0, fixtures_path=FIXTURES_PATH):
+    """
+    DESCRIPTION: Write the synthetic chart pages (the same pages for a seed)
+    INPUT: seed (int/optional), fixtures_path (str/optional)
+    OUTPUT: file_path_list (list)
+    """
+    file_path_list = []
+    for fixture_name, make_chart in [
+            ('billboard_hot_100.html', make_billboard_chart),
+            ('djmag_top_100_djs.html', make_dj_mag_chart),
+    ]:
+        random_state = random.Random(seed)
+        file_path = os.path.join(fixtures_path, fixture_name)
+        with open(file_path, 'w', encoding='utf-8') as fixture_file:
+            fixture_file.write(make_page(random_state, make_chart(random_state)))
+        file_path_list.append(file_path)
+
+    return file_path_list
+
+
+if __name__ == '__main__':
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    for file_path in write_fixtures(seed):
+        print('wrote', file_path, os.path.getsize(file_path), 'bytes')
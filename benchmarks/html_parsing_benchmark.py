@@ -0,0 +1,155 @@
+"""
+Benchmark of the chart scrapers parsing, over the synthetic chart pages of
+benchmarks/fixtures (built by benchmarks.generate_chart_fixtures, not saved
+pages): the full tree parse with html.parser (the original scrapers), the full tree
+parse with the parser of the scrapers (lxml) and the targeted parse (lxml with
+a SoupStrainer), so the gains of the parser and of the strainer are measured
+apart.
+
+Usage: python -m benchmarks.html_parsing_benchmark [repeat]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from functools import partial
+from bs4 import BeautifulSoup
+
+from data_acquisition.billboard_api import BillboardAPI
+from data_acquisition.djmag_api import DJMagAPI
+from data_acquisition.html_api import HTML_PARSER
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def full_tree_billboard(page, parser='html.parser'):
+    """
+    DESCRIPTION: Billboard parse building the whole tree and scanning it twice
+    INPUT: page (bytes), parser (str/optional)
+    OUTPUT: billboard (dict/json)
+    """
+    billboard_html = BeautifulSoup(page, parser)
+    song_tag_list = billboard_html.find_all('span', {'class': 'chart-element__information__song'})
+    artist_tag_list = billboard_html.find_all('span', {'class': 'chart-element__information__artist'})
+
+    billboard = {'hot_100': []}
+    for index, tag in enumerate(song_tag_list):
+        billboard['hot_100'].append({
+            'title': tag.get_text(),
+            'artist': artist_tag_list[index].get_text(),
+            'position': index + 1
+        })
+
+    return billboard
+
+
+def full_tree_dj_mag(page, parser='html.parser'):
+    """
+    DESCRIPTION: DJ Mag parse building the whole tree and scanning it
+    INPUT: page (bytes), parser (str/optional)
+    OUTPUT: dj_mag (dict/json)
+    """
+    dj_mag_html = BeautifulSoup(page, parser)
+    dj_name_tag_group = dj_mag_html.find_all('div', {'class': 'top100dj-name'})
+    dj_name_text_list = [tag.find_all('a')[0].get_text() for tag in dj_name_tag_group]
+
+    dj_mag = {'top100djs': []}
+    for index, dj_name in enumerate(dj_name_text_list):
+        dj_mag['top100djs'].append({'artist': dj_name, 'position': index + 1})
+
+    return dj_mag
+
+
+def measure(parse_function, page, repeat):
+    """
+    DESCRIPTION: Get the best wall time and the peak traced memory of a parse
+    INPUT: parse_function (function), page (bytes), repeat (int)
+    OUTPUT: result (dict)
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_function(page)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    parsed = parse_function(page)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'best_seconds': min(timings),
+        'peak_memory_mb': peak_memory / 1024 / 1024,
+        'rows': len(next(iter(parsed.values()))),
+    }
+
+
+def run_benchmark(repeat=5):
+    """
+    DESCRIPTION: Run the full tree (html.parser and lxml) and targeted parses
+                 over the fixtures. parser_speedup is the gain of lxml on the
+                 full tree, strainer_speedup the gain of the strainer with the
+                 same parser and speedup the gain over the original scrapers
+    INPUT: repeat (int/optional)
+    OUTPUT: results (dict)
+    """
+    cases = {
+        'billboard': (
+            'billboard_hot_100.html',
+            full_tree_billboard,
+            BillboardAPI().parse_billboard_hot_100
+        ),
+        'dj_mag': (
+            'djmag_top_100_djs.html',
+            full_tree_dj_mag,
+            DJMagAPI().parse_top_100_djs
+        ),
+    }
+
+    results = {}
+    for source_name, (fixture_name, full_tree_function, targeted_function) in cases.items():
+        with open(os.path.join(FIXTURES_PATH, fixture_name), 'rb') as fixture_file:
+            page = fixture_file.read()
+
+        full_tree_lxml_function = partial(full_tree_function, parser=HTML_PARSER)
+        full_tree = measure(full_tree_function, page, repeat)
+        full_tree_lxml = measure(full_tree_lxml_function, page, repeat)
+        targeted = measure(targeted_function, page, repeat)
+        assert full_tree_function(page) == full_tree_lxml_function(page) == targeted_function(page)
+
+        results[source_name] = {
+            'full_tree': full_tree,
+            'full_tree_lxml': full_tree_lxml,
+            'targeted': targeted,
+            'parser_speedup': full_tree['best_seconds'] / full_tree_lxml['best_seconds'],
+            'strainer_speedup': full_tree_lxml['best_seconds'] / targeted['best_seconds'],
+            'speedup': full_tree['best_seconds'] / targeted['best_seconds'],
+            'strainer_memory_ratio': full_tree_lxml['peak_memory_mb'] / targeted['peak_memory_mb'],
+            'memory_ratio': full_tree['peak_memory_mb'] / targeted['peak_memory_mb'],
+        }
+
+    return results
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for source_name, result in run_benchmark(repeat).items():
+        print('{0}: full tree html.parser {1:.3f}s / {2:.1f}MB, full tree {3} {4:.3f}s / {5:.1f}MB, '
+              'targeted {6:.3f}s / {7:.1f}MB'.format(
+                  source_name,
+                  result['full_tree']['best_seconds'],
+                  result['full_tree']['peak_memory_mb'],
+                  HTML_PARSER,
+                  result['full_tree_lxml']['best_seconds'],
+                  result['full_tree_lxml']['peak_memory_mb'],
+                  result['targeted']['best_seconds'],
+                  result['targeted']['peak_memory_mb'],
+              ))
+        print('    parser {0:.1f}x faster, strainer {1:.1f}x faster / {2:.1f}x less memory, '
+              'total {3:.1f}x faster / {4:.1f}x less memory'.format(
+                  result['parser_speedup'],
+                  result['strainer_speedup'],
+                  result['strainer_memory_ratio'],
+                  result['speedup'],
+                  result['memory_ratio']
+              ))
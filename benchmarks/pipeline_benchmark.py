@@ -0,0 +1,413 @@
+"""
+Offline benchmark of every pipeline stage, over the fixtures (Spotify json,
+synthetic Billboard and DJ Mag pages) scaled up by synthetic generators. Each stage
+runs in a fresh process, so its peak RSS is not mixed with the other stages.
+The results can be saved as json and compared with a previous version.
+
+Usage: python -m benchmarks.pipeline_benchmark [--rows N] [--repeat N] [--stages a,b]
+                                               [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from data_acquisition.billboard_api import BillboardAPI
+from data_acquisition.djmag_api import DJMagAPI
+from data_acquisition.spotify_api import SpotifyAPI
+from music_trends_master import MusicTrends
+from utilities.load_to_sql import TABLE_LOOKUP, bulk_load_frames
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+TRACKS_PER_PLAYLIST = 50
+TRACKS_PER_ARTIST = 10
+SQLITE_TABLE_LIST = [
+    """
+    create table tendencias_musicais_app_artists (
+        id integer primary key, artist_id text unique, name text,
+        music_genre_1 text, music_genre_2 text, music_genre_3 text
+    )
+    """,
+    """
+    create table tendencias_musicais_app_spotifydata (
+        id integer primary key, playlist_id_id text, main_artist_id_id text,
+        all_artists text, all_artists_ids text, release_date text, duration integer,
+        song_name text, popularity integer, position integer, source_date datetime
+    )
+    """,
+]
+
+
+def read_fixture(fixture_name):
+    """
+    DESCRIPTION: Read a fixture, parsing it when it is json
+    INPUT: fixture_name (str)
+    OUTPUT: fixture (bytes or dict)
+    """
+    with open(os.path.join(FIXTURES_PATH, fixture_name), 'rb') as fixture_file:
+        fixture = fixture_file.read()
+
+    if fixture_name.endswith('.json'):
+        return json.loads(fixture)
+
+    return fixture
+
+
+def make_synthetic_playlist_json(n_tracks, playlist_id='synthetic', seed=0):
+    """
+    DESCRIPTION: Scale the recorded playlist to n_tracks, changing the ids so
+                 the tracks and their main artists are not all the same
+    INPUT: n_tracks (int), playlist_id (str/optional), seed (int/optional)
+    OUTPUT: playlist_json (dict)
+    """
+    playlist_json = read_fixture('spotify_playlist.json')
+    recorded_item_list = playlist_json['tracks']['items']
+    n_artists = max(n_tracks // TRACKS_PER_ARTIST, 1)
+
+    item_list = []
+    for index in range(n_tracks):
+        item = copy.deepcopy(recorded_item_list[(index + seed) % len(recorded_item_list)])
+        if item['track']:
+            item['track']['id'] = '{0}_{1}'.format(item['track']['id'], index)
+            item['track']['album']['artists'][0]['id'] = 'artist_{0}'.format((index * 7 + seed) % n_artists)
+        item_list.append(item)
+
+    playlist_json['id'] = playlist_id
+    playlist_json['tracks'].update({'items': item_list, 'total': n_tracks})
+
+    return playlist_json
+
+
+def make_synthetic_artists_json(n_artists):
+    """
+    DESCRIPTION: Scale the recorded artists response to n_artists
+    INPUT: n_artists (int)
+    OUTPUT: artists_response_list (list)
+    """
+    recorded_artist_list = read_fixture('spotify_artists.json')['artists']
+
+    artists_response_list = []
+    for index in range(n_artists):
+        artist_data = dict(recorded_artist_list[index % len(recorded_artist_list)])
+        artist_data['id'] = 'artist_{0}'.format(index)
+        artists_response_list.append(artist_data)
+
+    return artists_response_list
+
+
+def get_offline_spotify_api():
+    """
+    DESCRIPTION: Get a SpotifyAPI for the offline stages (the token is only
+                 asked for on the first request, which these stages never send)
+    INPUT: None
+    OUTPUT: spotify_api (SpotifyAPI)
+    """
+    return SpotifyAPI('', '')
+
+
+def make_acquired_music_trends(n_rows):
+    """
+    DESCRIPTION: Build a MusicTrends holding the acquired data of a run with
+                 n_rows spotify tracks, as the acquisition stages leave it
+    INPUT: n_rows (int)
+    OUTPUT: music_trends (MusicTrends)
+    """
+    spotify_api = get_offline_spotify_api()
+    music_trends = MusicTrends(timestamp=datetime(2020, 8, 1, 12))
+
+    for index in range(0, n_rows, TRACKS_PER_PLAYLIST):
+        playlist_name = 'playlist_{0}'.format(index // TRACKS_PER_PLAYLIST)
+        playlist_json = make_synthetic_playlist_json(
+            min(TRACKS_PER_PLAYLIST, n_rows - index), playlist_name, seed=index
+        )
+        playlist_info = spotify_api.pre_process_playlist_json(playlist_json, playlist_name)
+        music_trends.spotify_playlists_data[playlist_name] = pd.DataFrame(playlist_info[playlist_name])
+
+    artists_info = spotify_api.pre_process_artists_json(
+        make_synthetic_artists_json(max(n_rows // TRACKS_PER_ARTIST, 1))
+    )
+    music_trends.artists_data['artists'] = pd.DataFrame(artists_info['artists'])
+
+    billboard_json = BillboardAPI().parse_billboard_hot_100(read_fixture('billboard_hot_100.html'))
+    music_trends.billboard_data['hot_100'] = pd.DataFrame(billboard_json['hot_100'])
+    dj_mag_json = DJMagAPI().parse_top_100_djs(read_fixture('djmag_top_100_djs.html'))
+    music_trends.dj_mag_data['top100djs'] = pd.DataFrame(dj_mag_json['top100djs'])
+
+    return music_trends
+
+
+def count_rows(music_trends):
+    """
+    DESCRIPTION: Count the rows of every dataframe of a MusicTrends
+    INPUT: music_trends (MusicTrends)
+    OUTPUT: n_rows (int)
+    """
+    return sum(
+        len(data_df)
+        for data_dict in music_trends.data_source_table.values()
+        for data_df in data_dict.values()
+    )
+
+
+def setup_pre_process(n_rows):
+    """
+    DESCRIPTION: Build the input of the pre_process_playlist_json stage
+    INPUT: n_rows (int)
+    OUTPUT: context (dict)
+    """
+    return {
+        'spotify_api': get_offline_spotify_api(),
+        'playlist_json': make_synthetic_playlist_json(n_rows),
+    }
+
+
+def run_pre_process(context):
+    """
+    DESCRIPTION: Extract the tracks of one big playlist
+    INPUT: context (dict)
+    OUTPUT: rows (int)
+    """
+    playlist_info = context['spotify_api'].pre_process_playlist_json(context['playlist_json'], 'synthetic')
+    return len(playlist_info['synthetic'])
+
+
+def setup_billboard_scraper(n_rows):
+    """
+    DESCRIPTION: Build the input of the billboard scraper stage
+    INPUT: n_rows (int, unused, the chart has 100 rows)
+    OUTPUT: context (dict)
+    """
+    return {'page': read_fixture('billboard_hot_100.html'), 'billboard_api': BillboardAPI()}
+
+
+def run_billboard_scraper(context):
+    """
+    DESCRIPTION: Parse the recorded hot 100 page
+    INPUT: context (dict)
+    OUTPUT: rows (int)
+    """
+    return len(context['billboard_api'].parse_billboard_hot_100(context['page'])['hot_100'])
+
+
+def setup_dj_mag_scraper(n_rows):
+    """
+    DESCRIPTION: Build the input of the dj mag scraper stage
+    INPUT: n_rows (int, unused, the chart has 100 rows)
+    OUTPUT: context (dict)
+    """
+    return {'page': read_fixture('djmag_top_100_djs.html'), 'djmag_api': DJMagAPI()}
+
+
+def run_dj_mag_scraper(context):
+    """
+    DESCRIPTION: Parse the recorded top 100 djs page
+    INPUT: context (dict)
+    OUTPUT: rows (int)
+    """
+    return len(context['djmag_api'].parse_top_100_djs(context['page'])['top100djs'])
+
+
+def setup_data_cleaning(n_rows):
+    """
+    DESCRIPTION: Build the input of the data_cleaning stage
+    INPUT: n_rows (int)
+    OUTPUT: context (dict)
+    """
+    return {'music_trends': make_acquired_music_trends(n_rows)}
+
+
+def run_data_cleaning(context):
+    """
+    DESCRIPTION: Clean every source of the run
+    INPUT: context (dict)
+    OUTPUT: rows (int)
+    """
+    context['music_trends'].data_cleaning()
+    return count_rows(context['music_trends'])
+
+
+def setup_data_local_storage(n_rows):
+    """
+    DESCRIPTION: Build the input of the data_local_storage stage, writing to a temporary directory
+    INPUT: n_rows (int)
+    OUTPUT: context (dict)
+    """
+    music_trends = make_acquired_music_trends(n_rows)
+    music_trends.data_cleaning()
+    tmp_dir = tempfile.TemporaryDirectory()
+    music_trends.storage_path = tmp_dir.name
+
+    return {'music_trends': music_trends, 'tmp_dir': tmp_dir}
+
+
+def run_data_local_storage(context):
+    """
+    DESCRIPTION: Store every source of the run
+    INPUT: context (dict)
+    OUTPUT: rows (int)
+    """
+    context['music_trends'].data_local_storage()
+    return count_rows(context['music_trends'])
+
+
+def setup_sql_load_sqlite(n_rows):
+    """
+    DESCRIPTION: Build the input of the sql load stage, with an empty sqlite database
+    INPUT: n_rows (int)
+    OUTPUT: context (dict)
+    """
+    music_trends = make_acquired_music_trends(n_rows)
+    music_trends.data_cleaning()
+    tmp_dir = tempfile.TemporaryDirectory()
+    engine = create_engine('sqlite:///{0}'.format(os.path.join(tmp_dir.name, 'benchmark.sqlite3')))
+    with engine.begin() as conn:
+        for create_table_sql in SQLITE_TABLE_LIST:
+            conn.execute(text(create_table_sql))
+
+    frame_table = {
+        TABLE_LOOKUP[source_name]: list(music_trends.data_source_table[source_name].values())
+        for source_name in ['spotify', 'artists']
+    }
+
+    return {'frame_table': frame_table, 'engine': engine, 'tmp_dir': tmp_dir}
+
+
+def run_sql_load_sqlite(context):
+    """
+    DESCRIPTION: Load the spotify and artists data in one transaction
+    INPUT: context (dict)
+    OUTPUT: rows (int)
+    """
+    bulk_load_frames(context['frame_table'], context['engine'])
+    return sum(len(data_df) for data_df_list in context['frame_table'].values() for data_df in data_df_list)
+
+
+STAGE_TABLE = {
+    'pre_process_playlist_json': (setup_pre_process, run_pre_process),
+    'billboard_scraper': (setup_billboard_scraper, run_billboard_scraper),
+    'dj_mag_scraper': (setup_dj_mag_scraper, run_dj_mag_scraper),
+    'data_cleaning': (setup_data_cleaning, run_data_cleaning),
+    'data_local_storage': (setup_data_local_storage, run_data_local_storage),
+    'sql_load_sqlite': (setup_sql_load_sqlite, run_sql_load_sqlite),
+}
+
+
+def run_stage(stage_name, n_rows, repeat):
+    """
+    DESCRIPTION: Time one stage. The setup of each repetition is not timed,
+                 the peak RSS is the one of the whole (fresh) process
+    INPUT: stage_name (str), n_rows (int), repeat (int)
+    OUTPUT: result (dict)
+    """
+    setup_function, run_function = STAGE_TABLE[stage_name]
+
+    timings = []
+    for _ in range(repeat):
+        context = setup_function(n_rows)
+        start = time.perf_counter()
+        rows = run_function(context)
+        timings.append(time.perf_counter() - start)
+        if 'tmp_dir' in context:
+            context['tmp_dir'].cleanup()
+
+    best_seconds = min(timings)
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+
+    return {
+        'best_seconds': best_seconds,
+        'mean_seconds': sum(timings) / len(timings),
+        'rows': rows,
+        'rows_per_second': rows / best_seconds if best_seconds else None,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 1024 / 1024,
+    }
+
+
+def run_benchmark(n_rows=100000, repeat=3, stage_list=None):
+    """
+    DESCRIPTION: Run each stage in its own fresh process
+    INPUT: n_rows (int/optional), repeat (int/optional), stage_list (list/optional)
+    OUTPUT: results (dict)
+    """
+    if stage_list is None:
+        stage_list = list(STAGE_TABLE)
+
+    stages = {}
+    spawn_context = multiprocessing.get_context('spawn')
+    for stage_name in stage_list:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn_context) as executor:
+            stages[stage_name] = executor.submit(run_stage, stage_name, n_rows, repeat).result()
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'rows': n_rows,
+        'repeat': repeat,
+        'stages': stages,
+    }
+
+
+def compare_results(results, baseline, threshold=0.2):
+    """
+    DESCRIPTION: Compare the stage timings with a baseline run. A stage slower
+                 than the baseline by more than the threshold is a regression
+    INPUT: results (dict), baseline (dict), threshold (float/optional)
+    OUTPUT: regression_list (list)
+    """
+    regression_list = []
+    for stage_name, result in results['stages'].items():
+        baseline_result = baseline['stages'].get(stage_name)
+        if baseline_result is None:
+            continue
+
+        ratio = result['best_seconds'] / baseline_result['best_seconds']
+        is_regression = ratio > 1 + threshold
+        if is_regression:
+            regression_list.append(stage_name)
+        print('{0:<28} {1:>8.3f}s vs {2:>8.3f}s ({3:.2f}x){4}'.format(
+            stage_name,
+            result['best_seconds'],
+            baseline_result['best_seconds'],
+            ratio,
+            '  REGRESSION' if is_regression else ''
+        ))
+
+    return regression_list
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='offline benchmark of the pipeline stages')
+    parser.add_argument('--rows', type=int, default=100000, help='spotify tracks of the synthetic run')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', help='comma separated stages, all by default: ' + ', '.join(STAGE_TABLE))
+    parser.add_argument('--output', help='save the results to this json file')
+    parser.add_argument('--compare', help='json results of a previous version to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown counted as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.rows, args.repeat, args.stages.split(',') if args.stages else None)
+    for stage_name, result in results['stages'].items():
+        print('{0:<28} {1:>8.3f}s {2:>12,.0f} rows/s {3:>8.1f}MB peak RSS'.format(
+            stage_name, result['best_seconds'], result['rows_per_second'] or 0, result['peak_rss_mb']
+        ))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regression_list = compare_results(results, json.load(baseline_file), args.threshold)
+        if regression_list:
+            sys.exit(1)
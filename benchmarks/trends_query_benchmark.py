@@ -0,0 +1,97 @@
+"""
+Benchmark of the cached trends queries under concurrent readers: the common
+queries of a dashboard (market overlap and top artists) are read by several
+threads from a trends file of synthetic charts, and the p99 latency of a read
+is compared with its target.
+
+Usage: python -m benchmarks.trends_query_benchmark [n_threads] [n_reads]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+import pandas as pd
+
+from data_analysis.trend_aggregation import TrendAggregator
+from data_analysis.trends_query import TrendsQueryService
+
+# Latency target of one read of the overlap and top artists (seconds), at the p99
+READ_TARGET_SECONDS = 0.005
+MARKET_LIST = ['BRA', 'USA', 'GBR', 'DEU', 'FRA', 'JPN', 'MEX', 'ESP']
+
+
+def fold_synthetic_charts(trend_aggregator, n_tracks=50, n_days=7):
+    """
+    DESCRIPTION: Fold a week of top 50 charts of a few markets, drawn from a
+                 shared pool of tracks so the markets overlap
+    INPUT: trend_aggregator (TrendAggregator), n_tracks (int/optional), n_days (int/optional)
+    OUTPUT: None
+    """
+    for day in range(n_days):
+        for market_index, market in enumerate(MARKET_LIST):
+            track_id_list = ['t{0}'.format((x * 7 + market_index * 11 + day * 3) % 150) for x in range(n_tracks)]
+            trend_aggregator.fold_snapshot(market, pd.DataFrame({
+                'track_id': track_id_list,
+                'main_artist_id_id': ['artist_{0}'.format(int(x[1:]) % 40) for x in track_id_list],
+                'song_name': track_id_list,
+                'popularity': 80,
+                'position': range(1, n_tracks + 1),
+                'source_date': datetime(2020, 8, day + 1),
+            }))
+
+
+def run_benchmark(n_threads=8, n_reads=500):
+    """
+    DESCRIPTION: Read the overlap and the top artists of a market from several
+                 threads at once, after a first read fills the cache
+    INPUT: n_threads (int/optional), n_reads (int/optional, per thread)
+    OUTPUT: results (dict)
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        trend_aggregator = TrendAggregator(os.path.join(tmp_dir, 'trends.sqlite3'))
+        fold_synthetic_charts(trend_aggregator)
+        registry = mock.Mock()
+        registry.get_entries.return_value = [{'market': x} for x in MARKET_LIST]
+        trends_query_service = TrendsQueryService(
+            trend_aggregator, os.path.join(tmp_dir, 'trends.generation'), registry=registry
+        )
+        expected = (trends_query_service.market_overlap(), trends_query_service.top_artists('BRA'))
+        latency_list = []
+        mismatch_list = []
+
+        def read_trends():
+            for _ in range(n_reads):
+                start = time.perf_counter()
+                result = (trends_query_service.market_overlap(), trends_query_service.top_artists('BRA'))
+                latency_list.append(time.perf_counter() - start)
+                if result != expected:
+                    mismatch_list.append(result)
+
+        thread_list = [threading.Thread(target=read_trends) for _ in range(n_threads)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        trend_aggregator.connection.close()
+
+    assert not mismatch_list
+    latency_list.sort()
+    return {
+        'reads': len(latency_list),
+        'mean_seconds': sum(latency_list) / len(latency_list),
+        'p99_seconds': latency_list[int(len(latency_list) * 0.99)],
+    }
+
+
+if __name__ == '__main__':
+    n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    n_reads = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    results = run_benchmark(n_threads, n_reads)
+    print('{0} reads from {1} threads: mean {2:.3f}ms, p99 {3:.3f}ms (target {4:.3f}ms)'.format(
+        results['reads'], n_threads, results['mean_seconds'] * 1000, results['p99_seconds'] * 1000,
+        READ_TARGET_SECONDS * 1000
+    ))
+    sys.exit(0 if results['p99_seconds'] < READ_TARGET_SECONDS else 1)
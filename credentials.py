@@ -0,0 +1,6 @@
+SPOTIFY_CLIENT_ID = ''
+SPOTIFY_SECRET = ''
+DB_USER = ''
+DB_PASSWORD = ''
+DB_DATABASE = ''
+DB_HOST = ''
@@ -2,3 +2,8 @@
 
 SPOTIFY_CLIENT_ID = 'add your spotify client_id here'
 SPOTIFY_SECRET = 'add your spotify secret here'
+
+DB_USER = 'add your database user here'
+DB_PASSWORD = 'add your database password here'
+DB_DATABASE = 'add your database name here'
+DB_HOST = 'add your database host here'
@@ -1,18 +1,37 @@
 """
 Module to handle the HTML data acquisition from Billboard website
 """
+import re
+from bs4 import SoupStrainer
+
+from music_trends_constants import HTML_CACHE_TTL_TABLE
 from .html_api import HtmlAPI
 
+SONG_CLASS = 'chart-element__information__song'
+ARTIST_CLASS = 'chart-element__information__artist'
+
 class BillboardAPI(HtmlAPI):
     """
     DESCRIPTION: Interface with Billboard via their website html
     ATTRIBUTES:
         - url (str)
+        - cache_ttl (int)
     METHODS:
         - get_billboard_hot_100_json
+        - parse_billboard_hot_100
     """
-    def __init__(self):
-        self.url = 'https://www.billboard.com/'
+    # regex on the class attribute so tags with extra classes also match
+    hot_100_strainer = SoupStrainer(
+        'span',
+        {'class': re.compile(r'(^|\s)({0}|{1})(\s|$)'.format(SONG_CLASS, ARTIST_CLASS))}
+    )
+
+    def __init__(self, http_cache=None):
+        super().__init__(
+            url='https://www.billboard.com/',
+            cache_ttl=HTML_CACHE_TTL_TABLE['billboard'],
+            http_cache=http_cache
+        )
 
     def get_billboard_hot_100_json(self):
         """
@@ -20,27 +39,32 @@ class BillboardAPI(HtmlAPI):
         INPUT: None
         OUTPUT: billboard (dict/json)
         """
-        billboard_html = self.fetch_html(uri='charts/hot-100')
-        song_title_tag_list = billboard_html.findAll(
-            'span',
-            {'class': 'chart-element__information__song'}
-        )
-        artist_name_tag_list = billboard_html.findAll(
-            'span',
-            {'class': 'chart-element__information__artist'}
-        )
+        billboard_page = self.fetch_page(uri='charts/hot-100')
+        billboard = self.parse_billboard_hot_100(billboard_page)
 
-        song_title_text_list = [tag.get_text() for tag in song_title_tag_list]
-        artist_name_text_list = [tag.get_text() for tag in artist_name_tag_list]
+        return billboard
+
+    def parse_billboard_hot_100(self, billboard_page):
+        """
+        DESCRIPTION: Extract title, artist and position of the hot 100 songs in a
+                     single pass over the song/artist spans of the page
+        INPUT: billboard_page (bytes/str)
+        OUTPUT: billboard (dict/json)
+        """
+        billboard_html = self.parse_html(billboard_page, self.hot_100_strainer)
 
         billboard = {'hot_100': []}
-        for index, song in enumerate(song_title_text_list):
-            song_info = {
-                'title': song,
-                'artist': artist_name_text_list[index],
-                'position': index + 1
-            }
-            billboard['hot_100'].append(song_info)
+        for tag in billboard_html.find_all('span', recursive=False):
+            tag_class = tag.get('class', [])
+            if SONG_CLASS in tag_class:
+                song_info = {
+                    'title': tag.get_text(),
+                    'artist': None,
+                    'position': len(billboard['hot_100']) + 1
+                }
+                billboard['hot_100'].append(song_info)
+            elif ARTIST_CLASS in tag_class and billboard['hot_100']:
+                billboard['hot_100'][-1]['artist'] = tag.get_text()
 
         return billboard
 
@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+from data_acquisition.billboard_api import BillboardAPI
+
+
+def make_chart_entry(title=None, artist=None, song_class='chart-element__information__song text--truncate'):
+    entry = '<li class="chart-list__element"><span class="chart-element__information">'
+    if title is not None:
+        entry += '<span class="{0}">{1}</span>'.format(song_class, title)
+    if artist is not None:
+        entry += '<span class="chart-element__information__artist text--truncate color--secondary">{0}</span>'.format(
+            artist
+        )
+    return entry + '</span></li>'
+
+
+class TestBillboardAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.billboard_api = BillboardAPI(http_cache=mock.Mock())
+
+    def test_parse_hot_100(self):
+        billboard_page = (
+            '<html><body><ol>'
+            + make_chart_entry('Song One', 'Artist One', 'chart-element__information__song')
+            + make_chart_entry('Song Two', 'Artist Two')
+            + make_chart_entry('Song Three', 'Artist Three', 'color--primary chart-element__information__song')
+            + '</ol></body></html>'
+        ).encode('utf-8')
+
+        billboard = self.billboard_api.parse_billboard_hot_100(billboard_page)
+
+        self.assertEqual(billboard, {'hot_100': [
+            {'title': 'Song One', 'artist': 'Artist One', 'position': 1},
+            {'title': 'Song Two', 'artist': 'Artist Two', 'position': 2},
+            {'title': 'Song Three', 'artist': 'Artist Three', 'position': 3},
+        ]})
+
+    def test_missing_artist_span(self):
+        billboard_page = (
+            '<html><body><ol>'
+            # an artist before any title is not attached to a song
+            + make_chart_entry(artist='Nobody')
+            + make_chart_entry('Song One', 'Artist One')
+            + make_chart_entry('Song Two')
+            + make_chart_entry('Song Three', 'Artist Three')
+            # a class only starting like the song class is not a song
+            + make_chart_entry('Not a song', song_class='chart-element__information__song-extra')
+            + '</ol></body></html>'
+        )
+
+        hot_100 = self.billboard_api.parse_billboard_hot_100(billboard_page)['hot_100']
+
+        self.assertEqual([(x['title'], x['artist'], x['position']) for x in hot_100], [
+            ('Song One', 'Artist One', 1),
+            ('Song Two', None, 2),
+            ('Song Three', 'Artist Three', 3),
+        ])
+
+    def test_get_hot_100_json(self):
+        billboard_page = '<html><body>{0}</body></html>'.format(make_chart_entry('Song One', 'Artist One'))
+        with mock.patch.object(self.billboard_api, 'fetch_page', return_value=billboard_page) as fetch_page:
+            billboard = self.billboard_api.get_billboard_hot_100_json()
+
+        fetch_page.assert_called_once_with(uri='charts/hot-100')
+        self.assertEqual(billboard['hot_100'], [{'title': 'Song One', 'artist': 'Artist One', 'position': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 """
 Module to handle the HTML data acquisition from DJ Mag website
 """
+import re
+from bs4 import SoupStrainer
+
+from music_trends_constants import HTML_CACHE_TTL_TABLE
 from .html_api import HtmlAPI
 
 class DJMagAPI(HtmlAPI):
@@ -8,11 +12,19 @@ class DJMagAPI(HtmlAPI):
     DESCRIPTION: Interface with DJ Mag via their website html
     ATTRIBUTES:
         - url (str)
+        - cache_ttl (int)
     METHODS:
         - get_top_100_djs_json
+        - parse_top_100_djs
     """
-    def __init__(self):
-        self.url = 'https://djmag.com/'
+    top_100_djs_strainer = SoupStrainer('div', {'class': re.compile(r'(^|\s)top100dj-name(\s|$)')})
+
+    def __init__(self, http_cache=None):
+        super().__init__(
+            url='https://djmag.com/',
+            cache_ttl=HTML_CACHE_TTL_TABLE['dj_mag'],
+            http_cache=http_cache
+        )
 
     def get_top_100_djs_json(self):
         """
@@ -20,19 +32,31 @@ class DJMagAPI(HtmlAPI):
         INPUT: None
         OUTPUT: dj_mag (dict/json)
         """
-        dj_mag_html = self.fetch_html(uri='top100djs')
-        dj_name_tag_group = dj_mag_html.findAll('div', {'class': 'top100dj-name'})
+        dj_mag_page = self.fetch_page(uri='top100djs')
+        dj_mag = self.parse_top_100_djs(dj_mag_page)
+
+        return dj_mag
 
-        dj_name_tag_list = [tag.findAll('a') for tag in dj_name_tag_group]
-        dj_name_text_list = [tag[0].get_text() for tag in dj_name_tag_list]
+    def parse_top_100_djs(self, dj_mag_page):
+        """
+        DESCRIPTION: Extract artist and position of the top 100 djs in a single
+                     pass over the dj name blocks of the page
+        INPUT: dj_mag_page (bytes/str)
+        OUTPUT: dj_mag (dict/json)
+        """
+        dj_mag_html = self.parse_html(dj_mag_page, self.top_100_djs_strainer)
 
         dj_mag = {'top100djs': []}
-        for index, dj_name in enumerate(dj_name_text_list):
-            song_info = {
-                'artist': dj_name,
-                'position': index + 1
+        for tag in dj_mag_html.find_all('div', recursive=False):
+            dj_name_tag = tag.find('a')
+            if dj_name_tag is None:
+                continue
+
+            dj_info = {
+                'artist': dj_name_tag.get_text(),
+                'position': len(dj_mag['top100djs']) + 1
             }
-            dj_mag['top100djs'].append(song_info)
+            dj_mag['top100djs'].append(dj_info)
 
         return dj_mag
 
@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+from data_acquisition.djmag_api import DJMagAPI
+
+
+def make_dj_entry(position, dj_name=None, name_class='top100dj-name'):
+    entry = '<div class="top100dj-item"><div class="top100dj-position">{0}</div>'.format(position)
+    if dj_name is None:
+        entry += '<div class="{0}"></div>'.format(name_class)
+    else:
+        entry += '<div class="{0}"><a href="/top100djs/{1}">{2}</a></div>'.format(name_class, position, dj_name)
+    return entry + '<div class="top100dj-body">bio</div></div>'
+
+
+class TestDJMagAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.dj_mag_api = DJMagAPI(http_cache=mock.Mock())
+
+    def test_parse_top_100_djs(self):
+        dj_mag_page = (
+            '<html><body><div class="view-content">'
+            + make_dj_entry(1, 'David GUETTA')
+            + make_dj_entry(2, 'Martin GARRIX', 'top100dj-name views-field')
+            + make_dj_entry(3, 'Armin VAN BUUREN', 'views-field top100dj-name field-content')
+            + '</div></body></html>'
+        ).encode('utf-8')
+
+        dj_mag = self.dj_mag_api.parse_top_100_djs(dj_mag_page)
+
+        self.assertEqual(dj_mag, {'top100djs': [
+            {'artist': 'David GUETTA', 'position': 1},
+            {'artist': 'Martin GARRIX', 'position': 2},
+            {'artist': 'Armin VAN BUUREN', 'position': 3},
+        ]})
+
+    def test_missing_dj_name_link(self):
+        dj_mag_page = (
+            '<html><body><div class="view-content">'
+            + make_dj_entry(1, 'David GUETTA')
+            # a name block without its link does not take a position
+            + make_dj_entry(2)
+            + make_dj_entry(2, 'Martin GARRIX')
+            # a class only starting like the name class is not a name block
+            + make_dj_entry(3, 'Not a dj', 'top100dj-name-extra')
+            + '</div></body></html>'
+        )
+
+        top100djs = self.dj_mag_api.parse_top_100_djs(dj_mag_page)['top100djs']
+
+        self.assertEqual([(x['artist'], x['position']) for x in top100djs], [
+            ('David GUETTA', 1),
+            ('Martin GARRIX', 2),
+        ])
+
+    def test_get_top_100_djs_json(self):
+        dj_mag_page = '<html><body>{0}</body></html>'.format(make_dj_entry(1, 'David GUETTA'))
+        with mock.patch.object(self.dj_mag_api, 'fetch_page', return_value=dj_mag_page) as fetch_page:
+            dj_mag = self.dj_mag_api.get_top_100_djs_json()
+
+        fetch_page.assert_called_once_with(uri='top100djs')
+        self.assertEqual(dj_mag['top100djs'], [{'artist': 'David GUETTA', 'position': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
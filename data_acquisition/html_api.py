@@ -1,33 +1,114 @@
 """
 Module to handle the HTML data acquisition from websites
 """
-from bs4 import BeautifulSoup
+import time
+import urllib.error
+import urllib.parse
 import urllib.request
+from bs4 import BeautifulSoup
+
+from utilities.http_cache import HttpCache
+from utilities.metrics import METRICS, record_http_call
+
+HTML_PARSER = 'lxml'
 
 class HtmlAPI(object):
     """
     DESCRIPTION: module to fetch html from website
     ATTRIBUTES:
         - url (str)
+        - cache_ttl (int): seconds a cached page is used without revalidation
+        - http_cache (HttpCache)
     METHODS:
+        - get_http_cache
+        - fetch_page
         - fetch_html
+        - parse_html
     """
-    def __init__(self):
-        self.url = 'https://www.google.com/'
+    def __init__(self, url='https://www.google.com/', cache_ttl=0, http_cache=None):
+        self.url = url
+        self.cache_ttl = cache_ttl
+        self.http_cache = http_cache
 
-    def fetch_html(self, uri=''):
+    def get_http_cache(self):
         """
-        DESCRIPTION: get HTML from given url
+        DESCRIPTION: get the local cache of http responses
+        INPUT: None
+        OUTPUT: http_cache (HttpCache)
+        """
+        if self.http_cache is None:
+            self.http_cache = HttpCache()
+
+        return self.http_cache
+
+    def fetch_page(self, uri=''):
+        """
+        DESCRIPTION: get the raw page from given url. The page is served from the
+                     local cache while it is younger than cache_ttl, and revalidated
+                     with a conditional GET (ETag/Last-Modified) after that
         INPUT: uri (str/optional)
-        OUTPUT: page_html (bs4)
+        OUTPUT: page (bytes)
         """
         fetch_url = self.url + uri
+        endpoint = urllib.parse.urlparse(fetch_url).netloc
+        http_cache = self.get_http_cache()
+        cache_entry = http_cache.get_entry(fetch_url)
+
+        if cache_entry and time.time() - cache_entry['fetched_at'] < self.cache_ttl:
+            METRICS.inc('http_cache_hits_total', client='html', endpoint=endpoint)
+            http_cache.touch(fetch_url)
+            return http_cache.read_body(cache_entry['digest'])
 
         user_agent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36'
         header = {'User-Agent': user_agent}
+        if cache_entry.get('etag'):
+            header['If-None-Match'] = cache_entry['etag']
+        if cache_entry.get('last_modified'):
+            header['If-Modified-Since'] = cache_entry['last_modified']
 
         request = urllib.request.Request(fetch_url, headers=header)
-        response = urllib.request.urlopen(request)
-        page_html = BeautifulSoup(response)
+        start = time.perf_counter()
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as error:
+            record_http_call('html', endpoint, error.code, time.perf_counter() - start)
+            if error.code == 304 and cache_entry:
+                http_cache.touch(fetch_url, refreshed=True)
+                return http_cache.read_body(cache_entry['digest'])
+            raise
+
+        page = response.read()
+        record_http_call('html', endpoint, 200, time.perf_counter() - start, len(page))
+        http_cache.store(
+            fetch_url,
+            page,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified')
+        )
+
+        return page
+
+    def fetch_html(self, uri='', parse_only=None):
+        """
+        DESCRIPTION: get HTML from given url
+        INPUT: uri (str/optional), parse_only (bs4.SoupStrainer/optional)
+        OUTPUT: page_html (bs4)
+        """
+        page = self.fetch_page(uri)
+        page_html = self.parse_html(page, parse_only)
+
+        return page_html
+
+    @staticmethod
+    def parse_html(page, parse_only=None):
+        """
+        DESCRIPTION: parse a raw page. When parse_only is given, only the
+                     elements it matches (and their children) are built into
+                     the tree, the rest of the page is skipped by the parser
+        INPUT: page (bytes/str), parse_only (bs4.SoupStrainer/optional)
+        OUTPUT: page_html (bs4)
+        """
+        with METRICS.timer('html_parse_seconds'):
+            page_html = BeautifulSoup(page, HTML_PARSER, parse_only=parse_only)
 
         return page_html
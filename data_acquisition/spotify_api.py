@@ -1,9 +1,21 @@
 """
 Module to handle the Spotify data aqcisition
 """
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from music_trends_constants import AUDIO_FEATURE_LIST, SPOTIFY_BACKOFF_BASE, SPOTIFY_BACKOFF_CAP, \
+    SPOTIFY_BATCH_SIZE_TABLE, SPOTIFY_MAX_RETRIES, SPOTIFY_MAX_WORKERS, SPOTIFY_RATE_LIMIT_STATE, \
+    SPOTIFY_TOKEN_EXPIRY_MARGIN, STREAMING_BATCH_SIZE
 from utilities.db_access import get_postgress_engine
+from utilities.local_cache import ArtistIdCache, PlaylistStateCache, SpotifyTokenCache, TrackEnrichmentCache
+from utilities.metrics import METRICS, record_http_call
+from utilities.rate_limiter import RateLimiter, get_backoff_seconds, parse_retry_after
+from utilities.record_batches import iter_record_batches
 
 class SpotifyAPI():
     """
@@ -11,99 +23,439 @@ class SpotifyAPI():
     ATTRIBUTES:
         - client_id (str)
         - client_secret (str)
-        - token (str)
+        - max_workers (int)
+        - session (requests.Session)
+        - artist_cache (ArtistIdCache)
+        - playlist_cache (PlaylistStateCache)
+        - enrichment_cache (TrackEnrichmentCache)
+        - token_cache (SpotifyTokenCache)
+        - rate_limiter (RateLimiter): paces every call, shared by the threads
+          and, through its state file, by the processes of a run
+        - max_retries (int)
+        - pending_playlist_states (dict)
+        - token (str): requested on first use, reused from the token cache
+          while it is valid
     METHODS:
+        - create_session
+        - get_rate_limiter
+        - send_request
+        - request
+        - get_token_cache
         - authentication
+        - get_several_playlists_data
+        - get_playlist_cache
+        - commit_playlist_states
         - get_playlist_data
-        - get_artist_data
+        - get_playlist_snapshot_state
+        - iter_playlist_track_pages
+        - iter_several_playlists_batches
+        - iter_track_records
+        - pre_process_playlist_json
+        - get_artist_cache
+        - iter_artist_records
+        - pre_process_artists_json
+        - iter_artists_responses
+        - request_artists
+        - iter_several_artists_batches
+        - get_several_artists_data
+        - get_enrichment_cache
+        - iter_several_items_responses
+        - get_album_records
+        - get_track_enrichment_record
+        - enrich_tracks
+        - get_tracks_enrichment_data
     """
 
-    def __init__(self, client_id, secret):
+    def __init__(self, client_id, secret, max_workers=SPOTIFY_MAX_WORKERS,
+                 artist_cache=None, playlist_cache=None, enrichment_cache=None, token_cache=None,
+                 rate_limiter=None, max_retries=SPOTIFY_MAX_RETRIES):
         """
         Constructor method for SpotifyAPI
         """
         self.client_id = client_id
         self.client_secret = secret
-        self.token = self.authentication()
+        self.max_workers = max_workers
+        self.artist_cache = artist_cache
+        self.playlist_cache = playlist_cache
+        self.enrichment_cache = enrichment_cache
+        self.token_cache = token_cache
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.pending_playlist_states = {}
+        self.session = self.create_session()
+        self._token = None
+
+
+    @property
+    def token(self):
+        """
+        DESCRIPTION: Access token, authenticating on first use only when the
+                     token cache has no valid token
+        INPUT: None
+        OUTPUT: token (str)
+        """
+        if self._token is None:
+            self._token = self.get_token_cache().get_token(self.client_id, SPOTIFY_TOKEN_EXPIRY_MARGIN)
+        if self._token is None:
+            self._token = self.authentication()
+
+        return self._token
+
+
+    @token.setter
+    def token(self, token):
+        self._token = token
+
+
+    def get_token_cache(self):
+        """
+        DESCRIPTION: Get the local cache of the access tokens
+        INPUT: None
+        OUTPUT: token_cache (SpotifyTokenCache)
+        """
+        if self.token_cache is None:
+            self.token_cache = SpotifyTokenCache()
+
+        return self.token_cache
+
+
+    def create_session(self):
+        """
+        DESCRIPTION: Create the keep-alive http session shared by every request,
+                     with a connection pool big enough for the concurrent fetches
+        INPUT: None
+        OUTPUT: session (requests.Session)
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max(self.max_workers, 1))
+        session.mount('https://', adapter)
+
+        return session
+
+
+    def get_rate_limiter(self):
+        """
+        DESCRIPTION: Get the rate limiter of the spotify calls
+        INPUT: None
+        OUTPUT: rate_limiter (RateLimiter)
+        """
+        if self.rate_limiter is None:
+            self.rate_limiter = RateLimiter(state_path=SPOTIFY_RATE_LIMIT_STATE)
+
+        return self.rate_limiter
+
+
+    def send_request(self, method, url, endpoint, **kwargs):
+        """
+        DESCRIPTION: Send one request through the shared session once the rate
+                     limiter allows it, recording its status, latency and size
+                     in the run metrics
+        INPUT: method (str), url (str), endpoint (str), kwargs (keyword args of requests)
+        OUTPUT: response (requests.Response)
+        """
+        self.get_rate_limiter().acquire()
+        start = time.perf_counter()
+        try:
+            response = getattr(self.session, method)(url, **kwargs)
+        except requests.ConnectionError:
+            record_http_call('spotify', endpoint, 'connection_error', time.perf_counter() - start)
+            raise
+
+        record_http_call(
+            'spotify',
+            endpoint,
+            response.status_code,
+            time.perf_counter() - start,
+            int(response.headers.get('Content-Length') or 0)
+        )
+
+        return response
+
+
+    def request(self, method, url, **kwargs):
+        """
+        DESCRIPTION: Send a request, paced by the rate limiter, and retry it when
+                     spotify throttles (429, honoring Retry-After and slowing the
+                     rate down), fails (5xx, connection errors, with jittered
+                     backoff) or rejects an expired token (401, once, with a new
+                     token). The endpoint label of the metrics drops the ids from
+                     the path (e.g. playlists/tracks)
+        INPUT: method (str), url (str), kwargs (keyword args of requests)
+        OUTPUT: response (requests.Response), the last one when the retries run out
+        """
+        path_part_list = urlparse(url).path.strip('/').split('/')
+        if path_part_list[0] in ('v1', 'api'):
+            path_part_list = path_part_list[1:]
+        endpoint = '/'.join(path_part_list[0::2])
+        rate_limiter = self.get_rate_limiter()
+        has_token = 'Authorization' in (kwargs.get('headers') or {})
+        token_refreshed = False
+
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            if has_token:
+                # the token may have been refreshed since the headers were built
+                kwargs['headers'] = dict(kwargs['headers'], Authorization='Bearer {0}'.format(self.token))
+            try:
+                response = self.send_request(method, url, endpoint, **kwargs)
+            except requests.ConnectionError:
+                if is_last_attempt:
+                    raise
+                METRICS.inc('retries_total', client='spotify', endpoint=endpoint, reason='connection_error')
+                time.sleep(get_backoff_seconds(attempt, SPOTIFY_BACKOFF_BASE, SPOTIFY_BACKOFF_CAP))
+                continue
+
+            if response.status_code == 429:
+                retry_after = parse_retry_after(
+                    response.headers.get('Retry-After'),
+                    get_backoff_seconds(attempt, SPOTIFY_BACKOFF_BASE, SPOTIFY_BACKOFF_CAP)
+                )
+                rate_limiter.on_throttle(retry_after)
+                reason = '429'
+            elif response.status_code == 401 and has_token and not token_refreshed:
+                self.token = self.authentication()
+                token_refreshed = True
+                reason = '401'
+            elif response.status_code >= 500:
+                if not is_last_attempt:
+                    time.sleep(get_backoff_seconds(attempt, SPOTIFY_BACKOFF_BASE, SPOTIFY_BACKOFF_CAP))
+                reason = str(response.status_code)
+            else:
+                if response.status_code < 400:
+                    rate_limiter.on_success()
+                return response
+
+            if is_last_attempt:
+                break
+            METRICS.inc('retries_total', client='spotify', endpoint=endpoint, reason=reason)
+
+        return response
 
 
     def authentication(self):
         """
-        DESCRIPTION: Method to handle the authentication with Spotify API
+        DESCRIPTION: Method to handle the authentication with Spotify API. A
+                     valid token is stored in the token cache until it expires
         INPUT: None
         OUTPUT: token (str)
         """
         grant_type = 'client_credentials'
         body_params = {'grant_type': grant_type}
         auth_url = 'https://accounts.spotify.com/api/token'
-        response = requests.post(
+        response = self.request(
+            'post',
             auth_url,
             data=body_params,
             auth=(self.client_id, self.client_secret)
         )
         try:
-            token = response.json()['access_token']
+            token_json = response.json()
+            token = token_json['access_token']
         except KeyError:
-            token = ''
+            return ''
+
+        self.get_token_cache().set_token(self.client_id, token, token_json.get('expires_in', 3600))
 
         return token
 
 
-    def get_several_playlists_data(self, playlists_table):
+    def get_several_playlists_data(self, playlists_table, max_workers=None):
         """
-        DESCRIPTION: Use the method get_playlist_data to get several playlists data
-        INPUT: playlists_table (dict)
+        DESCRIPTION: Use the method get_playlist_data to get several playlists data.
+                     The playlists are fetched concurrently by a pool of threads
+                     sharing the same http session. Only the playlists that
+                     changed since the last run are returned.
+        INPUT: playlists_table (dict), max_workers (int/optional)
         OUTPUT: several_playlists_json_response
         """
+        if max_workers is None:
+            max_workers = self.max_workers
+
         several_playlists_json_response = {}
 
-        for playlist_name, playlist_id in playlists_table.items():
-            playlist_info = {
-                'playlist_id': playlist_id,
-                'playlist_name': playlist_name
-            }
-            this_playlist_data = self.get_playlist_data(playlist_info)
-            several_playlists_json_response.update(this_playlist_data)
+        playlist_info_list = [
+            {'playlist_id': playlist_id, 'playlist_name': playlist_name}
+            for playlist_name, playlist_id in playlists_table.items()
+        ]
+
+        self.get_playlist_cache()
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            for this_playlist_data in executor.map(self.get_playlist_data, playlist_info_list):
+                several_playlists_json_response.update(this_playlist_data)
 
         return several_playlists_json_response
 
 
+    def get_playlist_cache(self):
+        """
+        DESCRIPTION: Get the local cache with the last processed state of each playlist
+        INPUT: None
+        OUTPUT: playlist_cache (PlaylistStateCache)
+        """
+        if self.playlist_cache is None:
+            self.playlist_cache = PlaylistStateCache()
+
+        return self.playlist_cache
+
+
+    def commit_playlist_states(self):
+        """
+        DESCRIPTION: Store the states of the playlists fetched in this run, so the
+                     next run skips them while they do not change. It should be
+                     called once the playlists data is safely stored.
+        INPUT: None
+        OUTPUT: None
+        """
+        if self.pending_playlist_states:
+            self.get_playlist_cache().set_states(self.pending_playlist_states)
+            self.pending_playlist_states = {}
+
+
     def get_playlist_data(self, playlist_info):
         """
-        DESCRIPTION: Method to fetch playlist data from Spotify API
+        DESCRIPTION: Method to fetch playlist data from Spotify API. A light request
+                     for the playlist snapshot_id (with the cached ETag) is done first,
+                     and the full playlist is only fetched when it has changed.
         INPUT: playlist_info (dict)
-        OUTPUT: playlist_json_response (json/dict)
+        OUTPUT: playlist_json_response (json/dict), empty if the playlist is unchanged
         """
-        playlist_id = playlist_info['playlist_id']
-        playlist_name = playlist_info['playlist_name']
+        new_playlist_state = self.get_playlist_snapshot_state(playlist_info)
+        if new_playlist_state is None:
+            return {}
+
+        track_record_list = []
+        for page_record_list in self.iter_playlist_track_pages(playlist_info, new_playlist_state):
+            track_record_list += page_record_list
+
+        return {playlist_info['playlist_name']: track_record_list}
+
 
+    def get_playlist_snapshot_state(self, playlist_info):
+        """
+        DESCRIPTION: Check with a light request (snapshot_id and the cached ETag)
+                     whether the playlist changed since the last run
+        INPUT: playlist_info (dict)
+        OUTPUT: new_playlist_state (dict), None if the playlist is unchanged
+        """
+        playlist_id = playlist_info['playlist_id']
         playlist_url = 'https://api.spotify.com/v1/playlists/{0}'.format(playlist_id)
         headers = {'Authorization': 'Bearer {0}'.format(self.token)}
 
-        playlist_response = requests.get(playlist_url, headers=headers)
-        playlist_raw_json_response = playlist_response.json()
+        playlist_state = self.get_playlist_cache().get_state(playlist_id)
+        if playlist_state.get('etag'):
+            headers['If-None-Match'] = playlist_state['etag']
 
-        playlist_json_response = self.pre_process_playlist_json(
-            playlist_raw_json_response,
-            playlist_name
+        snapshot_response = self.request(
+            'get',
+            playlist_url,
+            headers=headers,
+            params={'fields': 'snapshot_id'}
         )
+        if snapshot_response.status_code == 304:
+            return None
 
-        return playlist_json_response
+        snapshot_id = snapshot_response.json().get('snapshot_id')
+        new_playlist_state = {
+            'snapshot_id': snapshot_id,
+            'etag': snapshot_response.headers.get('ETag'),
+        }
+        if snapshot_id is not None and snapshot_id == playlist_state.get('snapshot_id'):
+            self.pending_playlist_states[playlist_id] = new_playlist_state
+            return None
 
+        return new_playlist_state
 
-    def pre_process_playlist_json(self, raw_playlist_json, playlist_name):
+
+    def iter_playlist_track_pages(self, playlist_info, new_playlist_state):
         """
-        DESCRIPTION: Extract data from raw api reponse and put in json format
-        INPUT: raw_playlist_json (json)
-        OUTPUT: playlist_info (json)
+        DESCRIPTION: Generator over the pages of a playlist, following the
+                     tracks.next links. Each page is turned into track records as
+                     soon as it arrives, so only one page is held at a time. The
+                     playlist state is marked to commit once the last page is read.
+        INPUT: playlist_info (dict), new_playlist_state (dict)
+        OUTPUT: page_record_list (generator of lists of dicts)
+        """
+        playlist_id = playlist_info['playlist_id']
+        playlist_url = 'https://api.spotify.com/v1/playlists/{0}'.format(playlist_id)
+        headers = {'Authorization': 'Bearer {0}'.format(self.token)}
+
+        playlist_response = self.request('get', playlist_url, headers=headers)
+        playlist_raw_json_response = playlist_response.json()
+        tracks_page = playlist_raw_json_response['tracks']
+
+        position_offset = 0
+        while True:
+            track_item_list = tracks_page['items']
+            yield list(self.iter_track_records(track_item_list, playlist_id, position_offset))
+            position_offset += len(track_item_list)
+
+            next_url = tracks_page.get('next')
+            if not next_url:
+                break
+            tracks_page = self.request('get', next_url, headers=headers).json()
+
+        new_playlist_state = dict(new_playlist_state)
+        new_playlist_state['snapshot_id'] = playlist_raw_json_response.get(
+            'snapshot_id', new_playlist_state['snapshot_id']
+        )
+        self.pending_playlist_states[playlist_id] = new_playlist_state
+
+
+    def iter_several_playlists_batches(self, playlists_table, batch_size=STREAMING_BATCH_SIZE,
+                                       max_workers=None):
+        """
+        DESCRIPTION: Streaming version of get_several_playlists_data. The next
+                     max_workers playlists are fetched concurrently by a pool of
+                     threads while the current one is consumed, and their tracks
+                     are yielded in the order of playlists_table, in record
+                     batches of at most batch_size, so memory grows with the
+                     number of playlists in flight, not with the whole table.
+        INPUT: playlists_table (dict), batch_size (int/optional), max_workers (int/optional)
+        OUTPUT: (playlist_name, record_batch) (generator of tuples)
         """
-        playlist_info = {playlist_name: []}
+        if max_workers is None:
+            max_workers = self.max_workers
+        max_workers = max(max_workers, 1)
+
+        playlist_info_iter = iter([
+            {'playlist_id': playlist_id, 'playlist_name': playlist_name}
+            for playlist_name, playlist_id in playlists_table.items()
+        ])
 
-        for index, track in enumerate(raw_playlist_json['tracks']['items']):
+        self.get_playlist_cache()
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            future_queue = deque(
+                executor.submit(self.get_playlist_data, x) for x in itertools.islice(playlist_info_iter, max_workers)
+            )
+            while future_queue:
+                this_playlist_data = future_queue.popleft().result()
+                for playlist_info in itertools.islice(playlist_info_iter, 1):
+                    future_queue.append(executor.submit(self.get_playlist_data, playlist_info))
+
+                for playlist_name, track_record_list in this_playlist_data.items():
+                    for record_batch in iter_record_batches(track_record_list, batch_size):
+                        yield playlist_name, record_batch
+        finally:
+            # a consumer stopping early does not wait for the playlists not started
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+    def iter_track_records(self, track_item_list, playlist_id, position_offset=0):
+        """
+        DESCRIPTION: Generator extracting the track records of a page of playlist items
+        INPUT: track_item_list (list), playlist_id (str), position_offset (int/optional)
+        OUTPUT: track_info_pick (generator of dicts)
+        """
+        for index, track in enumerate(track_item_list, start=position_offset + 1):
             track_info = track['track']
+            if not track_info:
+                # tracks removed from Spotify come as null, keep the others positions
+                continue
 
-            track_info_pick = {
-                'playlist_id_id': raw_playlist_json['id'],
+            yield {
+                'playlist_id_id': playlist_id,
+                'track_id': track_info.get('id'),
                 'main_artist_id_id': track_info['album']['artists'][0]['id'],
                 'all_artists': '*'.join([info['name'] for info in track_info['artists']]),
                 'all_artists_ids': '*'.join([info['id'] for info in track_info['artists']]),
@@ -111,35 +463,51 @@ class SpotifyAPI():
                 'duration': track_info['duration_ms'],
                 'song_name': track_info['name'],
                 'popularity': track_info['popularity'],
-                'position': index + 1,
+                'position': index,
             }
 
-            playlist_info[playlist_name].append(track_info_pick)
-
-        return playlist_info
 
-    def get_artists_ids_from_db(self):
+    def pre_process_playlist_json(self, raw_playlist_json, playlist_name):
         """
+        DESCRIPTION: Extract data from raw api reponse and put in json format
+        INPUT: raw_playlist_json (json)
+        OUTPUT: playlist_info (json)
+        """
+        return {
+            playlist_name: list(self.iter_track_records(
+                raw_playlist_json['tracks']['items'],
+                raw_playlist_json['id']
+            ))
+        }
+
+    def get_artist_cache(self):
         """
-        engine = get_postgress_engine()
-        query = """
-            select distinct artist_id
-            from tendencias_musicais_app_artists
+        DESCRIPTION: Get the local cache of known artist ids, synced with the
+                     rows added to the database since the last sync
+        INPUT: None
+        OUTPUT: artist_cache (ArtistIdCache)
         """
-        artist_ids_df = pd.read_sql_query(query, engine)
-        artist_ids_list = artist_ids_df['artist_id'].to_list()
-        return artist_ids_list
+        if self.artist_cache is None:
+            self.artist_cache = ArtistIdCache()
 
+        self.artist_cache.sync_from_db(get_postgress_engine())
 
-    def pre_process_artists_json(self, artists_response_list):
+        return self.artist_cache
+
+
+    def iter_artist_records(self, artists_response_list):
         """
+        DESCRIPTION: Generator extracting the artist records of an artists response
+        INPUT: artists_response_list (list)
+        OUTPUT: artists_info_pick (generator of dicts)
         """
-        artists_info = {'artists': []}
-
         for artist_data in artists_response_list:
+            if not artist_data:
+                continue
+
             genres = artist_data['genres']
             genres = genres + [''] * 3
-            artists_info_pick = {
+            yield {
                 'artist_id': artist_data['id'],
                 'name': artist_data['name'],
                 'music_genre_1': genres[0],
@@ -147,9 +515,74 @@ class SpotifyAPI():
                 'music_genre_3': genres[2]
             }
 
-            artists_info['artists'].append(artists_info_pick)
 
-        return artists_info
+    def pre_process_artists_json(self, artists_response_list):
+        """
+        DESCRIPTION: Extract the artists data from the raw api responses
+        INPUT: artists_response_list (list)
+        OUTPUT: artists_info (json/dict)
+        """
+        return {'artists': list(self.iter_artist_records(artists_response_list))}
+
+
+    def iter_artists_responses(self, spotify_artist_ids):
+        """
+        DESCRIPTION: Generator over the raw artists of the ids not known yet,
+                     requested 50 at a time (the limit of the several artists
+                     endpoint). The ids are checked against the cache by chunks
+                     and the unknown ones are buffered, so each request is full
+                     however spread out the unknown ids are
+        INPUT: spotify_artist_ids (iterable)
+        OUTPUT: artists_response_list (generator of lists)
+        """
+        artist_cache = self.get_artist_cache()
+        batch_size = SPOTIFY_BATCH_SIZE_TABLE['artists']
+
+        new_artist_list = []
+        seen_artist_set = set()
+        for ids_sublist in iter_record_batches(spotify_artist_ids, artist_cache.lookup_chunk_size):
+            for artist_id in artist_cache.filter_unknown(ids_sublist):
+                if artist_id not in seen_artist_set:
+                    seen_artist_set.add(artist_id)
+                    new_artist_list.append(artist_id)
+
+            while len(new_artist_list) >= batch_size:
+                yield self.request_artists(new_artist_list[:batch_size])
+                new_artist_list = new_artist_list[batch_size:]
+
+        if new_artist_list:
+            yield self.request_artists(new_artist_list)
+
+
+    def request_artists(self, artist_id_list):
+        """
+        DESCRIPTION: Request the several artists endpoint for up to 50 ids
+        INPUT: artist_id_list (list)
+        OUTPUT: artists_response_list (list)
+        """
+        headers = {'Authorization': 'Bearer {0}'.format(self.token)}
+        artists_url = 'https://api.spotify.com/v1/artists/?ids={0}'.format(','.join(artist_id_list))
+        artists_response = self.request('get', artists_url, headers=headers)
+        # still failing once the retries ran out
+        artists_response.raise_for_status()
+
+        return artists_response.json()['artists']
+
+
+    def iter_several_artists_batches(self, spotify_artist_ids, batch_size=STREAMING_BATCH_SIZE):
+        """
+        DESCRIPTION: Streaming version of get_several_artists_data, yielding the
+                     artist records in batches of at most batch_size
+        INPUT: spotify_artist_ids (iterable), batch_size (int/optional)
+        OUTPUT: record_batch (generator of lists of dicts)
+        """
+        artist_records = (
+            artist_record
+            for artists_response_list in self.iter_artists_responses(spotify_artist_ids)
+            for artist_record in self.iter_artist_records(artists_response_list)
+        )
+
+        return iter_record_batches(artist_records, batch_size)
 
 
     def get_several_artists_data(self, spotify_artist_list):
@@ -158,28 +591,168 @@ class SpotifyAPI():
         INPUT: artist_id_list (list)
         OUTPUT: artists_json_response (json/dict)
         """
-        def chunks(lst, n):
-            """Yield successive n-sized chunks from lst."""
-            for i in range(0, len(lst), n):
-                yield lst[i:i + n]
-
-        db_artist_list = self.get_artists_ids_from_db()
-        new_artist_list = [id for id in spotify_artist_list if id not in db_artist_list]
-
         artists_response_list = []
-        for ids_sublist in chunks(new_artist_list, 50):
-            artists_parameter = ','.join(ids_sublist)
-            artists_url = 'https://api.spotify.com/v1/artists/?ids={0}'.format(artists_parameter)
-            headers = {'Authorization': 'Bearer {0}'.format(self.token)}
-            artists_response = requests.get(artists_url, headers=headers)
-            artists_json_response = artists_response.json()
-            artists_response_list += artists_json_response['artists']
+        for this_response_list in self.iter_artists_responses(spotify_artist_list):
+            artists_response_list += this_response_list
 
         artists_json_response = self.pre_process_artists_json(artists_response_list)
 
         return artists_json_response
 
 
+    def get_enrichment_cache(self):
+        """
+        DESCRIPTION: Get the local cache of the tracks and albums already enriched
+        INPUT: None
+        OUTPUT: enrichment_cache (TrackEnrichmentCache)
+        """
+        if self.enrichment_cache is None:
+            self.enrichment_cache = TrackEnrichmentCache()
+
+        return self.enrichment_cache
+
+
+    def iter_several_items_responses(self, endpoint, id_list):
+        """
+        DESCRIPTION: Generator over the items of a several-items endpoint (tracks,
+                     albums, audio-features), requested at the maximum number of
+                     ids per request of the endpoint
+        INPUT: endpoint (str), id_list (list)
+        OUTPUT: (ids_sublist, item_list) (generator of tuples, an item is None
+                when spotify has no data for its id, item_list is None when
+                the request failed)
+        """
+        headers = {'Authorization': 'Bearer {0}'.format(self.token)}
+        response_key = endpoint.replace('-', '_')
+
+        for ids_sublist in iter_record_batches(id_list, SPOTIFY_BATCH_SIZE_TABLE[endpoint]):
+            items_url = 'https://api.spotify.com/v1/{0}?ids={1}'.format(endpoint, ','.join(ids_sublist))
+            items_response = self.request('get', items_url, headers=headers)
+            if items_response.status_code != 200:
+                yield ids_sublist, None
+                continue
+
+            yield ids_sublist, items_response.json()[response_key]
+
+
+    def get_album_records(self, album_id_list):
+        """
+        DESCRIPTION: Get the metadata of several albums, fetching only the ones
+                     not in the enrichment cache. The albums spotify has no data
+                     for are stored empty, the ones of a failed request are not
+                     stored, so they are asked again on the next call
+        INPUT: album_id_list (list)
+        OUTPUT: album_record_table (dict of dicts keyed by album id, without
+                the albums of the failed requests)
+        """
+        enrichment_cache = self.get_enrichment_cache()
+        new_album_list = enrichment_cache.filter_unknown(album_id_list, 'album_enrichment')
+
+        new_album_table = {}
+        for ids_sublist, album_list in self.iter_several_items_responses('albums', new_album_list):
+            if album_list is None:
+                continue
+
+            for album_id, album_data in zip(ids_sublist, album_list):
+                if not album_data:
+                    new_album_table[album_id] = {}
+                    continue
+
+                new_album_table[album_id] = {
+                    'album_name': album_data.get('name'),
+                    'album_type': album_data.get('album_type'),
+                    'album_label': album_data.get('label'),
+                    'album_popularity': album_data.get('popularity'),
+                    'album_total_tracks': album_data.get('total_tracks'),
+                    'album_genres': '*'.join(album_data.get('genres') or []),
+                }
+        enrichment_cache.add_records(new_album_table, 'album_enrichment')
+
+        return enrichment_cache.get_records(album_id_list, 'album_enrichment')
+
+
+    def get_track_enrichment_record(self, track_data, album_record, audio_features):
+        """
+        DESCRIPTION: Build the enrichment record of a track
+        INPUT: track_data (dict), album_record (dict), audio_features (dict or None)
+        OUTPUT: track_record (dict)
+        """
+        album_data = track_data.get('album') or {}
+        track_record = {
+            'isrc': (track_data.get('external_ids') or {}).get('isrc'),
+            'explicit': track_data.get('explicit'),
+            'album_id': album_data.get('id'),
+            'album_release_date': album_data.get('release_date'),
+            'album_release_date_precision': album_data.get('release_date_precision'),
+        }
+        track_record.update(album_record)
+        for feature in AUDIO_FEATURE_LIST:
+            track_record[feature] = (audio_features or {}).get(feature)
+
+        return track_record
+
+
+    def enrich_tracks(self, track_id_list):
+        """
+        DESCRIPTION: Fetch the tracks not enriched yet through the several tracks,
+                     albums and audio features endpoints, at their maximum batch
+                     size, and store them in the enrichment cache. Known tracks
+                     (and albums) cost no request. A track is stored only when
+                     its tracks, audio features and album requests succeeded,
+                     so the tracks of a failed request are fetched again on the
+                     next call
+        INPUT: track_id_list (list)
+        OUTPUT: n_new_tracks (int)
+        """
+        track_id_list = [x for x in track_id_list if isinstance(x, str) and x]
+        new_track_list = self.get_enrichment_cache().filter_unknown(track_id_list)
+        if not new_track_list:
+            return 0
+
+        # the tracks spotify has no data for are stored empty, so they are not asked again
+        track_data_table = {}
+        for ids_sublist, track_list in self.iter_several_items_responses('tracks', new_track_list):
+            if track_list is not None:
+                track_data_table.update((track_id, x or {}) for track_id, x in zip(ids_sublist, track_list))
+
+        audio_features_table = {}
+        failed_track_set = set()
+        for ids_sublist, audio_features_list in self.iter_several_items_responses(
+                'audio-features', [key for key, value in track_data_table.items() if value]):
+            if audio_features_list is None:
+                failed_track_set.update(ids_sublist)
+            else:
+                audio_features_table.update(zip(ids_sublist, audio_features_list))
+
+        album_record_table = self.get_album_records([
+            x['album']['id'] for x in track_data_table.values() if (x.get('album') or {}).get('id')
+        ])
+
+        track_record_table = {}
+        for track_id, track_data in track_data_table.items():
+            album_id = (track_data.get('album') or {}).get('id')
+            if track_id in failed_track_set or (album_id and album_id not in album_record_table):
+                continue
+
+            track_record_table[track_id] = self.get_track_enrichment_record(
+                track_data, album_record_table.get(album_id, {}), audio_features_table.get(track_id)
+            )
+        self.get_enrichment_cache().add_records(track_record_table)
+
+        return len(track_record_table)
+
+
+    def get_tracks_enrichment_data(self, track_id_list):
+        """
+        DESCRIPTION: Get the enrichment of several tracks from the cache
+        INPUT: track_id_list (list)
+        OUTPUT: tracks_info (json/dict)
+        """
+        record_table = self.get_enrichment_cache().get_records(track_id_list)
+
+        return {'tracks': [dict(track_id=key, **value) for key, value in record_table.items()]}
+
+
 if __name__ == '__main__':
     spotify_api = SpotifyAPI('', '')
     playlist_data = spotify_api.get_playlist_data('37i9dQZEVXbLRQDuF5jeBp')
@@ -1,10 +1,93 @@
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-from spotify_api import SpotifyAPI
+from data_acquisition.spotify_api import SpotifyAPI
+from utilities.local_cache import ArtistIdCache, PlaylistStateCache, SpotifyTokenCache, TrackEnrichmentCache
+from utilities.metrics import METRICS
+from utilities.rate_limiter import RateLimiter
+
+
+def fake_playlist_json(playlist_id):
+    track = {
+        'track': {
+            'album': {'artists': [{'id': 'artist_1'}], 'release_date': '2020-01-01'},
+            'artists': [{'name': 'Artist One', 'id': 'artist_1'}],
+            'duration_ms': 180000,
+            'name': 'Song of {0}'.format(playlist_id),
+            'popularity': 90,
+        }
+    }
+    return {'id': playlist_id, 'snapshot_id': 'snap_1', 'tracks': {'items': [track, track]}}
+
+
+def fake_response(json_data, status_code=200, etag='"etag_1"'):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = {'ETag': etag}
+    response.json.return_value = json_data
+    return response
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """
+    Mock of the spotify api: at most `rate` calls per second (429 with a
+    Retry-After beyond), and 401 for any token but `valid_token`
+    """
+    rate = 20
+    valid_token = 'token'
+    lock = threading.Lock()
+    call_time_list = []
+    status_list = []
+
+    def do_GET(self):
+        with self.lock:
+            now = time.perf_counter()
+            recent_call_list = [x for x in self.call_time_list if now - x < 1]
+            if self.headers.get('Authorization') != 'Bearer {0}'.format(self.valid_token):
+                status = 401
+            elif len(recent_call_list) >= self.rate:
+                status = 429
+            else:
+                status = 200
+                self.call_time_list.append(now)
+            self.status_list.append(status)
+
+        body = json.dumps({'artists': []}).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0.2')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
 
 
 class TestSpotifyAPI(unittest.TestCase):
 
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.playlist_cache = PlaylistStateCache(os.path.join(self.tmp_dir.name, 'cache.sqlite3'))
+        self.spotify_api = SpotifyAPI(
+            '', '', max_workers=4, playlist_cache=self.playlist_cache,
+            rate_limiter=RateLimiter(rate=1000, capacity=1000, max_rate=1000)
+        )
+        self.spotify_api.token = 'token'
+
+    def tearDown(self):
+        self.playlist_cache.connection.close()
+        if self.spotify_api.enrichment_cache is not None:
+            self.spotify_api.enrichment_cache.connection.close()
+        self.tmp_dir.cleanup()
+
     def test_authentication_bad_credentials(self):
         spotify_api = SpotifyAPI('', '')
         received_token = spotify_api.authentication()
@@ -12,6 +95,254 @@ class TestSpotifyAPI(unittest.TestCase):
 
         self.assertEqual(received_token, expected_token)
 
+    def test_lazy_authentication_with_token_cache(self):
+        token_cache = SpotifyTokenCache(os.path.join(self.tmp_dir.name, 'cache.sqlite3'))
+        token_response = fake_response({'access_token': 'token_1', 'expires_in': 3600})
+        with mock.patch('requests.Session.post', return_value=token_response) as session_post:
+            spotify_api = SpotifyAPI('client', '', token_cache=token_cache)
+            self.assertEqual(session_post.call_count, 0)
+            self.assertEqual(spotify_api.token, 'token_1')
+            self.assertEqual(spotify_api.token, 'token_1')
+            # another process reuses the cached token
+            self.assertEqual(SpotifyAPI('client', '', token_cache=token_cache).token, 'token_1')
+            self.assertEqual(session_post.call_count, 1)
+
+        token_cache.set_token('client', 'token_2', 30)
+        with mock.patch('requests.Session.post', return_value=token_response) as session_post:
+            # a token about to expire is not used
+            self.assertEqual(SpotifyAPI('client', '', token_cache=token_cache).token, 'token_1')
+            self.assertEqual(session_post.call_count, 1)
+        token_cache.connection.close()
+
+    def start_mock_server(self):
+        ThrottlingHandler.call_time_list = []
+        ThrottlingHandler.status_list = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottlingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        return 'http://127.0.0.1:{0}/v1/artists?ids=artist_1'.format(server.server_address[1])
+
+    def test_rate_limited_against_throttling_server(self):
+        url = self.start_mock_server()
+        METRICS.reset()
+        # starts above the server limit and has to adapt to it
+        self.spotify_api.rate_limiter = RateLimiter(rate=40, capacity=5, min_rate=2, max_rate=40)
+
+        headers = {'Authorization': 'Bearer token'}
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            response_list = list(executor.map(
+                lambda _: self.spotify_api.request('get', url, headers=headers), range(40)
+            ))
+
+        self.assertEqual([x.status_code for x in response_list], [200] * 40)
+        n_throttled = ThrottlingHandler.status_list.count(429)
+        self.assertGreater(n_throttled, 0)
+        self.assertLess(n_throttled, 20)
+        retries = [x for x in METRICS.get_report()['counters'] if x['name'] == 'retries_total']
+        self.assertEqual(sum(x['value'] for x in retries), n_throttled)
+        self.assertLess(self.spotify_api.rate_limiter.get_rate(), 40)
+
+    def test_token_refreshed_on_401(self):
+        url = self.start_mock_server()
+        self.spotify_api.token = 'expired'
+        with mock.patch.object(SpotifyAPI, 'authentication', return_value='token') as authentication:
+            response = self.spotify_api.request('get', url, headers={'Authorization': 'Bearer expired'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.spotify_api.token, 'token')
+
+            ThrottlingHandler.valid_token = 'other'
+            self.assertEqual(self.spotify_api.request('get', url, headers={}).status_code, 401)
+            ThrottlingHandler.valid_token = 'token'
+
+        self.assertEqual(authentication.call_count, 1)
+        self.assertEqual(ThrottlingHandler.status_list, [401, 200, 401])
+
+    def test_get_several_playlists_data_concurrent(self):
+        def fake_get(url, headers=None, params=None):
+            if params:
+                return fake_response({'snapshot_id': 'snap_1'})
+            return fake_response(fake_playlist_json(url.rsplit('/', 1)[-1]))
+
+        playlists_table = {'playlist_{0}'.format(i): 'id_{0}'.format(i) for i in range(20)}
+        with mock.patch.object(self.spotify_api.session, 'get', side_effect=fake_get) as session_get:
+            received = self.spotify_api.get_several_playlists_data(playlists_table)
+
+        self.assertEqual(session_get.call_count, 40)
+        self.assertEqual(list(received.keys()), list(playlists_table.keys()))
+        self.assertEqual(received['playlist_7'][1]['playlist_id_id'], 'id_7')
+        self.assertEqual(received['playlist_7'][1]['position'], 2)
+
+    def test_unchanged_playlist_is_skipped(self):
+        self.playlist_cache.set_states({'id_1': {'snapshot_id': 'snap_1', 'etag': '"etag_1"'}})
+        playlist_info = {'playlist_id': 'id_1', 'playlist_name': 'playlist_1'}
+
+        not_modified = fake_response({}, status_code=304)
+        with mock.patch.object(self.spotify_api.session, 'get', return_value=not_modified) as session_get:
+            self.assertEqual(self.spotify_api.get_playlist_data(playlist_info), {})
+        self.assertEqual(session_get.call_args[1]['headers']['If-None-Match'], '"etag_1"')
+
+        same_snapshot = fake_response({'snapshot_id': 'snap_1'}, etag='"etag_2"')
+        with mock.patch.object(self.spotify_api.session, 'get', return_value=same_snapshot) as session_get:
+            self.assertEqual(self.spotify_api.get_playlist_data(playlist_info), {})
+        self.assertEqual(session_get.call_count, 1)
+
+    def test_playlist_pagination(self):
+        first_page = fake_playlist_json('id_1')
+        first_page['tracks']['next'] = 'https://api.spotify.com/next_page'
+        second_page = {'items': fake_playlist_json('id_1')['tracks']['items'], 'next': None}
+        responses = [
+            fake_response({'snapshot_id': 'snap_2'}),
+            fake_response(first_page),
+            fake_response(second_page),
+        ]
+        playlist_info = {'playlist_id': 'id_1', 'playlist_name': 'playlist_1'}
+        with mock.patch.object(self.spotify_api.session, 'get', side_effect=responses):
+            received = self.spotify_api.get_playlist_data(playlist_info)
+
+        self.assertEqual([x['position'] for x in received['playlist_1']], [1, 2, 3, 4])
+
+        self.spotify_api.commit_playlist_states()
+        self.assertEqual(self.playlist_cache.get_state('id_1')['snapshot_id'], 'snap_1')
+
+    def test_playlists_streamed_in_batches(self):
+        first_page = fake_playlist_json('id_1')
+        first_page['tracks']['next'] = 'https://api.spotify.com/next_page'
+        second_page = {'items': fake_playlist_json('id_1')['tracks']['items'] * 2, 'next': None}
+        responses = [
+            fake_response({'snapshot_id': 'snap_2'}),
+            fake_response(first_page),
+            fake_response(second_page),
+        ]
+        with mock.patch.object(self.spotify_api.session, 'get', side_effect=responses):
+            received = list(self.spotify_api.iter_several_playlists_batches({'playlist_1': 'id_1'}, 4))
+
+        self.assertEqual([len(batch) for _, batch in received], [4, 2])
+        self.assertEqual([x['position'] for x in received[1][1]], [5, 6])
+        self.assertIn('id_1', self.spotify_api.pending_playlist_states)
+
+    def test_playlists_streamed_with_bounded_prefetch(self):
+        lock = threading.Lock()
+        in_flight_list = [0, 0]
+
+        def fake_get(url, headers=None, params=None):
+            with lock:
+                in_flight_list[0] += 1
+                in_flight_list[1] = max(in_flight_list)
+            # the first playlists are the slowest, so the next ones finish first
+            time.sleep(0.05 if url.endswith(('id_0', 'id_1')) else 0.01)
+            with lock:
+                in_flight_list[0] -= 1
+            if params:
+                return fake_response({'snapshot_id': 'snap_1'})
+            return fake_response(fake_playlist_json(url.rsplit('/', 1)[-1]))
+
+        playlists_table = {'playlist_{0}'.format(i): 'id_{0}'.format(i) for i in range(12)}
+        with mock.patch.object(self.spotify_api.session, 'get', side_effect=fake_get) as session_get:
+            received = list(self.spotify_api.iter_several_playlists_batches(playlists_table, 10, max_workers=3))
+
+        self.assertEqual([playlist_name for playlist_name, _ in received], list(playlists_table))
+        self.assertEqual(received[5][1][0]['playlist_id_id'], 'id_5')
+        self.assertEqual(session_get.call_count, 24)
+        self.assertGreater(in_flight_list[1], 1)
+        self.assertLessEqual(in_flight_list[1], 3)
+
+    def test_unknown_artists_packed_in_full_requests(self):
+        artist_cache = ArtistIdCache(os.path.join(self.tmp_dir.name, 'cache.sqlite3'))
+        self.addCleanup(artist_cache.connection.close)
+        artist_id_list = ['artist_{0}'.format(i) for i in range(500)]
+        # one unknown artist in every 25, spread across all the chunks of 50
+        unknown_artist_list = artist_id_list[::25]
+        artist_cache.add_artist_ids([x for x in artist_id_list if x not in unknown_artist_list])
+
+        def fake_get(url, headers=None):
+            id_list = url.split('?ids=')[1].split(',')
+            return fake_response({'artists': [{'id': x, 'name': x, 'genres': []} for x in id_list]})
+
+        with mock.patch.object(self.spotify_api, 'get_artist_cache', return_value=artist_cache), \
+                mock.patch.object(self.spotify_api.session, 'get', side_effect=fake_get) as session_get:
+            response_list = list(self.spotify_api.iter_artists_responses(artist_id_list + unknown_artist_list))
+
+        self.assertEqual(session_get.call_count, 1)
+        self.assertEqual([x['id'] for x in response_list[0]], unknown_artist_list)
+
+        artist_cache.execute('delete from artist_ids', [()])
+        with mock.patch.object(self.spotify_api, 'get_artist_cache', return_value=artist_cache), \
+                mock.patch.object(self.spotify_api.session, 'get', side_effect=fake_get) as session_get:
+            response_list = list(self.spotify_api.iter_artists_responses(iter(artist_id_list[:120])))
+
+        self.assertEqual([len(x) for x in response_list], [50, 50, 20])
+
+    def test_tracks_enriched_once(self):
+        self.spotify_api.enrichment_cache = TrackEnrichmentCache(os.path.join(self.tmp_dir.name, 'cache.sqlite3'))
+        track_id_list = ['track_{0}'.format(i) for i in range(120)]
+
+        def fake_get(url, headers=None):
+            endpoint, ids = url.split('/v1/')[1].split('?ids=')
+            id_list = ids.split(',')
+            if endpoint == 'tracks':
+                items = [
+                    {'id': x, 'explicit': False, 'external_ids': {'isrc': 'isrc_' + x},
+                     'album': {'id': 'album_1', 'release_date': '2020-01-01'}}
+                    for x in id_list
+                ]
+            elif endpoint == 'audio-features':
+                items = [{'id': x, 'tempo': 120.0, 'energy': 0.8} for x in id_list]
+            else:
+                items = [{'id': x, 'name': 'Album', 'label': 'Label', 'genres': ['pop']} for x in id_list]
+            return fake_response({endpoint.replace('-', '_'): items})
+
+        with mock.patch.object(self.spotify_api.session, 'get', side_effect=fake_get) as session_get:
+            self.assertEqual(self.spotify_api.enrich_tracks(track_id_list), 120)
+            # 3 tracks, 2 audio features and 1 album requests
+            self.assertEqual(session_get.call_count, 6)
+            self.assertEqual(self.spotify_api.enrich_tracks(track_id_list + ['track_120']), 1)
+            self.assertEqual(session_get.call_count, 8)
+
+        track_record = self.spotify_api.get_tracks_enrichment_data(['track_7'])['tracks'][0]
+        self.assertEqual(track_record['isrc'], 'isrc_track_7')
+        self.assertEqual(track_record['tempo'], 120.0)
+        self.assertIsNone(track_record['danceability'])
+        self.assertEqual(track_record['album_label'], 'Label')
+
+    def test_failed_enrichment_not_cached(self):
+        self.spotify_api.enrichment_cache = TrackEnrichmentCache(os.path.join(self.tmp_dir.name, 'cache.sqlite3'))
+        track_id_list = ['track_0', 'track_1', 'track_2']
+        failing_endpoint_set = {'albums'}
+
+        def fake_get(url, headers=None):
+            endpoint, ids = url.split('/v1/')[1].split('?ids=')
+            id_list = ids.split(',')
+            if endpoint in failing_endpoint_set:
+                return fake_response({'error': {'status': 403}}, status_code=403)
+            if endpoint == 'tracks':
+                # spotify has no data for track_2
+                items = [{'id': x, 'album': {'id': 'album_1'}} for x in id_list[:2]] + [None]
+            elif endpoint == 'audio-features':
+                items = [{'id': x, 'tempo': 120.0} for x in id_list]
+            else:
+                items = [{'id': x, 'name': 'Album'} for x in id_list]
+            return fake_response({endpoint.replace('-', '_'): items})
+
+        with mock.patch.object(self.spotify_api.session, 'get', side_effect=fake_get):
+            # only the track spotify has no data for is stored
+            self.assertEqual(self.spotify_api.enrich_tracks(track_id_list), 1)
+            self.assertEqual(
+                self.spotify_api.get_enrichment_cache().filter_unknown(track_id_list), ['track_0', 'track_1']
+            )
+
+            failing_endpoint_set = {'audio-features'}
+            self.assertEqual(self.spotify_api.enrich_tracks(track_id_list), 0)
+
+            failing_endpoint_set.clear()
+            self.assertEqual(self.spotify_api.enrich_tracks(track_id_list), 2)
+
+        record_table = self.spotify_api.get_enrichment_cache().get_records(track_id_list)
+        self.assertEqual(record_table['track_0']['tempo'], 120.0)
+        self.assertEqual(record_table['track_0']['album_name'], 'Album')
+        self.assertIsNone(record_table['track_2']['tempo'])
+
 
 if __name__ == '__main__':
     unittest.main()
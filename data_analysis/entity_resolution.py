@@ -0,0 +1,439 @@
+"""
+Module to link the Billboard and DJ Mag chart rows to the Spotify artists and
+tracks, through an index of normalized names and MinHash signatures
+"""
+import random
+import re
+import struct
+import unicodedata
+import zlib
+from collections import Counter
+import pandas as pd
+
+from music_trends_constants import ENTITY_INDEX_DB, ENTITY_MATCH_THRESHOLD, ENTITY_MAX_CANDIDATES, MINHASH_BANDS, \
+    MINHASH_ROWS
+from data_cleaning.cleaning_functions import TRANSLITERATION_TABLE, clean_music_name
+from utilities.local_cache import LocalCache
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r'[^a-z0-9]+')
+# separators of the artists in the chart artist strings (e.g. 'drake featuring future')
+ARTIST_SEPARATOR_PATTERN = re.compile(r'\s+(?:featuring|feat\.?|ft\.?|with|x|&|and|vs\.?)\s+|\s*,\s*|\s*/\s*')
+# the hash functions of the MinHash signatures are (a * crc32(ngram) + b) mod
+# MERSENNE_PRIME, with fixed (a, b) so the signatures are stable between runs
+MERSENNE_PRIME = (1 << 61) - 1
+MINHASH_PARAMETER_LIST = [
+    (random_generator.randrange(1, MERSENNE_PRIME), random_generator.randrange(MERSENNE_PRIME))
+    for random_generator in [random.Random(0)]
+    for _ in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+MINHASH_LAYOUT = '{0}x{1}'.format(MINHASH_BANDS, MINHASH_ROWS)
+
+
+def normalize_entity_name(name, is_music_name=False):
+    """
+    DESCRIPTION: normalize an artist or track name for matching: cut the extra
+                 info of music names, lowercase, transliterate to ascii and keep
+                 only letters and digits separated by single spaces
+    INPUT: name (str), is_music_name (bool/optional)
+    OUTPUT: normalized_name (str)
+    """
+    if not isinstance(name, str):
+        return ''
+    if is_music_name:
+        name = clean_music_name(name)
+
+    name = unicodedata.normalize('NFKD', name.lower().translate(TRANSLITERATION_TABLE))
+    name = name.encode('ascii', 'ignore').decode('ascii')
+
+    return NON_ALPHANUMERIC_PATTERN.sub(' ', name).strip()
+
+
+def get_name_ngrams(normalized_name, n=3):
+    """
+    DESCRIPTION: get the character n-grams of a name, padded so the short
+                 names and the word boundaries also give n-grams
+    INPUT: normalized_name (str), n (int/optional)
+    OUTPUT: ngram_set (set)
+    """
+    padded_name = ' {0} '.format(normalized_name)
+    if len(padded_name) <= n:
+        return {padded_name}
+
+    return {padded_name[i:i + n] for i in range(len(padded_name) - n + 1)}
+
+
+def get_minhash_signature(ngram_set):
+    """
+    DESCRIPTION: get the MinHash signature of a set of n-grams
+    INPUT: ngram_set (set)
+    OUTPUT: signature (list of ints)
+    """
+    ngram_hash_list = [zlib.crc32(x.encode('utf-8')) for x in ngram_set]
+
+    return [
+        min((a * x + b) % MERSENNE_PRIME for x in ngram_hash_list)
+        for a, b in MINHASH_PARAMETER_LIST
+    ]
+
+
+def get_lsh_buckets(signature):
+    """
+    DESCRIPTION: split a signature in bands and hash each band. Names sharing
+                 any bucket are candidate matches
+    INPUT: signature (list of ints)
+    OUTPUT: bucket_list (list of (band, bucket_hash))
+    """
+    return [
+        (band, zlib.crc32(struct.pack(
+            '<{0}Q'.format(MINHASH_ROWS), *signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+        )))
+        for band in range(MINHASH_BANDS)
+    ]
+
+
+def get_jaccard_similarity(ngram_set_a, ngram_set_b):
+    """
+    DESCRIPTION: get the jaccard similarity of two n-gram sets
+    INPUT: ngram_set_a (set), ngram_set_b (set)
+    OUTPUT: similarity (float)
+    """
+    if not ngram_set_a or not ngram_set_b:
+        return 0.0
+
+    return len(ngram_set_a & ngram_set_b) / len(ngram_set_a | ngram_set_b)
+
+
+class EntityIndex(LocalCache):
+    """
+    DESCRIPTION: Index of the Spotify artists and tracks by normalized name,
+                 with MinHash LSH buckets over their character 3-grams for the
+                 names that do not match exactly. It is kept in a local sqlite
+                 file and loaded in memory, so resolving a chart row is a few
+                 dict lookups plus the similarity of a handful of candidates.
+                 The resolved ids of each chart row are stored as well.
+    ATTRIBUTES:
+        - db_path (str)
+        - threshold (float)
+        - max_candidates (int)
+        - exact_table (dict)
+        - bucket_table (dict)
+        - entity_table (dict)
+    METHODS:
+        - load
+        - rebuild_buckets
+        - add_entities
+        - add_spotify_data
+        - resolve
+        - resolve_artist
+        - resolve_track
+        - resolve_chart
+        - get_resolutions
+    """
+    schema = """
+        create table if not exists entities (
+            entity_type text,
+            entity_id text,
+            normalized_name text,
+            artist_id text,
+            primary key (entity_type, entity_id)
+        );
+        create table if not exists entity_buckets (
+            entity_type text,
+            band integer,
+            bucket_hash integer,
+            entity_id text
+        );
+        create table if not exists chart_resolutions (
+            source text,
+            source_date text,
+            position integer,
+            chart_artist text,
+            chart_title text,
+            artist_id text,
+            track_id text,
+            artist_score real,
+            track_score real,
+            primary key (source, source_date, position)
+        );
+    """
+
+    def __init__(self, db_path=ENTITY_INDEX_DB, threshold=ENTITY_MATCH_THRESHOLD,
+                 max_candidates=ENTITY_MAX_CANDIDATES):
+        """
+        Constructor method for EntityIndex
+        """
+        super().__init__(db_path)
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.exact_table = {}
+        self.bucket_table = {}
+        self.entity_table = {}
+        self.load()
+
+
+    def load(self):
+        """
+        DESCRIPTION: Load the persisted index in memory
+        INPUT: None
+        OUTPUT: None
+        """
+        self.exact_table = {}
+        self.bucket_table = {}
+        self.entity_table = {}
+        for entity_type, entity_id, normalized_name, artist_id in self.query(
+                'select entity_type, entity_id, normalized_name, artist_id from entities'):
+            self.add_to_memory(entity_type, entity_id, normalized_name, artist_id)
+
+        # the buckets stored with other bands and rows do not match the new signatures
+        if self.get_meta('minhash_layout') != MINHASH_LAYOUT:
+            self.rebuild_buckets()
+            return
+
+        for entity_type, band, bucket_hash, entity_id in self.query(
+                'select entity_type, band, bucket_hash, entity_id from entity_buckets'):
+            self.bucket_table.setdefault((entity_type, band, bucket_hash), []).append(entity_id)
+
+
+    def rebuild_buckets(self):
+        """
+        DESCRIPTION: Compute again the LSH buckets of every indexed entity and
+                     replace the stored ones
+        INPUT: None
+        OUTPUT: None
+        """
+        self.bucket_table = {}
+        bucket_row_list = []
+        for (entity_type, entity_id), entity in self.entity_table.items():
+            for band, bucket_hash in get_lsh_buckets(get_minhash_signature(entity['ngram_set'])):
+                self.bucket_table.setdefault((entity_type, band, bucket_hash), []).append(entity_id)
+                bucket_row_list.append((entity_type, band, bucket_hash, entity_id))
+
+        with self.lock, self.connection:
+            self.connection.execute('delete from entity_buckets')
+            self.connection.executemany(
+                'insert into entity_buckets (entity_type, band, bucket_hash, entity_id) values (?, ?, ?, ?)',
+                bucket_row_list
+            )
+        self.set_meta('minhash_layout', MINHASH_LAYOUT)
+
+
+    def add_to_memory(self, entity_type, entity_id, normalized_name, artist_id):
+        """
+        DESCRIPTION: Add an entity to the in-memory lookups (not the buckets)
+        INPUT: entity_type (str), entity_id (str), normalized_name (str), artist_id (str)
+        OUTPUT: None
+        """
+        self.entity_table[(entity_type, entity_id)] = {
+            'normalized_name': normalized_name,
+            'artist_id': artist_id,
+            'ngram_set': get_name_ngrams(normalized_name),
+        }
+        self.exact_table.setdefault((entity_type, normalized_name), []).append(entity_id)
+
+
+    def add_entities(self, entity_type, entity_list):
+        """
+        DESCRIPTION: Index the entities not indexed yet
+        INPUT: entity_type (str: artist or track),
+               entity_list (list of (entity_id, name, artist_id) tuples)
+        OUTPUT: n_added (int)
+        """
+        entity_row_list = []
+        bucket_row_list = []
+        for entity_id, name, artist_id in entity_list:
+            if not isinstance(entity_id, str) or not entity_id or (entity_type, entity_id) in self.entity_table:
+                continue
+
+            normalized_name = normalize_entity_name(name, is_music_name=entity_type == 'track')
+            if not normalized_name:
+                continue
+
+            self.add_to_memory(entity_type, entity_id, normalized_name, artist_id)
+            entity_row_list.append((entity_type, entity_id, normalized_name, artist_id))
+            signature = get_minhash_signature(self.entity_table[(entity_type, entity_id)]['ngram_set'])
+            for band, bucket_hash in get_lsh_buckets(signature):
+                self.bucket_table.setdefault((entity_type, band, bucket_hash), []).append(entity_id)
+                bucket_row_list.append((entity_type, band, bucket_hash, entity_id))
+
+        self.execute(
+            'insert or ignore into entities (entity_type, entity_id, normalized_name, artist_id) values (?, ?, ?, ?)',
+            entity_row_list
+        )
+        self.execute(
+            'insert into entity_buckets (entity_type, band, bucket_hash, entity_id) values (?, ?, ?, ?)',
+            bucket_row_list
+        )
+
+        return len(entity_row_list)
+
+
+    def add_spotify_data(self, spotify_data_dict, artists_df_list=()):
+        """
+        DESCRIPTION: Index the artists and tracks of a run. The artists come from
+                     the artists data and also from the all_artists/all_artists_ids
+                     columns of the tracks, so known artists are indexed too
+        INPUT: spotify_data_dict (dict of dataframes), artists_df_list (list of dataframes/optional)
+        OUTPUT: None
+        """
+        artist_list = []
+        for artists_df in artists_df_list:
+            artist_list += [(x.artist_id, x.name, x.artist_id) for x in artists_df.itertuples(index=False)]
+
+        track_list = []
+        for snapshot_df in spotify_data_dict.values():
+            if snapshot_df.empty:
+                continue
+            for row in snapshot_df.itertuples(index=False):
+                artist_id_list = str(row.all_artists_ids).split('*')
+                artist_name_list = str(row.all_artists).split('*')
+                artist_list += list(zip(artist_id_list, artist_name_list, artist_id_list))
+                track_list.append((getattr(row, 'track_id', None), row.song_name, row.main_artist_id_id))
+
+        self.add_entities('artist', artist_list)
+        self.add_entities('track', track_list)
+
+
+    def resolve(self, entity_type, name, artist_id=None):
+        """
+        DESCRIPTION: Find the entity of a name: an exact normalized match first,
+                     then the most similar LSH candidate above the threshold.
+                     Only the max_candidates candidates sharing the most
+                     buckets with the name are compared, so common words in
+                     the names do not make a resolve slow. When artist_id is
+                     given, tracks of that artist are preferred
+        INPUT: entity_type (str), name (str), artist_id (str/optional)
+        OUTPUT: (entity_id, score) (tuple), (None, 0.0) when nothing matches
+        """
+        normalized_name = normalize_entity_name(name, is_music_name=entity_type == 'track')
+        if not normalized_name:
+            return None, 0.0
+
+        exact_id_list = self.exact_table.get((entity_type, normalized_name), [])
+        if exact_id_list:
+            for entity_id in exact_id_list:
+                if artist_id is None or self.entity_table[(entity_type, entity_id)]['artist_id'] == artist_id:
+                    return entity_id, 1.0
+            if artist_id is None:
+                return exact_id_list[0], 1.0
+
+        ngram_set = get_name_ngrams(normalized_name)
+        bucket_count_table = Counter()
+        for band, bucket_hash in get_lsh_buckets(get_minhash_signature(ngram_set)):
+            bucket_count_table.update(self.bucket_table.get((entity_type, band, bucket_hash), []))
+        candidate_id_set = {x for x, _ in bucket_count_table.most_common(self.max_candidates)}
+        candidate_id_set.update(exact_id_list)
+
+        best_id, best_score = None, 0.0
+        for entity_id in candidate_id_set:
+            entity = self.entity_table[(entity_type, entity_id)]
+            score = get_jaccard_similarity(ngram_set, entity['ngram_set'])
+            if artist_id is not None and entity['artist_id'] != artist_id:
+                score *= 0.9
+            if score > best_score or (score == best_score and best_id is not None and entity_id < best_id):
+                best_id, best_score = entity_id, score
+
+        if best_score < self.threshold:
+            return None, best_score
+
+        return best_id, best_score
+
+
+    def resolve_artist(self, chart_artist):
+        """
+        DESCRIPTION: Resolve a chart artist string. When the whole string does
+                     not match (e.g. 'drake featuring future'), its first artist
+                     is tried
+        INPUT: chart_artist (str)
+        OUTPUT: (artist_id, score) (tuple)
+        """
+        artist_id, score = self.resolve('artist', chart_artist)
+        if artist_id is not None or not isinstance(chart_artist, str):
+            return artist_id, score
+
+        main_artist = ARTIST_SEPARATOR_PATTERN.split(chart_artist.strip())[0]
+        if main_artist == chart_artist:
+            return artist_id, score
+
+        return self.resolve('artist', main_artist)
+
+
+    def resolve_track(self, chart_title, chart_artist):
+        """
+        DESCRIPTION: Resolve a chart song, using its artist to pick between
+                     tracks with similar names
+        INPUT: chart_title (str), chart_artist (str)
+        OUTPUT: (track_id, track_score, artist_id, artist_score) (tuple)
+        """
+        artist_id, artist_score = self.resolve_artist(chart_artist)
+        track_id, track_score = self.resolve('track', chart_title, artist_id)
+
+        return track_id, track_score, artist_id, artist_score
+
+
+    def resolve_chart(self, source_name, chart_df):
+        """
+        DESCRIPTION: Resolve every row of a cleaned chart (artist, and title when
+                     the chart has songs) and store the resolutions
+        INPUT: source_name (str), chart_df (DataFrame with artist, position,
+               source_date and optionally title)
+        OUTPUT: chart_df (DataFrame with artist_id, track_id, artist_score and track_score)
+        """
+        if chart_df.empty:
+            return chart_df
+
+        has_title = 'title' in chart_df.columns
+        resolution_list = []
+        for row in chart_df.itertuples(index=False):
+            if has_title:
+                resolution_list.append(self.resolve_track(row.title, row.artist))
+            else:
+                artist_id, artist_score = self.resolve_artist(row.artist)
+                resolution_list.append((None, 0.0, artist_id, artist_score))
+
+        resolution_df = pd.DataFrame(
+            resolution_list,
+            columns=['track_id', 'track_score', 'artist_id', 'artist_score'],
+            index=chart_df.index
+        )
+        chart_df = chart_df.assign(**{column: resolution_df[column] for column in resolution_df.columns})
+
+        self.execute(
+            """
+            insert or replace into chart_resolutions (
+                source, source_date, position, chart_artist, chart_title,
+                artist_id, track_id, artist_score, track_score
+            ) values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    source_name,
+                    pd.Timestamp(row.source_date).isoformat() if 'source_date' in chart_df.columns else '',
+                    int(row.position),
+                    row.artist,
+                    row.title if has_title else None,
+                    row.artist_id,
+                    row.track_id,
+                    row.artist_score,
+                    row.track_score,
+                )
+                for row in chart_df.itertuples(index=False)
+            ]
+        )
+
+        return chart_df
+
+
+    def get_resolutions(self, source_name, source_date=None):
+        """
+        DESCRIPTION: Get the stored resolutions of a chart
+        INPUT: source_name (str), source_date (datetime/optional, all dates by default)
+        OUTPUT: resolution_df (DataFrame)
+        """
+        statement = 'select * from chart_resolutions where source = ?'
+        params = (source_name,)
+        if source_date is not None:
+            statement += ' and source_date = ?'
+            params += (pd.Timestamp(source_date).isoformat(),)
+
+        with self.lock:
+            return pd.read_sql_query(statement + ' order by source_date, position', self.connection, params=params)
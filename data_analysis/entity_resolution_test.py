@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+import pandas as pd
+
+from benchmarks.entity_resolution_benchmark import make_overlapping_names
+from data_analysis.entity_resolution import EntityIndex, normalize_entity_name
+
+
+class TestEntityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'entities.sqlite3')
+        self.entity_index = EntityIndex(self.db_path)
+        self.entity_index.add_spotify_data(
+            {
+                'playlist_USA': pd.DataFrame({
+                    'track_id': ['t_levitating', 't_wait', 't_way'],
+                    'main_artist_id_id': ['a_dua', 'a_drake', 'a_drake'],
+                    'all_artists': ['dua lipa*dababy', 'drake', 'drake*future'],
+                    'all_artists_ids': ['a_dua*a_dababy', 'a_drake', 'a_drake*a_future'],
+                    'song_name': ['levitating', 'wait for u', 'way 2 sexy'],
+                }),
+            },
+            [pd.DataFrame({'artist_id': ['a_beyonce', 'a_tiesto'], 'name': ['Beyoncé', 'Tiësto']})]
+        )
+
+    def tearDown(self):
+        self.entity_index.connection.close()
+        self.tmp_dir.cleanup()
+
+    def test_normalize_entity_name(self):
+        self.assertEqual(normalize_entity_name('Tiësto'), 'tiesto')
+        self.assertEqual(normalize_entity_name('  AC/DC!! '), 'ac dc')
+        self.assertEqual(normalize_entity_name('Levitating (feat. DaBaby)', is_music_name=True), 'levitating')
+        self.assertEqual(normalize_entity_name(None), '')
+
+    def test_resolve_artist(self):
+        self.assertEqual(self.entity_index.resolve_artist('beyonce'), ('a_beyonce', 1.0))
+        self.assertEqual(self.entity_index.resolve_artist('Tiesto')[0], 'a_tiesto')
+        # the first artist of a collaboration
+        self.assertEqual(self.entity_index.resolve_artist('drake featuring future & young thug')[0], 'a_drake')
+        # a close spelling
+        artist_id, score = self.entity_index.resolve_artist('dua lippa')
+        self.assertEqual(artist_id, 'a_dua')
+        self.assertLess(score, 1.0)
+        self.assertEqual(self.entity_index.resolve_artist('metallica')[0], None)
+
+    def test_resolve_chart(self):
+        chart_df = pd.DataFrame({
+            'title': ['wait for u', 'levitating', 'unknown song'],
+            'artist': ['future featuring drake & tems', 'dua lipa featuring dababy', 'nobody'],
+            'position': [1, 2, 3],
+            'source_date': datetime(2022, 5, 10),
+        })
+        resolved_df = self.entity_index.resolve_chart('billboard', chart_df)
+
+        self.assertEqual(resolved_df['track_id'].tolist()[:2], ['t_wait', 't_levitating'])
+        self.assertEqual(resolved_df['artist_id'].tolist()[1], 'a_dua')
+        self.assertTrue(resolved_df.loc[2, ['artist_id', 'track_id']].isnull().all())
+        self.assertEqual(len(self.entity_index.get_resolutions('billboard', datetime(2022, 5, 10))), 3)
+
+        # resolving the same chart again replaces its resolutions
+        self.entity_index.resolve_chart('billboard', chart_df)
+        self.assertEqual(len(self.entity_index.get_resolutions('billboard')), 3)
+
+    def test_index_is_persisted(self):
+        self.entity_index.connection.close()
+        self.entity_index = EntityIndex(self.db_path)
+
+        self.assertEqual(self.entity_index.resolve('track', 'Way 2 Sexy (with Future & Young Thug)', 'a_drake'),
+                         ('t_way', 1.0))
+        self.assertEqual(self.entity_index.add_entities('artist', [('a_drake', 'drake', 'a_drake')]), 0)
+
+    def test_resolve_overlapping_names(self):
+        # names made of a few common words, so each one shares n-grams with many
+        # others (the latency is measured by benchmarks.entity_resolution_benchmark)
+        name_list = make_overlapping_names(5000)
+        self.entity_index.add_entities('artist', [('a_{0}'.format(i), x, None) for i, x in enumerate(name_list)])
+        for i, name in enumerate(name_list[:200]):
+            self.assertEqual(self.entity_index.resolve_artist(name[:-1])[0], 'a_{0}'.format(i))
+
+    def test_buckets_rebuilt_for_a_new_layout(self):
+        self.entity_index.set_meta('minhash_layout', '16x2')
+        self.entity_index.execute('update entity_buckets set bucket_hash = 0', [()])
+        self.entity_index.connection.close()
+        self.entity_index = EntityIndex(self.db_path)
+
+        self.assertEqual(self.entity_index.resolve_artist('dua lippa')[0], 'a_dua')
+        self.assertNotEqual(self.entity_index.get_meta('minhash_layout'), '16x2')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,501 @@
+"""
+Module to keep the music trends aggregates up to date, folding each new chart
+snapshot into them instead of recomputing the history
+"""
+import pandas as pd
+
+from music_trends_constants import TRENDS_DB, TREND_POPULARITY_ALPHA
+from utilities.local_cache import LocalCache
+
+GENRE_COLUMN_LIST = ['music_genre_1', 'music_genre_2', 'music_genre_3']
+# Tables keyed by the chart (market and chart type)
+CHART_TABLE_LIST = ['track_trends', 'chart_events', 'market_genre_share', 'market_snapshots']
+
+
+def get_snapshot_track_id(snapshot_df):
+    """
+    DESCRIPTION: get the track key of each row of a snapshot. Tracks without a
+                 spotify id (e.g. local files) are keyed by artist and name
+    INPUT: snapshot_df (DataFrame)
+    OUTPUT: track_id_series (Series)
+    """
+    fallback_series = (
+        'local:' + snapshot_df['main_artist_id_id'].astype(str) + ':' + snapshot_df['song_name'].astype(str)
+    )
+    if 'track_id' not in snapshot_df.columns:
+        return fallback_series
+
+    return snapshot_df['track_id'].astype(object).where(snapshot_df['track_id'].notnull(), fallback_series)
+
+
+class TrendAggregator(LocalCache):
+    """
+    DESCRIPTION: Aggregates of the charts of each market, kept in a local
+                 sqlite file and updated once per snapshot. A chart is a
+                 market and a chart type (top_50, viral...), so the charts of
+                 one market are folded apart. Folding a snapshot only touches
+                 its own tracks and the tracks that were on the chart, so the
+                 cost does not grow with the history:
+                 - track_trends: position, delta, best position, days on chart
+                   and rolling (EWMA) popularity of each track per chart
+                 - chart_events: entries and exits of the charts
+                 - market_genre_share: share of the chart of each genre, in
+                   the last snapshot and accumulated
+                 - artist_genres: genres of the artists, from their spotify data
+    ATTRIBUTES:
+        - db_path (str)
+        - popularity_alpha (float)
+    METHODS:
+        - migrate_chart_type
+        - update_artist_genres
+        - sync_artist_genres
+        - get_artist_genres
+        - read_artist_genres
+        - fold_snapshot
+        - fold_genre_share
+        - fold_run
+        - get_market_trends
+        - get_genre_share
+        - get_events
+        - query_dicts
+    """
+    schema = """
+        create table if not exists track_trends (
+            market text,
+            chart_type text,
+            track_id text,
+            song_name text,
+            main_artist_id text,
+            first_seen text,
+            last_seen text,
+            last_position integer,
+            prev_position integer,
+            position_delta integer,
+            best_position integer,
+            days_on_chart integer,
+            popularity_ewma real,
+            on_chart integer,
+            primary key (market, chart_type, track_id)
+        );
+        create index if not exists track_trends_on_chart on track_trends (market, chart_type, on_chart);
+        create table if not exists chart_events (
+            market text,
+            chart_type text,
+            track_id text,
+            event_type text,
+            event_date text,
+            position integer
+        );
+        create index if not exists chart_events_market_date on chart_events (market, chart_type, event_date);
+        create table if not exists market_genre_share (
+            market text,
+            chart_type text,
+            genre text,
+            snapshot_date text,
+            current_tracks integer,
+            current_share real,
+            total_tracks integer,
+            primary key (market, chart_type, genre)
+        );
+        create table if not exists market_snapshots (
+            market text,
+            chart_type text,
+            last_snapshot_date text,
+            snapshot_count integer,
+            primary key (market, chart_type)
+        );
+        create table if not exists artist_genres (
+            artist_id text primary key,
+            music_genre_1 text,
+            music_genre_2 text,
+            music_genre_3 text
+        );
+    """
+    lookup_chunk_size = 500
+
+    def __init__(self, db_path=TRENDS_DB, popularity_alpha=TREND_POPULARITY_ALPHA):
+        """
+        Constructor method for TrendAggregator
+        """
+        super().__init__(db_path)
+        self.popularity_alpha = popularity_alpha
+        self.migrate_chart_type()
+
+
+    def migrate_chart_type(self):
+        """
+        DESCRIPTION: Key by chart the aggregates of a trends file written when
+                     they were keyed by market only. Its rows are given the
+                     top_50 chart type
+        INPUT: None
+        OUTPUT: None
+        """
+        with self.lock:
+            column_list = [row[1] for row in self.connection.execute('pragma table_info(track_trends)')]
+            if 'chart_type' in column_list:
+                return
+
+            # the tables are renamed and copied in one transaction (executescript commits before it runs)
+            script = 'begin; drop index track_trends_on_chart; drop index chart_events_market_date;'
+            for table_name in CHART_TABLE_LIST:
+                script += 'alter table {0} rename to {0}_by_market;'.format(table_name)
+            script += self.schema
+            for table_name in CHART_TABLE_LIST:
+                old_column_str = ', '.join(
+                    row[1] for row in self.connection.execute('pragma table_info({0})'.format(table_name))
+                )
+                script += """
+                    insert into {0} (chart_type, {1}) select 'top_50', {1} from {0}_by_market;
+                    drop table {0}_by_market;
+                """.format(table_name, old_column_str)
+            try:
+                self.connection.executescript(script + 'commit;')
+            except Exception:
+                self.connection.rollback()
+                raise
+
+
+    def update_artist_genres(self, artists_df):
+        """
+        DESCRIPTION: Add or refresh the genres of the artists of a run
+        INPUT: artists_df (DataFrame)
+        OUTPUT: None
+        """
+        if artists_df.empty:
+            return
+
+        genre_df = artists_df[['artist_id'] + GENRE_COLUMN_LIST].astype(object)
+        genre_df = genre_df.where(genre_df.notnull(), '')
+        self.execute(
+            'insert or replace into artist_genres (artist_id, {0}) values (?, ?, ?, ?)'.format(
+                ', '.join(GENRE_COLUMN_LIST)
+            ),
+            list(genre_df.itertuples(index=False, name=None))
+        )
+
+
+    def sync_artist_genres(self, engine, table_name='tendencias_musicais_app_artists'):
+        """
+        DESCRIPTION: Bring the genres of the artists inserted in the database
+                     since the last sync, so the artists known before a run
+                     (not in its artists frame) have their genres too
+        INPUT: engine (sqlalchemy engine), table_name (str/optional)
+        OUTPUT: new_rows (int)
+        """
+        from sqlalchemy import text
+
+        last_id = int(self.get_meta('artists_last_id', 0))
+        query = text("""
+            select id, artist_id, {0}
+            from {1}
+            where id > :last_id
+            order by id
+        """.format(', '.join(GENRE_COLUMN_LIST), table_name))
+
+        with engine.connect() as conn:
+            rows = conn.execute(query, {'last_id': last_id}).fetchall()
+
+        if rows:
+            self.update_artist_genres(pd.DataFrame(
+                [tuple(row[1:]) for row in rows], columns=['artist_id'] + GENRE_COLUMN_LIST
+            ))
+            self.set_meta('artists_last_id', rows[-1][0])
+
+        return len(rows)
+
+
+    def get_artist_genres(self, artist_id_list):
+        """
+        DESCRIPTION: Get the genres of some artists, looked up by primary key
+        INPUT: artist_id_list (list)
+        OUTPUT: artist_genre_table (dict of lists of genres by artist id)
+        """
+        with self.lock:
+            return self.read_artist_genres(artist_id_list)
+
+
+    def read_artist_genres(self, artist_id_list):
+        """
+        DESCRIPTION: Look up the genres of some artists by primary key, without
+                     taking the lock (the caller holds it)
+        INPUT: artist_id_list (list)
+        OUTPUT: artist_genre_table (dict of lists of genres by artist id)
+        """
+        artist_id_list = list(set(artist_id_list))
+        artist_genre_table = {}
+        for i in range(0, len(artist_id_list), self.lookup_chunk_size):
+            chunk = artist_id_list[i:i + self.lookup_chunk_size]
+            rows = self.connection.execute(
+                'select artist_id, {0} from artist_genres where artist_id in ({1})'.format(
+                    ', '.join(GENRE_COLUMN_LIST), ', '.join('?' * len(chunk))
+                ),
+                tuple(chunk)
+            )
+            for artist_id, *genre_list in rows:
+                artist_genre_table[artist_id] = [x for x in genre_list if x]
+
+        return artist_genre_table
+
+
+    def fold_snapshot(self, market, snapshot_df, snapshot_date=None, chart_type='top_50'):
+        """
+        DESCRIPTION: Fold one chart snapshot of a market into the aggregates, in
+                     a single transaction. Snapshots not newer than the last one
+                     folded for the chart are skipped, so folding is idempotent
+        INPUT: market (str), snapshot_df (DataFrame of the cleaned spotify data),
+               snapshot_date (datetime/optional, source_date of the rows by default),
+               chart_type (str/optional)
+        OUTPUT: summary (dict with tracks, entries and exits), empty if skipped
+        """
+        if snapshot_df.empty:
+            return {}
+        if snapshot_date is None:
+            snapshot_date = snapshot_df['source_date'].iloc[0]
+        snapshot_date_str = pd.Timestamp(snapshot_date).isoformat()
+
+        snapshot_df = snapshot_df.assign(track_id=get_snapshot_track_id(snapshot_df))
+        snapshot_df = snapshot_df.sort_values('position').drop_duplicates('track_id')
+        track_id_list = snapshot_df['track_id'].tolist()
+
+        with self.lock, self.connection:
+            last_snapshot_rows = self.connection.execute(
+                'select last_snapshot_date from market_snapshots where market = ? and chart_type = ?',
+                (market, chart_type)
+            ).fetchall()
+            if last_snapshot_rows and last_snapshot_rows[0][0] >= snapshot_date_str:
+                return {}
+
+            previous_table = {
+                row[0]: row for row in self.connection.execute(
+                    """
+                    select track_id, first_seen, last_seen, last_position, best_position,
+                           days_on_chart, popularity_ewma, on_chart
+                    from track_trends where market = ? and chart_type = ? and on_chart = 1
+                    """,
+                    (market, chart_type)
+                )
+            }
+            off_chart_id_list = [x for x in track_id_list if x not in previous_table]
+            for i in range(0, len(off_chart_id_list), self.lookup_chunk_size):
+                chunk = off_chart_id_list[i:i + self.lookup_chunk_size]
+                previous_table.update({
+                    row[0]: row for row in self.connection.execute(
+                        """
+                        select track_id, first_seen, last_seen, last_position, best_position,
+                               days_on_chart, popularity_ewma, on_chart
+                        from track_trends where market = ? and chart_type = ? and track_id in ({0})
+                        """.format(', '.join('?' * len(chunk))),
+                        (market, chart_type) + tuple(chunk)
+                    )
+                })
+
+            track_row_list = []
+            event_row_list = []
+            for row in snapshot_df.itertuples(index=False):
+                position = int(row.position)
+                popularity = None if pd.isnull(row.popularity) else float(row.popularity)
+                previous = previous_table.get(row.track_id)
+
+                if previous is None or not previous[7]:
+                    event_row_list.append((market, chart_type, row.track_id, 'entry', snapshot_date_str, position))
+
+                if previous is None:
+                    track_row_list.append((
+                        market, chart_type, row.track_id, row.song_name, row.main_artist_id_id,
+                        snapshot_date_str, snapshot_date_str, position, None, None, position, 1,
+                        popularity, 1
+                    ))
+                    continue
+
+                _, first_seen, last_seen, last_position, best_position, days_on_chart, popularity_ewma, on_chart = previous
+                if last_seen[:10] != snapshot_date_str[:10]:
+                    days_on_chart += 1
+                if popularity is not None:
+                    if popularity_ewma is None:
+                        popularity_ewma = popularity
+                    else:
+                        popularity_ewma += self.popularity_alpha * (popularity - popularity_ewma)
+                prev_position = last_position if on_chart else None
+                track_row_list.append((
+                    market, chart_type, row.track_id, row.song_name, row.main_artist_id_id,
+                    first_seen, snapshot_date_str, position, prev_position,
+                    None if prev_position is None else prev_position - position,
+                    min(best_position, position), days_on_chart, popularity_ewma, 1
+                ))
+
+            snapshot_track_id_set = set(track_id_list)
+            exit_list = [
+                (track_id, previous[3]) for track_id, previous in previous_table.items()
+                if previous[7] and track_id not in snapshot_track_id_set
+            ]
+            event_row_list += [
+                (market, chart_type, track_id, 'exit', snapshot_date_str, last_position)
+                for track_id, last_position in exit_list
+            ]
+
+            self.connection.executemany(
+                """
+                insert or replace into track_trends (
+                    market, chart_type, track_id, song_name, main_artist_id, first_seen, last_seen,
+                    last_position, prev_position, position_delta, best_position,
+                    days_on_chart, popularity_ewma, on_chart
+                ) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                track_row_list
+            )
+            self.connection.executemany(
+                'update track_trends set on_chart = 0 where market = ? and chart_type = ? and track_id = ?',
+                [(market, chart_type, track_id) for track_id, _ in exit_list]
+            )
+            self.connection.executemany(
+                """
+                insert into chart_events (market, chart_type, track_id, event_type, event_date, position)
+                values (?, ?, ?, ?, ?, ?)
+                """,
+                event_row_list
+            )
+            self.fold_genre_share(market, chart_type, snapshot_df, snapshot_date_str)
+            self.connection.execute(
+                """
+                insert into market_snapshots (market, chart_type, last_snapshot_date, snapshot_count)
+                values (?, ?, ?, 1)
+                on conflict (market, chart_type) do update set
+                    last_snapshot_date = excluded.last_snapshot_date,
+                    snapshot_count = snapshot_count + 1
+                """,
+                (market, chart_type, snapshot_date_str)
+            )
+
+        return {
+            'tracks': len(track_row_list),
+            'entries': sum(1 for x in event_row_list if x[3] == 'entry'),
+            'exits': len(exit_list),
+        }
+
+
+    def fold_genre_share(self, market, chart_type, snapshot_df, snapshot_date_str):
+        """
+        DESCRIPTION: Update the genre share of a chart with one snapshot. It is
+                     called by fold_snapshot, inside its transaction
+        INPUT: market (str), chart_type (str), snapshot_df (DataFrame), snapshot_date_str (str)
+        OUTPUT: None
+        """
+        artist_genre_table = self.read_artist_genres(snapshot_df['main_artist_id_id'].astype(str).tolist())
+
+        genre_count_table = {}
+        for artist_id in snapshot_df['main_artist_id_id'].astype(str):
+            for genre in set(artist_genre_table.get(artist_id, [])):
+                genre_count_table[genre] = genre_count_table.get(genre, 0) + 1
+
+        n_tracks = len(snapshot_df)
+        self.connection.execute(
+            'update market_genre_share set current_tracks = 0, current_share = 0 where market = ? and chart_type = ?',
+            (market, chart_type)
+        )
+        self.connection.executemany(
+            """
+            insert into market_genre_share (
+                market, chart_type, genre, snapshot_date, current_tracks, current_share, total_tracks
+            ) values (?, ?, ?, ?, ?, ?, ?)
+            on conflict (market, chart_type, genre) do update set
+                snapshot_date = excluded.snapshot_date,
+                current_tracks = excluded.current_tracks,
+                current_share = excluded.current_share,
+                total_tracks = total_tracks + excluded.total_tracks
+            """,
+            [
+                (market, chart_type, genre, snapshot_date_str, count, count / n_tracks, count)
+                for genre, count in genre_count_table.items()
+            ]
+        )
+
+
+    def fold_run(self, spotify_data_dict, artists_df_list, chart_table):
+        """
+        DESCRIPTION: Fold the data of a pipeline run: the new artists genres
+                     first, then the snapshot of each playlist into its chart
+        INPUT: spotify_data_dict (dict of dataframes by playlist name),
+               artists_df_list (list of dataframes),
+               chart_table (dict of (market, chart_type) by playlist name)
+        OUTPUT: summary_table (dict of summaries by playlist name)
+        """
+        for artists_df in artists_df_list:
+            self.update_artist_genres(artists_df)
+
+        summary_table = {}
+        for playlist_name, snapshot_df in spotify_data_dict.items():
+            market, chart_type = chart_table.get(playlist_name, (playlist_name.split('_', 1)[-1], 'top_50'))
+            summary = self.fold_snapshot(market, snapshot_df, chart_type=chart_type)
+            if summary:
+                summary_table[playlist_name] = summary
+
+        return summary_table
+
+
+    def get_market_trends(self, market, on_chart_only=True, limit=None, chart_type='top_50'):
+        """
+        DESCRIPTION: Get the track trends of a chart of a market, by position
+        INPUT: market (str), on_chart_only (bool/optional), limit (int/optional),
+               chart_type (str/optional)
+        OUTPUT: trend_list (list of dicts)
+        """
+        statement = 'select * from track_trends where market = ? and chart_type = ?'
+        if on_chart_only:
+            statement += ' and on_chart = 1'
+        statement += ' order by on_chart desc, last_position'
+        params = (market, chart_type)
+        if limit is not None:
+            statement += ' limit ?'
+            params += (limit,)
+
+        return self.query_dicts(statement, params)
+
+
+    def get_genre_share(self, market, chart_type='top_50'):
+        """
+        DESCRIPTION: Get the genre share of a chart of a market, in the last
+                     snapshot and accumulated over every snapshot folded
+        INPUT: market (str), chart_type (str/optional)
+        OUTPUT: genre_share_list (list of dicts)
+        """
+        return self.query_dicts(
+            """
+            select genre, snapshot_date, current_tracks, current_share, total_tracks,
+                   1.0 * total_tracks / (
+                       select sum(total_tracks) from market_genre_share where market = ? and chart_type = ?
+                   ) as total_share
+            from market_genre_share where market = ? and chart_type = ?
+            order by current_share desc, total_tracks desc
+            """,
+            (market, chart_type, market, chart_type)
+        )
+
+
+    def get_events(self, market, since=None, chart_type='top_50'):
+        """
+        DESCRIPTION: Get the entries and exits of a chart of a market
+        INPUT: market (str), since (datetime/optional), chart_type (str/optional)
+        OUTPUT: event_list (list of dicts)
+        """
+        since_str = '' if since is None else pd.Timestamp(since).isoformat()
+
+        return self.query_dicts(
+            """
+            select market, chart_type, track_id, event_type, event_date, position from chart_events
+            where market = ? and chart_type = ? and event_date >= ?
+            order by event_date, event_type, position
+            """,
+            (market, chart_type, since_str)
+        )
+
+
+    def query_dicts(self, statement, params=()):
+        """
+        DESCRIPTION: Run a select statement and get its rows as dicts
+        INPUT: statement (str), params (tuple/optional)
+        OUTPUT: row_list (list of dicts)
+        """
+        with self.lock:
+            cursor = self.connection.execute(statement, params)
+            column_list = [x[0] for x in cursor.description]
+            return [dict(zip(column_list, row)) for row in cursor.fetchall()]
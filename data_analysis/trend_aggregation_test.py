@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+import pandas as pd
+
+from data_analysis.trend_aggregation import TrendAggregator
+
+
+def make_snapshot(track_id_list, source_date, popularity=80):
+    return pd.DataFrame({
+        'track_id': track_id_list,
+        'main_artist_id_id': ['artist_{0}'.format(x[-1]) for x in track_id_list],
+        'song_name': ['song {0}'.format(x) for x in track_id_list],
+        'popularity': popularity,
+        'position': range(1, len(track_id_list) + 1),
+        'source_date': source_date,
+    })
+
+
+class TestTrendAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.trend_aggregator = TrendAggregator(
+            os.path.join(self.tmp_dir.name, 'trends.sqlite3'), popularity_alpha=0.5
+        )
+        self.trend_aggregator.update_artist_genres(pd.DataFrame([
+            {'artist_id': 'artist_a', 'music_genre_1': 'pop', 'music_genre_2': 'dance pop', 'music_genre_3': ''},
+            {'artist_id': 'artist_b', 'music_genre_1': 'rock', 'music_genre_2': None, 'music_genre_3': ''},
+        ]))
+
+    def tearDown(self):
+        self.trend_aggregator.connection.close()
+        self.tmp_dir.cleanup()
+
+    def test_fold_snapshots(self):
+        day_1, day_2 = datetime(2020, 8, 1), datetime(2020, 8, 2)
+        self.trend_aggregator.fold_snapshot('BRA', make_snapshot(['t1a', 't2b', 't3a'], day_1, 80))
+        summary = self.trend_aggregator.fold_snapshot('BRA', make_snapshot(['t2b', 't1a', 't4b'], day_2, 90))
+
+        self.assertEqual(summary, {'tracks': 3, 'entries': 1, 'exits': 1})
+        self.assertEqual(self.trend_aggregator.fold_snapshot('BRA', make_snapshot(['t1a'], day_2)), {})
+
+        trend_table = {x['track_id']: x for x in self.trend_aggregator.get_market_trends('BRA')}
+        self.assertEqual(list(trend_table), ['t2b', 't1a', 't4b'])
+        self.assertEqual(trend_table['t2b']['position_delta'], 1)
+        self.assertEqual(trend_table['t1a']['position_delta'], -1)
+        self.assertEqual(trend_table['t1a']['days_on_chart'], 2)
+        self.assertEqual(trend_table['t1a']['popularity_ewma'], 85)
+        self.assertIsNone(trend_table['t4b']['prev_position'])
+
+        event_list = self.trend_aggregator.get_events('BRA', since=day_2)
+        self.assertEqual([(x['track_id'], x['event_type']) for x in event_list], [('t4b', 'entry'), ('t3a', 'exit')])
+
+        genre_share_table = {x['genre']: x for x in self.trend_aggregator.get_genre_share('BRA')}
+        self.assertAlmostEqual(genre_share_table['rock']['current_share'], 2 / 3)
+        self.assertAlmostEqual(genre_share_table['pop']['current_share'], 1 / 3)
+        self.assertEqual(genre_share_table['pop']['total_tracks'], 3)
+
+    def test_two_charts_in_one_market(self):
+        day_1, day_2 = datetime(2020, 8, 1), datetime(2020, 8, 2)
+        chart_table = {'top_50_BRA': ('BRA', 'top_50'), 'viral_BRA': ('BRA', 'viral')}
+        self.trend_aggregator.fold_run({
+            'top_50_BRA': make_snapshot(['t1a', 't2b'], day_1),
+            'viral_BRA': make_snapshot(['t3a', 't1a'], day_1),
+        }, [], chart_table)
+        # the viral chart of the day is not skipped as an old snapshot of the top 50 chart
+        summary_table = self.trend_aggregator.fold_run({
+            'top_50_BRA': make_snapshot(['t2b', 't1a'], day_2),
+            'viral_BRA': make_snapshot(['t3a', 't4b'], day_2),
+        }, [], chart_table)
+        self.assertEqual(summary_table, {
+            'top_50_BRA': {'tracks': 2, 'entries': 0, 'exits': 0},
+            'viral_BRA': {'tracks': 2, 'entries': 1, 'exits': 1},
+        })
+
+        top_50_table = {x['track_id']: x for x in self.trend_aggregator.get_market_trends('BRA')}
+        self.assertEqual(list(top_50_table), ['t2b', 't1a'])
+        self.assertEqual(top_50_table['t1a']['position_delta'], -1)
+        self.assertEqual(top_50_table['t1a']['days_on_chart'], 2)
+
+        viral_list = self.trend_aggregator.get_market_trends('BRA', chart_type='viral')
+        self.assertEqual([x['track_id'] for x in viral_list], ['t3a', 't4b'])
+        event_list = self.trend_aggregator.get_events('BRA', since=day_2, chart_type='viral')
+        self.assertEqual([(x['track_id'], x['event_type']) for x in event_list], [('t4b', 'entry'), ('t1a', 'exit')])
+        self.assertEqual(self.trend_aggregator.get_events('BRA', since=day_2), [])
+
+        genre_share_table = {x['genre']: x for x in self.trend_aggregator.get_genre_share('BRA', 'viral')}
+        self.assertEqual(genre_share_table['pop']['total_tracks'], 3)
+        self.assertEqual(self.trend_aggregator.get_genre_share('BRA')[0]['total_tracks'], 2)
+
+    def test_market_keyed_file_migrated(self):
+        db_path = os.path.join(self.tmp_dir.name, 'old_trends.sqlite3')
+        connection = sqlite3.connect(db_path)
+        connection.executescript("""
+            create table track_trends (
+                market text, track_id text, song_name text, main_artist_id text, first_seen text,
+                last_seen text, last_position integer, prev_position integer, position_delta integer,
+                best_position integer, days_on_chart integer, popularity_ewma real, on_chart integer,
+                primary key (market, track_id)
+            );
+            create index track_trends_on_chart on track_trends (market, on_chart);
+            create table chart_events (
+                market text, track_id text, event_type text, event_date text, position integer
+            );
+            create index chart_events_market_date on chart_events (market, event_date);
+            create table market_genre_share (
+                market text, genre text, snapshot_date text, current_tracks integer,
+                current_share real, total_tracks integer, primary key (market, genre)
+            );
+            create table market_snapshots (
+                market text primary key, last_snapshot_date text, snapshot_count integer
+            );
+            insert into track_trends values (
+                'BRA', 't1a', 'song t1a', 'artist_a', '2020-08-01T00:00:00', '2020-08-01T00:00:00',
+                1, null, null, 1, 1, 80.0, 1
+            );
+            insert into market_snapshots values ('BRA', '2020-08-01T00:00:00', 1);
+        """)
+        connection.close()
+
+        trend_aggregator = TrendAggregator(db_path)
+        self.addCleanup(trend_aggregator.connection.close)
+        self.assertEqual([x['track_id'] for x in trend_aggregator.get_market_trends('BRA')], ['t1a'])
+
+        trend_aggregator.fold_snapshot('BRA', make_snapshot(['t2b', 't1a'], datetime(2020, 8, 2)))
+        trend_table = {x['track_id']: x for x in trend_aggregator.get_market_trends('BRA')}
+        self.assertEqual(trend_table['t1a']['days_on_chart'], 2)
+        self.assertEqual(trend_aggregator.query('select snapshot_count from market_snapshots'), [(2,)])
+        # the file is migrated once
+        TrendAggregator(db_path).connection.close()
+
+    def test_known_artists_genres_synced(self):
+        from sqlalchemy import create_engine, text
+
+        engine = create_engine('sqlite:///{0}'.format(os.path.join(self.tmp_dir.name, 'artists.sqlite3')))
+        self.addCleanup(engine.dispose)
+        with engine.begin() as conn:
+            conn.execute(text(
+                'create table tendencias_musicais_app_artists (id integer primary key, artist_id text, '
+                'music_genre_1 text, music_genre_2 text, music_genre_3 text)'
+            ))
+            conn.execute(text("insert into tendencias_musicais_app_artists values (1, 'artist_c', 'jazz', '', '')"))
+
+        # the artists of the playlist were known before the run, so its artists frame is empty
+        self.assertEqual(self.trend_aggregator.sync_artist_genres(engine), 1)
+        self.trend_aggregator.fold_run({'top_50_BRA': make_snapshot(['t1c', 't2c'], datetime(2020, 8, 1))}, [], {'top_50_BRA': ('BRA', 'top_50')})
+        self.assertEqual(
+            [(x['genre'], x['current_tracks']) for x in self.trend_aggregator.get_genre_share('BRA')], [('jazz', 2)]
+        )
+
+        with engine.begin() as conn:
+            conn.execute(text("insert into tendencias_musicais_app_artists values (2, 'artist_d', 'soul', '', '')"))
+        self.assertEqual(self.trend_aggregator.sync_artist_genres(engine), 1)
+        self.assertEqual(self.trend_aggregator.get_artist_genres(['artist_d']), {'artist_d': ['soul']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,391 @@
+"""
+Module to serve the music trends to the readers (dashboards, scripts): the
+common queries over the trend aggregates are computed once and kept in an
+LRU cache with a TTL, dropped as soon as a run folds new snapshots (the run
+bumps the generation file), so the readers rarely touch the database. The
+queries are available as a python api and from a small local http server:
+
+    /top-artists?market=BRA&limit=10
+    /top-genres?market=BRA&limit=10
+    /overlap[?market=BRA&market=USA]
+    /risers?market=BRA&limit=10 (all the markets without market)
+
+The queries read the top 50 charts, another chart type is asked with
+chart_type (e.g. /top-artists?market=BRA&chart_type=viral)
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import combinations
+from urllib.parse import parse_qs, urlparse
+
+from music_trends_constants import TRENDS_GENERATION_PATH, TRENDS_CACHE_TTL, TRENDS_CACHE_MAX_ENTRIES, \
+    TRENDS_QUERY_PORT
+from data_analysis.trend_aggregation import TrendAggregator
+from utilities.metrics import METRICS, write_atomic
+from utilities.playlist_registry import PlaylistRegistry
+
+
+def read_trends_generation(generation_path=TRENDS_GENERATION_PATH):
+    """
+    DESCRIPTION: read the generation of the trend aggregates
+    INPUT: generation_path (str/optional)
+    OUTPUT: generation (int, 0 before the first bump)
+    """
+    try:
+        with open(generation_path) as generation_file:
+            return int(generation_file.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_trends_generation(generation_path=TRENDS_GENERATION_PATH):
+    """
+    DESCRIPTION: increment the generation of the trend aggregates, so every
+                 reader drops its cached results
+    INPUT: generation_path (str/optional)
+    OUTPUT: generation (int)
+    """
+    generation = read_trends_generation(generation_path) + 1
+    write_atomic(generation_path, str(generation))
+
+    return generation
+
+
+class TTLCache():
+    """
+    DESCRIPTION: Thread safe LRU cache whose entries expire after ttl_seconds
+    ATTRIBUTES:
+        - max_entries (int)
+        - ttl_seconds (float)
+        - entry_table (OrderedDict of (expires_at, value) by key, oldest used first)
+        - lock (threading.Lock)
+    METHODS:
+        - get
+        - set
+        - clear
+    """
+    def __init__(self, max_entries=TRENDS_CACHE_MAX_ENTRIES, ttl_seconds=TRENDS_CACHE_TTL):
+        """
+        Constructor method for TTLCache
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entry_table = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get(self, key):
+        """
+        DESCRIPTION: Get a value that has not expired
+        INPUT: key (hashable)
+        OUTPUT: is_hit (bool), value
+        """
+        with self.lock:
+            entry = self.entry_table.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.monotonic():
+                del self.entry_table[key]
+                return False, None
+
+            self.entry_table.move_to_end(key)
+            return True, entry[1]
+
+
+    def set(self, key, value):
+        """
+        DESCRIPTION: Add a value, evicting the least recently used ones past max_entries
+        INPUT: key (hashable), value
+        OUTPUT: None
+        """
+        with self.lock:
+            self.entry_table[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entry_table.move_to_end(key)
+            while len(self.entry_table) > self.max_entries:
+                self.entry_table.popitem(last=False)
+
+
+    def clear(self):
+        """
+        DESCRIPTION: Drop every value
+        INPUT: None
+        OUTPUT: None
+        """
+        with self.lock:
+            self.entry_table.clear()
+
+
+class TrendsQueryService():
+    """
+    DESCRIPTION: Cached queries over the trend aggregates. Each result is
+                 computed on its first request and served from the cache until
+                 it expires or the generation file changes (checked with a
+                 stat on each request)
+    ATTRIBUTES:
+        - trend_aggregator (TrendAggregator)
+        - generation_path (str)
+        - generation_stamp (tuple): stat of the generation file when the cache was filled
+        - cache (TTLCache)
+        - chart_market_list (list): markets of the top 50 charts, compared by the overlap
+    METHODS:
+        - get_generation_stamp
+        - check_generation
+        - get_cached
+        - query
+        - top_artists
+        - top_genres
+        - market_overlap
+        - fastest_risers
+        - serve
+    """
+    query_name_list = ['top_artists', 'top_genres', 'market_overlap', 'fastest_risers']
+
+    def __init__(self, trend_aggregator=None, generation_path=TRENDS_GENERATION_PATH,
+                 ttl_seconds=TRENDS_CACHE_TTL, max_entries=TRENDS_CACHE_MAX_ENTRIES, registry=None):
+        """
+        Constructor method for TrendsQueryService
+        """
+        self.trend_aggregator = trend_aggregator if trend_aggregator is not None else TrendAggregator()
+        self.generation_path = generation_path
+        self.generation_stamp = None
+        self.cache = TTLCache(max_entries, ttl_seconds)
+        if registry is None:
+            registry = PlaylistRegistry()
+        self.chart_market_list = [x['market'] for x in registry.get_entries(chart_type='top_50')]
+
+
+    def get_generation_stamp(self):
+        """
+        DESCRIPTION: Get the stat of the generation file
+        INPUT: None
+        OUTPUT: generation_stamp (tuple, None when there is no generation file)
+        """
+        try:
+            file_stat = os.stat(self.generation_path)
+        except OSError:
+            return None
+
+        return (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+
+
+    def check_generation(self):
+        """
+        DESCRIPTION: Drop the cached results when the generation file changed
+        INPUT: None
+        OUTPUT: generation_stamp (tuple)
+        """
+        generation_stamp = self.get_generation_stamp()
+        if generation_stamp != self.generation_stamp:
+            self.cache.clear()
+            self.generation_stamp = generation_stamp
+
+        return generation_stamp
+
+
+    def get_cached(self, key, compute_function):
+        """
+        DESCRIPTION: Get a result from the cache, computing it on a miss. A
+                     result is cached only when the generation did not change
+                     while it was computed, so a run folding new snapshots
+                     meanwhile can not leave a stale result in the cache
+        INPUT: key (tuple), compute_function (function without arguments)
+        OUTPUT: result
+        """
+        generation_stamp = self.check_generation()
+        is_hit, result = self.cache.get(key)
+        METRICS.inc('trends_cache_total', query=key[0], result='hit' if is_hit else 'miss')
+        if is_hit:
+            return result
+
+        with METRICS.timer('trends_query_seconds', query=key[0]):
+            result = compute_function()
+        if self.get_generation_stamp() == generation_stamp:
+            self.cache.set(key, result)
+
+        return result
+
+
+    def query(self, query_name, **params):
+        """
+        DESCRIPTION: Run a query by its name
+        INPUT: query_name (str, one of query_name_list), params (arguments of the query)
+        OUTPUT: result (list of dicts)
+        """
+        if query_name not in self.query_name_list:
+            raise ValueError('unknown query {0}, expected one of {1}'.format(query_name, self.query_name_list))
+
+        return getattr(self, query_name)(**params)
+
+
+    def top_artists(self, market, limit=10, chart_type='top_50'):
+        """
+        DESCRIPTION: Get the artists with the most tracks on a chart of a market
+        INPUT: market (str), limit (int/optional), chart_type (str/optional)
+        OUTPUT: artist_list (list of dicts)
+        """
+        return self.get_cached(('top_artists', market, limit, chart_type), lambda: self.trend_aggregator.query_dicts(
+            """
+            select trends.main_artist_id as artist_id, count(*) as tracks,
+                   min(trends.last_position) as best_position,
+                   avg(trends.popularity_ewma) as popularity, genres.music_genre_1 as genre
+            from track_trends as trends
+            left join artist_genres as genres on genres.artist_id = trends.main_artist_id
+            where trends.market = ? and trends.chart_type = ? and trends.on_chart = 1
+            group by trends.main_artist_id
+            order by tracks desc, best_position
+            limit ?
+            """,
+            (market, chart_type, limit)
+        ))
+
+
+    def top_genres(self, market, limit=10, chart_type='top_50'):
+        """
+        DESCRIPTION: Get the genres with the largest share of a chart of a market
+        INPUT: market (str), limit (int/optional), chart_type (str/optional)
+        OUTPUT: genre_share_list (list of dicts)
+        """
+        return self.get_cached(
+            ('top_genres', market, limit, chart_type),
+            lambda: self.trend_aggregator.get_genre_share(market, chart_type)[:limit]
+        )
+
+
+    def market_overlap(self, market_list=None, chart_type='top_50'):
+        """
+        DESCRIPTION: Get the tracks shared by the current charts of a type of
+                     each pair of markets (the markets of the top 50 charts by
+                     default)
+        INPUT: market_list (list/optional), chart_type (str/optional)
+        OUTPUT: overlap_list (list of dicts by jaccard similarity)
+        """
+        market_tuple = tuple(sorted(market_list or self.chart_market_list))
+
+        def compute_overlap():
+            track_set_table = {market: set() for market in market_tuple}
+            for row in self.trend_aggregator.query(
+                    'select market, track_id from track_trends '
+                    'where on_chart = 1 and chart_type = ? and market in ({0})'.format(
+                        ', '.join('?' * len(market_tuple))
+                    ),
+                    (chart_type,) + market_tuple
+            ):
+                track_set_table[row[0]].add(row[1])
+
+            overlap_list = []
+            for market_1, market_2 in combinations(market_tuple, 2):
+                shared_tracks = len(track_set_table[market_1] & track_set_table[market_2])
+                all_tracks = len(track_set_table[market_1] | track_set_table[market_2])
+                overlap_list.append({
+                    'market_1': market_1,
+                    'market_2': market_2,
+                    'shared_tracks': shared_tracks,
+                    'jaccard': shared_tracks / all_tracks if all_tracks else 0.0,
+                })
+
+            return sorted(overlap_list, key=lambda x: (-x['jaccard'], x['market_1'], x['market_2']))
+
+        return self.get_cached(('market_overlap', market_tuple, chart_type), compute_overlap)
+
+
+    def fastest_risers(self, market=None, limit=10, chart_type='top_50'):
+        """
+        DESCRIPTION: Get the tracks that climbed the most positions in the last
+                     snapshot of a chart type of a market (of every market by
+                     default)
+        INPUT: market (str/optional), limit (int/optional), chart_type (str/optional)
+        OUTPUT: trend_list (list of dicts)
+        """
+        statement = 'select * from track_trends where on_chart = 1 and chart_type = ? and position_delta > 0'
+        params = (chart_type,)
+        if market is not None:
+            statement += ' and market = ?'
+            params += (market,)
+        statement += ' order by position_delta desc, last_position limit ?'
+        params += (limit,)
+
+        return self.get_cached(
+            ('fastest_risers', market, limit, chart_type), lambda: self.trend_aggregator.query_dicts(statement, params)
+        )
+
+
+    def serve(self, port=TRENDS_QUERY_PORT, host='127.0.0.1'):
+        """
+        DESCRIPTION: Create the http server of the queries (serve_forever runs it)
+        INPUT: port (int/optional, 0 for any free port), host (str/optional)
+        OUTPUT: query_server (ThreadingHTTPServer)
+        """
+        query_server = ThreadingHTTPServer((host, port), TrendsRequestHandler)
+        query_server.daemon_threads = True
+        query_server.trends_query_service = self
+
+        return query_server
+
+
+class TrendsRequestHandler(BaseHTTPRequestHandler):
+    """
+    DESCRIPTION: Handler of the trends http server. The path is the query name
+                 (with dashes), the parameters are in the query string and the
+                 answer is json
+    METHODS:
+        - do_GET
+        - send_body
+        - log_message
+    """
+    def do_GET(self):
+        """
+        DESCRIPTION: Answer a query
+        INPUT: None
+        OUTPUT: None
+        """
+        url = urlparse(self.path)
+        route = url.path.strip('/').replace('-', '_')
+        if route == 'health':
+            self.send_body(200, {'status': 'ok'})
+            return
+
+        query_name = {'overlap': 'market_overlap', 'risers': 'fastest_risers'}.get(route, route)
+        param_table = parse_qs(url.query)
+        params = {}
+        try:
+            if 'limit' in param_table:
+                params['limit'] = int(param_table['limit'][0])
+            if 'chart_type' in param_table:
+                params['chart_type'] = param_table['chart_type'][0]
+            if query_name == 'market_overlap':
+                params['market_list'] = param_table.get('market')
+            elif 'market' in param_table:
+                params['market'] = param_table['market'][0]
+            result = self.server.trends_query_service.query(query_name, **params)
+        except (TypeError, ValueError) as error:
+            self.send_body(404 if query_name not in TrendsQueryService.query_name_list else 400, {'error': str(error)})
+            return
+
+        self.send_body(200, result)
+
+
+    def send_body(self, status, result):
+        """
+        DESCRIPTION: Send a json answer
+        INPUT: status (int), result (json serializable)
+        OUTPUT: None
+        """
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        """
+        DESCRIPTION: Do not log each query
+        INPUT: format (str), args (tuple)
+        OUTPUT: None
+        """
+        return
@@ -0,0 +1,150 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from datetime import datetime
+from unittest import mock
+import pandas as pd
+
+from data_analysis.trend_aggregation import TrendAggregator
+from data_analysis.trend_aggregation_test import make_snapshot
+from data_analysis.trends_query import TTLCache, TrendsQueryService, bump_trends_generation
+
+
+class TestTrendsQueryService(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.generation_path = os.path.join(self.tmp_dir.name, 'trends.generation')
+        self.trend_aggregator = TrendAggregator(os.path.join(self.tmp_dir.name, 'trends.sqlite3'))
+        self.trend_aggregator.update_artist_genres(pd.DataFrame([
+            {'artist_id': 'artist_a', 'music_genre_1': 'pop', 'music_genre_2': '', 'music_genre_3': ''},
+            {'artist_id': 'artist_b', 'music_genre_1': 'rock', 'music_genre_2': '', 'music_genre_3': ''},
+        ]))
+        day_1, day_2 = datetime(2020, 8, 1), datetime(2020, 8, 2)
+        self.trend_aggregator.fold_snapshot('BRA', make_snapshot(['t1a', 't2b', 't3a', 't4a'], day_1))
+        self.trend_aggregator.fold_snapshot('BRA', make_snapshot(['t4a', 't1a', 't2b', 't5b'], day_2))
+        self.trend_aggregator.fold_snapshot('USA', make_snapshot(['t1a', 't6b'], day_2))
+        self.trend_aggregator.fold_snapshot('GBR', make_snapshot(['t7a'], day_2))
+
+        registry = mock.Mock()
+        registry.get_entries.return_value = [{'market': x} for x in ['BRA', 'USA', 'GBR']]
+        self.trends_query_service = TrendsQueryService(
+            self.trend_aggregator, self.generation_path, ttl_seconds=60, registry=registry
+        )
+
+    def tearDown(self):
+        self.trend_aggregator.connection.close()
+        self.tmp_dir.cleanup()
+
+    def test_queries(self):
+        artist_list = self.trends_query_service.top_artists('BRA')
+        self.assertEqual([(x['artist_id'], x['tracks'], x['genre']) for x in artist_list],
+                         [('artist_a', 2, 'pop'), ('artist_b', 2, 'rock')])
+        self.assertEqual(self.trends_query_service.top_genres('BRA', limit=1)[0]['genre'], 'pop')
+
+        overlap_list = self.trends_query_service.market_overlap()
+        self.assertEqual(overlap_list[0], {'market_1': 'BRA', 'market_2': 'USA', 'shared_tracks': 1, 'jaccard': 0.2})
+        self.assertEqual(len(overlap_list), 3)
+
+        # t4a climbed from 4 to 1
+        riser_list = self.trends_query_service.fastest_risers()
+        self.assertEqual([(x['track_id'], x['position_delta']) for x in riser_list], [('t4a', 3)])
+
+        # the viral chart of a market is apart from its top 50 chart
+        self.trend_aggregator.fold_snapshot('BRA', make_snapshot(['t6b'], datetime(2020, 8, 2)), chart_type='viral')
+        artist_list = self.trends_query_service.top_artists('BRA', chart_type='viral')
+        self.assertEqual([(x['artist_id'], x['tracks']) for x in artist_list], [('artist_b', 1)])
+        self.assertEqual(len(self.trends_query_service.top_artists('BRA')), 2)
+
+        with self.assertRaises(ValueError):
+            self.trends_query_service.query('drop_tables')
+
+    def test_cache_invalidation(self):
+        with mock.patch.object(
+                self.trend_aggregator, 'query_dicts', wraps=self.trend_aggregator.query_dicts
+        ) as query_dicts:
+            self.trends_query_service.top_artists('USA')
+            self.trends_query_service.top_artists('USA')
+            self.assertEqual(query_dicts.call_count, 1)
+
+            self.trend_aggregator.fold_snapshot('USA', make_snapshot(['t6b', 't8b'], datetime(2020, 8, 3)))
+            self.assertEqual(bump_trends_generation(self.generation_path), 1)
+            artist_list = self.trends_query_service.top_artists('USA')
+            self.assertEqual(query_dicts.call_count, 2)
+            self.assertEqual([(x['artist_id'], x['tracks']) for x in artist_list], [('artist_b', 2)])
+
+    def test_result_not_cached_across_a_generation_bump(self):
+        query_dicts = self.trend_aggregator.query_dicts
+
+        def fold_during_query(statement, params=()):
+            result = query_dicts(statement, params)
+            # a run folds a new snapshot while the stale result is computed
+            self.trend_aggregator.fold_snapshot('USA', make_snapshot(['t6b', 't8b'], datetime(2020, 8, 3)))
+            bump_trends_generation(self.generation_path)
+            # and another reader sees the new generation before this one ends
+            self.trends_query_service.check_generation()
+            return result
+
+        with mock.patch.object(self.trend_aggregator, 'query_dicts', side_effect=fold_during_query):
+            stale_list = self.trends_query_service.top_artists('USA')
+        self.assertEqual([(x['artist_id'], x['tracks']) for x in stale_list], [('artist_a', 1), ('artist_b', 1)])
+
+        artist_list = self.trends_query_service.top_artists('USA')
+        self.assertEqual([(x['artist_id'], x['tracks']) for x in artist_list], [('artist_b', 2)])
+
+    def test_ttl_and_lru(self):
+        cache = TTLCache(max_entries=2, ttl_seconds=0.05)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('a'), (True, 1))
+        time.sleep(0.06)
+        self.assertEqual(cache.get('a'), (False, None))
+
+    def test_concurrent_readers(self):
+        # the latency is measured by benchmarks.trends_query_benchmark
+        expected = (self.trends_query_service.market_overlap(), self.trends_query_service.top_artists('BRA'))
+        result_list = []
+
+        def read_trends():
+            for _ in range(500):
+                result_list.append(
+                    (self.trends_query_service.market_overlap(), self.trends_query_service.top_artists('BRA'))
+                )
+
+        thread_list = [threading.Thread(target=read_trends) for _ in range(8)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+
+        self.assertEqual(len(result_list), 8 * 500)
+        self.assertTrue(all(x == expected for x in result_list))
+
+    def test_http_server(self):
+        query_server = self.trends_query_service.serve(port=0)
+        threading.Thread(target=query_server.serve_forever, daemon=True).start()
+        self.addCleanup(query_server.server_close)
+        self.addCleanup(query_server.shutdown)
+        url = 'http://127.0.0.1:{0}'.format(query_server.server_address[1])
+
+        with urllib.request.urlopen(url + '/top-artists?market=BRA&limit=1') as response:
+            self.assertEqual([x['artist_id'] for x in json.loads(response.read())], ['artist_a'])
+        with urllib.request.urlopen(url + '/overlap?market=USA&market=GBR') as response:
+            self.assertEqual(json.loads(response.read())[0]['shared_tracks'], 0)
+
+        for path, status in [('/top-artists', 400), ('/top-artists?market=BRA&limit=x', 400), ('/tables', 404)]:
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url + path)
+            self.assertEqual(context.exception.code, status)
+
+
+if __name__ == '__main__':
+    unittest.main()
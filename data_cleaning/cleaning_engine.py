@@ -0,0 +1,71 @@
+"""
+Module to clean all the dataframes of a source in one batched pass
+"""
+import pandas as pd
+
+from music_trends_constants import CLEANING_RULES_TABLE
+from data_cleaning.cleaning_functions import (
+    add_metadata, clean_music_name_series, make_cols_lowercase, remove_special_chars
+)
+
+
+class CleaningEngine():
+    """
+    DESCRIPTION: Apply the cleaning rules declared for each source. The frames of
+                 a source are concatenated, cleaned with vectorized string
+                 operations, and split back by key (with a new RangeIndex, as
+                 the frames built from the acquired json have)
+    ATTRIBUTES:
+        - rules_table (dict)
+    METHODS:
+        - clean_frame
+        - clean_source
+    """
+    def __init__(self, rules_table=CLEANING_RULES_TABLE):
+        """
+        Constructor method for CleaningEngine
+        """
+        self.rules_table = rules_table
+
+
+    def clean_frame(self, source_name, data_df, metadata_dict=None):
+        """
+        DESCRIPTION: Apply the cleaning rules of a source to one dataframe
+        INPUT: source_name (str), data_df (DataFrame), metadata_dict (dict/optional)
+        OUTPUT: data_df (DataFrame)
+        """
+        rules = self.rules_table[source_name]
+
+        data_df = make_cols_lowercase(data_df, rules.get('lowercase', []))
+        data_df = remove_special_chars(data_df, rules.get('special_chars', []))
+        if rules.get('metadata') and metadata_dict:
+            data_df = add_metadata(data_df, metadata_dict)
+        for column in rules.get('music_name', []):
+            data_df[column] = clean_music_name_series(data_df[column])
+
+        return data_df
+
+
+    def clean_source(self, source_name, data_dict, metadata_dict=None):
+        """
+        DESCRIPTION: Clean all the dataframes of a source in a single pass.
+                     Empty dataframes are kept as they are
+        INPUT: source_name (str), data_dict (dict of dataframes), metadata_dict (dict/optional)
+        OUTPUT: cleaned_data_dict (dict of dataframes)
+        """
+        key_list = [key for key, data_df in data_dict.items() if not data_df.empty]
+        if not key_list:
+            return dict(data_dict)
+
+        source_df = pd.concat([data_dict[key] for key in key_list], ignore_index=True)
+        source_df = self.clean_frame(source_name, source_df, metadata_dict)
+
+        # the frames are contiguous in the concatenation, split them back by position
+        cleaned_data_dict = dict(data_dict)
+        start = 0
+        for key in key_list:
+            end = start + len(data_dict[key])
+            cleaned_data_dict[key] = source_df.iloc[start:end].reset_index(drop=True)
+            start = end
+
+        return cleaned_data_dict
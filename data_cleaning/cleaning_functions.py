@@ -1,6 +1,36 @@
 """
 Collection of python functions to help cleaning data acquired in this project
 """
+import re
+
+MUSIC_NAME_BREAKING_SUBSTRING_LIST = [
+    ' (feat.',
+    ' (with',
+]
+# cuts the name at the first breaking substring, same as clean_music_name. It is
+# kept as a pattern string (not compiled) so pandas can run it in the arrow
+# string kernels when they are available
+MUSIC_NAME_BREAKING_PATTERN = '(?s)(?:{0}).*'.format(
+    '|'.join(re.escape(x) for x in MUSIC_NAME_BREAKING_SUBSTRING_LIST)
+)
+
+# characters that the unicode decomposition (NFKD) does not turn into ascii
+TRANSLITERATION_TABLE = str.maketrans({
+    'ß': 'ss', 'ẞ': 'SS',
+    'æ': 'ae', 'Æ': 'AE',
+    'œ': 'oe', 'Œ': 'OE',
+    'ø': 'o', 'Ø': 'O',
+    'đ': 'd', 'Đ': 'D',
+    'ð': 'd', 'Ð': 'D',
+    'ł': 'l', 'Ł': 'L',
+    'þ': 'th', 'Þ': 'Th',
+    'ı': 'i', 'ħ': 'h', 'Ħ': 'H',
+    '‘': "'", '’': "'", '‚': "'", '′': "'",
+    '“': '"', '”': '"', '„': '"', '″': '"',
+    '‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '―': '-',
+    '…': '...', '¡': '!', '¿': '?', '×': 'x', '•': '*',
+})
+
 
 def clean_music_name(music_name):
     """
@@ -8,12 +38,7 @@ def clean_music_name(music_name):
     INPUT: music_name (str)
     OUTPUT: music_name (str)
     """
-    breaking_substring_list = [
-        ' (feat.',
-        ' (with',
-    ]
-
-    for substring in breaking_substring_list:
+    for substring in MUSIC_NAME_BREAKING_SUBSTRING_LIST:
         if substring in music_name:
             breaking_point = music_name.find(substring)
             music_name = music_name[:breaking_point]
@@ -21,15 +46,30 @@ def clean_music_name(music_name):
     return music_name
 
 
+def clean_music_name_series(music_name_series):
+    """
+    DESCRIPTION: clean extra info from all the music names of a series at once
+    INPUT: music_name_series (Series)
+    OUTPUT: music_name_series (Series)
+    """
+    return music_name_series.str.replace(MUSIC_NAME_BREAKING_PATTERN, '', regex=True)
+
+
 def remove_special_chars(data_df, column_list):
     """
-    DESCRIPTION: create a new column for strings with no special chars
+    DESCRIPTION: transliterate the strings of the columns to ascii
+                 (e.g. 'Beyoncé' -> 'Beyonce', 'Ørjan' -> 'Orjan')
     INPUT: data_df (DataFrame), column_list (list)
     OUTPUT: data_df (DataFrame)
     """
-    # TODO: search for conversion lookup table
     for column in column_list:
-        data_df[column] = data_df[column].str.encode('ascii', 'ignore').str.decode('ascii')
+        data_df[column] = (
+            data_df[column]
+            .str.translate(TRANSLITERATION_TABLE)
+            .str.normalize('NFKD')
+            .str.encode('ascii', 'ignore')
+            .str.decode('ascii')
+        )
 
     return data_df
 
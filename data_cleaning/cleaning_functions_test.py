@@ -0,0 +1,78 @@
+import unittest
+from datetime import datetime
+import pandas as pd
+
+from data_cleaning.cleaning_engine import CleaningEngine
+from data_cleaning.cleaning_functions import clean_music_name, clean_music_name_series, remove_special_chars
+from data_cleaning.schemas import apply_source_schema, concat_source_frames
+
+
+class TestCleaningFunctions(unittest.TestCase):
+
+    def test_clean_music_name_series_matches_clean_music_name(self):
+        music_name_list = [
+            'song (feat. someone) (with other)',
+            'song (with other) (feat. someone)',
+            'song (without me)',
+            'song - remix',
+            'song (feat.\nsomeone',
+        ]
+
+        received = clean_music_name_series(pd.Series(music_name_list)).tolist()
+        expected = [clean_music_name(x) for x in music_name_list]
+
+        self.assertEqual(received, expected)
+
+    def test_remove_special_chars(self):
+        data_df = pd.DataFrame({'name': ['Beyoncé', 'Ørjan Nilsen', 'Straße', 'Sigur Rós — “Hoppípolla”']})
+
+        received = remove_special_chars(data_df, ['name'])['name'].tolist()
+
+        self.assertEqual(received, ['Beyonce', 'Orjan Nilsen', 'Strasse', 'Sigur Ros - "Hoppipolla"'])
+
+    def test_clean_source_in_one_pass(self):
+        data_dict = {
+            'playlist_BRA': pd.DataFrame({'song_name': ['Hey (With You)', 'Yo'], 'all_artists': ['A', 'B']}),
+            'playlist_USA': pd.DataFrame({'song_name': ['Blah (feat. X)'], 'all_artists': ['C']}),
+            'playlist_NZL': pd.DataFrame(),
+        }
+        source_date = datetime(2020, 8, 1)
+
+        received = CleaningEngine().clean_source('spotify', data_dict, {'source_date': source_date})
+
+        self.assertEqual(received['playlist_BRA']['song_name'].tolist(), ['hey', 'yo'])
+        self.assertEqual(received['playlist_USA']['all_artists'].tolist(), ['c'])
+        self.assertEqual(received['playlist_USA']['song_name'].tolist(), ['blah'])
+        self.assertTrue((received['playlist_BRA']['source_date'] == source_date).all())
+        self.assertTrue(received['playlist_NZL'].empty)
+
+
+class TestSchemas(unittest.TestCase):
+
+    def test_apply_and_concat_keep_compact_types(self):
+        data_df_list = [
+            pd.DataFrame({
+                'playlist_id_id': ['p1', 'p1'],
+                'song_name': ['a', 'b'],
+                'popularity': [90, 80],
+                'position': [1, 2],
+                'source_date': [datetime(2020, 8, day)] * 2,
+            })
+            for day in [1, 2]
+        ]
+        data_df_list = [apply_source_schema(x, 'spotify') for x in data_df_list]
+
+        self.assertEqual(str(data_df_list[0]['playlist_id_id'].dtype), 'category')
+        self.assertEqual(str(data_df_list[0]['position'].dtype), 'int8')
+        self.assertEqual(str(data_df_list[0]['source_date'].dtype), 'datetime64[ns]')
+
+        data_df = concat_source_frames(data_df_list, 'spotify')
+
+        self.assertEqual(str(data_df['song_name'].dtype), 'category')
+        self.assertEqual(list(data_df['song_name'].cat.categories), ['a', 'b'])
+        self.assertEqual(data_df['song_name'].tolist(), ['a', 'b', 'a', 'b'])
+        self.assertEqual(list(data_df.columns), list(data_df_list[0].columns))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Typed schemas of the dataframes of each source, to keep them compact in memory
+"""
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# column types of each source:
+#   - category: repeated values (ids, genres) stored once, referenced by small codes
+#   - integer: downcast to the smallest integer type that fits
+#   - datetime: datetime64[ns]
+# columns not listed keep their type
+SOURCE_SCHEMA_TABLE = {
+    'billboard': {
+        'position': 'integer',
+        'source_date': 'datetime',
+    },
+    'dj_mag': {
+        'position': 'integer',
+        'source_date': 'datetime',
+    },
+    'spotify': {
+        'playlist_id_id': 'category',
+        'track_id': 'category',
+        'main_artist_id_id': 'category',
+        'all_artists': 'category',
+        'all_artists_ids': 'category',
+        'release_date': 'category',
+        'song_name': 'category',
+        'duration': 'integer',
+        'popularity': 'integer',
+        'position': 'integer',
+        'source_date': 'datetime',
+    },
+    'artists': {
+        'artist_id': 'category',
+        'music_genre_1': 'category',
+        'music_genre_2': 'category',
+        'music_genre_3': 'category',
+    },
+}
+
+
+def cast_column(column_series, column_type):
+    """
+    DESCRIPTION: cast a column to one of the schema types
+    INPUT: column_series (Series), column_type (str)
+    OUTPUT: column_series (Series)
+    """
+    if column_type == 'category':
+        return column_series.astype('category')
+    if column_type == 'integer':
+        if column_series.isnull().any():
+            return pd.to_numeric(column_series, downcast='float')
+        return pd.to_numeric(column_series, downcast='integer')
+    if column_type == 'datetime':
+        return pd.to_datetime(column_series).astype('datetime64[ns]')
+
+    raise ValueError('unknown column type {0}'.format(column_type))
+
+
+def apply_source_schema(data_df, source_name, schema_table=SOURCE_SCHEMA_TABLE):
+    """
+    DESCRIPTION: cast the columns of a dataframe to the schema of its source
+    INPUT: data_df (DataFrame), source_name (str), schema_table (dict/optional)
+    OUTPUT: data_df (DataFrame)
+    """
+    for column, column_type in schema_table.get(source_name, {}).items():
+        if column in data_df.columns:
+            data_df[column] = cast_column(data_df[column], column_type)
+
+    return data_df
+
+
+def concat_source_frames(data_df_list, source_name, schema_table=SOURCE_SCHEMA_TABLE):
+    """
+    DESCRIPTION: concatenate dataframes of the same source keeping the schema.
+                 The categories of each column are unified, so a track repeated
+                 across many snapshots is stored once
+    INPUT: data_df_list (list of dataframes), source_name (str), schema_table (dict/optional)
+    OUTPUT: data_df (DataFrame)
+    """
+    data_df_list = [x for x in data_df_list if not x.empty]
+    if not data_df_list:
+        return pd.DataFrame()
+
+    category_column_list = [
+        column for column, column_type in schema_table.get(source_name, {}).items()
+        if column_type == 'category' and all(column in x.columns for x in data_df_list)
+    ]
+
+    data_df = pd.concat(
+        [x.drop(columns=category_column_list) for x in data_df_list],
+        ignore_index=True
+    )
+    for column in category_column_list:
+        data_df[column] = pd.Series(union_categoricals(
+            [x[column].astype('category') for x in data_df_list]
+        ))
+
+    return data_df[data_df_list[0].columns]
+
+
+def get_memory_report(data_source_table):
+    """
+    DESCRIPTION: get the memory used by each dataframe, counting the python
+                 objects they hold
+    INPUT: data_source_table (dict of dicts of dataframes, by source)
+    OUTPUT: memory_report (dict of bytes, by source and key)
+    """
+    memory_report = {}
+    for source_name, data_dict in data_source_table.items():
+        memory_report[source_name] = {
+            key: int(data_df.memory_usage(index=True, deep=True).sum())
+            for key, data_df in data_dict.items()
+        }
+
+    return memory_report
+
+
+def print_memory_report(memory_report):
+    """
+    DESCRIPTION: print the memory used by each source
+    INPUT: memory_report (dict)
+    OUTPUT: None
+    """
+    for source_name, memory_table in memory_report.items():
+        print('{0}: {1:.1f} KB in {2} frames'.format(
+            source_name, sum(memory_table.values()) / 1024, len(memory_table)
+        ))
@@ -0,0 +1,226 @@
+"""
+Command line of the music trends pipeline. Each subcommand imports only the
+modules it needs (pandas, boto3, sqlalchemy, bs4 are loaded by the commands
+that use them), so partial runs and loads start fast:
+
+    python music_trends_cli.py acquire --source billboard --run-timestamp 20240101000000
+    python music_trends_cli.py clean --source billboard --run-timestamp 20240101000000
+    python music_trends_cli.py store --source billboard dj_mag
+    python music_trends_cli.py upload-s3
+    python music_trends_cli.py load-sql --type artists spotify --db sqlite
+    python music_trends_cli.py run [--shard i/N | --workers N | --merge] [--run-timestamp ...]
+    python music_trends_cli.py daemon [--port 8765] [--once]
+    python music_trends_cli.py serve-trends [--port 8766]
+
+acquire and clean save their frames in the staging dir of the run timestamp,
+and clean or store called with the same --run-timestamp start from them
+"""
+import argparse
+import sys
+from datetime import datetime
+
+from music_trends_constants import PIPELINE_SOURCE_LIST, DAEMON_STATUS_PORT, TRENDS_QUERY_PORT
+
+SOURCE_NAME_LIST = PIPELINE_SOURCE_LIST
+LOAD_TYPE_LIST = ['artists', 'playlists', 'spotify']
+
+
+def parse_run_timestamp(run_timestamp_str):
+    """
+    DESCRIPTION: parse the --run-timestamp option
+    INPUT: run_timestamp_str (str, %Y%m%d%H%M%S, or None)
+    OUTPUT: run_timestamp (datetime or None)
+    """
+    if not run_timestamp_str:
+        return None
+
+    return datetime.strptime(run_timestamp_str, '%Y%m%d%H%M%S')
+
+
+def run_store(args):
+    """
+    DESCRIPTION: run some sources up to the step of the command (no sink
+                 runs): acquire and clean save their frames in the staging
+                 dir, store writes them in the local storage, so a later
+                 upload-s3 or load-sql picks them up
+    INPUT: args (argparse.Namespace)
+    OUTPUT: None
+    """
+    from music_trends_master import MusicTrends
+
+    music_trends = MusicTrends(
+        storage_format=args.storage_format, timestamp=parse_run_timestamp(args.run_timestamp)
+    )
+    music_trends.run_sources(args.source, args.command)
+
+
+def run_upload_s3(args):
+    """
+    DESCRIPTION: upload the files of the local storage to s3
+    INPUT: args (argparse.Namespace)
+    OUTPUT: None
+    """
+    from utilities.load_to_sql import get_storage_path
+    from utilities.s3_upload import upload_storage_files
+
+    upload_status_table = upload_storage_files(get_storage_path(), SOURCE_NAME_LIST + ['artists'])
+    for file_path, status in sorted(upload_status_table.items()):
+        print(status, file_path)
+
+
+def run_load_sql(args):
+    """
+    DESCRIPTION: load the new files of the local storage into the database
+    INPUT: args (argparse.Namespace)
+    OUTPUT: None
+    """
+    from utilities.load_to_sql import load_storage_to_sql
+
+    load_storage_to_sql(args.type, args.db)
+
+
+def run_pipeline(args):
+    """
+    DESCRIPTION: run the whole pipeline, one of its shards or the merge of the shards
+    INPUT: args (argparse.Namespace)
+    OUTPUT: None
+    """
+    from music_trends_master import MusicTrends, run_sharded
+    from utilities.playlist_registry import parse_shard
+
+    run_timestamp = parse_run_timestamp(args.run_timestamp)
+    option_table = {
+        'storage_format': args.storage_format,
+        'streaming': args.streaming,
+        'timestamp': run_timestamp,
+        'profile': args.profile,
+        'delta_snapshots': args.delta,
+    }
+
+    if args.shard:
+        if run_timestamp is None:
+            args.parser.error('--shard needs the --run-timestamp shared by all the shards')
+        shard_index, shard_count = parse_shard(args.shard)
+        MusicTrends(shard_index=shard_index, shard_count=shard_count, **option_table).run_shard()
+    elif args.merge:
+        if run_timestamp is None:
+            args.parser.error('--merge needs the --run-timestamp of the shards')
+        MusicTrends(**option_table).merge_shards()
+    elif args.workers:
+        run_sharded(args.workers, run_timestamp, args.profile)
+    else:
+        MusicTrends(**option_table).run_music_trends()
+
+
+def run_daemon(args):
+    """
+    DESCRIPTION: run the sources on their schedules in a long-running process
+    INPUT: args (argparse.Namespace)
+    OUTPUT: None
+    """
+    from music_trends_daemon import run_daemon
+
+    run_daemon(
+        args.port,
+        {'storage_format': args.storage_format, 'streaming': args.streaming, 'delta_snapshots': args.delta},
+        once=args.once
+    )
+
+
+def run_serve_trends(args):
+    """
+    DESCRIPTION: serve the cached trends queries over http until interrupted
+    INPUT: args (argparse.Namespace)
+    OUTPUT: None
+    """
+    from data_analysis.trends_query import TrendsQueryService
+
+    query_server = TrendsQueryService().serve(args.port)
+    print('serving the trends on http://127.0.0.1:{0}'.format(query_server.server_address[1]))
+    try:
+        query_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        query_server.server_close()
+
+
+def add_run_options(parser):
+    """
+    DESCRIPTION: add the options of the run subcommand
+    INPUT: parser (argparse.ArgumentParser)
+    OUTPUT: None
+    """
+    parser.add_argument('--shard', help='run only the shard i/N of the playlist registry')
+    parser.add_argument('--workers', type=int, help='run the shards in this many local processes and merge them')
+    parser.add_argument('--merge', action='store_true', help='merge the shards of --run-timestamp')
+    parser.add_argument('--streaming', action='store_true', help='stream the spotify records in batches')
+    parser.add_argument('--profile', action='store_true', help='run each stage under cProfile')
+    parser.add_argument('--delta', action='store_true', help='store the charts as deltas with periodic keyframes')
+
+
+def get_parser():
+    """
+    DESCRIPTION: build the parser of the command line
+    INPUT: None
+    OUTPUT: parser (argparse.ArgumentParser)
+    """
+    parser = argparse.ArgumentParser(description='music trends pipeline')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command, help_str in [
+            ('acquire', 'fetch the sources and save them in the staging dir'),
+            ('clean', 'clean the sources and save them in the staging dir'),
+            ('store', 'fetch, clean and store the sources in the local storage'),
+            ('run', 'run the whole pipeline'),
+    ]:
+        subparser = subparsers.add_parser(command, help=help_str)
+        subparser.add_argument('--storage-format', default='parquet', choices=['parquet', 'csv'])
+        subparser.add_argument(
+            '--run-timestamp', help='timestamp of the run (%%Y%%m%%d%%H%%M%%S), shared by the shards of a run'
+        )
+        if command == 'run':
+            add_run_options(subparser)
+            subparser.set_defaults(handler=run_pipeline, parser=subparser)
+        else:
+            subparser.add_argument(
+                '--source', nargs='+', choices=SOURCE_NAME_LIST, default=SOURCE_NAME_LIST,
+                help='sources to process (all by default)'
+            )
+            subparser.set_defaults(handler=run_store)
+
+    subparser = subparsers.add_parser('daemon', help='run the sources on their schedules, with a status server')
+    subparser.add_argument('--storage-format', default='parquet', choices=['parquet', 'csv'])
+    subparser.add_argument('--streaming', action='store_true', help='stream the spotify records in batches')
+    subparser.add_argument('--delta', action='store_true', help='store the charts as deltas with periodic keyframes')
+    subparser.add_argument('--port', type=int, default=DAEMON_STATUS_PORT, help='port of the status server')
+    subparser.add_argument('--once', action='store_true', help='run the sources that are due and exit')
+    subparser.set_defaults(handler=run_daemon)
+
+    subparser = subparsers.add_parser('serve-trends', help='serve the cached trends queries over http')
+    subparser.add_argument('--port', type=int, default=TRENDS_QUERY_PORT, help='port of the trends server')
+    subparser.set_defaults(handler=run_serve_trends)
+
+    subparser = subparsers.add_parser('upload-s3', help='upload the local storage to s3')
+    subparser.set_defaults(handler=run_upload_s3)
+
+    subparser = subparsers.add_parser('load-sql', help='load the new storage files into the database')
+    subparser.add_argument('--type', nargs='+', choices=LOAD_TYPE_LIST, default=LOAD_TYPE_LIST)
+    subparser.add_argument('--db', default='postgres', choices=['postgres', 'sqlite'])
+    subparser.set_defaults(handler=run_load_sql)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    DESCRIPTION: run a subcommand
+    INPUT: argv (list/optional, sys.argv by default)
+    OUTPUT: None
+    """
+    args = get_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
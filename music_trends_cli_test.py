@@ -0,0 +1,98 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import music_trends_cli
+
+PROJECT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestMusicTrendsCli(unittest.TestCase):
+
+    def test_parse_subcommands(self):
+        parser = music_trends_cli.get_parser()
+
+        args = parser.parse_args(['store', '--source', 'billboard', 'dj_mag'])
+        self.assertEqual(args.source, ['billboard', 'dj_mag'])
+        self.assertEqual(args.handler, music_trends_cli.run_store)
+
+        args = parser.parse_args(['load-sql', '--db', 'sqlite'])
+        self.assertEqual(args.type, music_trends_cli.LOAD_TYPE_LIST)
+
+        args = parser.parse_args(['acquire', '--source', 'spotify', '--run-timestamp', '20240101000000'])
+        self.assertEqual(args.source, ['spotify'])
+        self.assertEqual(args.handler, music_trends_cli.run_store)
+
+        args = parser.parse_args(['clean'])
+        self.assertEqual(args.source, music_trends_cli.SOURCE_NAME_LIST)
+
+        with self.assertRaises(SystemExit), mock.patch('sys.stderr'):
+            parser.parse_args(['store', '--source', 'radio'])
+
+    def test_load_sql_imports_only_what_it_needs(self):
+        code = (
+            'import sys, music_trends_cli;'
+            'import utilities.load_to_sql;'
+            'print(sorted(x for x in ["pandas", "boto3", "bs4", "sqlalchemy", "psycopg2"] if x in sys.modules))'
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=PROJECT_PATH, capture_output=True, text=True, check=True
+        ).stdout
+
+        self.assertEqual(output.strip(), '[]')
+
+    def test_master_imports_only_what_it_needs(self):
+        code = (
+            'import sys, music_trends_master;'
+            'print(sorted(x for x in ["pandas", "boto3", "bs4", "requests", "sqlalchemy"] if x in sys.modules))'
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=PROJECT_PATH, capture_output=True, text=True, check=True
+        ).stdout
+
+        self.assertEqual(output.strip(), '[]')
+
+    def test_load_sql_command(self):
+        with mock.patch('utilities.load_to_sql.load_storage_to_sql') as load_storage_to_sql:
+            music_trends_cli.main(['load-sql', '--type', 'artists', '--db', 'sqlite'])
+
+        load_storage_to_sql.assert_called_once_with(['artists'], 'sqlite')
+
+    def test_acquire_clean_store_commands(self):
+        billboard_json = {'hot_100': [
+            {'title': 'Song A', 'artist': 'Artist A', 'position': '1'},
+            {'title': 'Song B', 'artist': 'Artist B', 'position': '2'},
+        ]}
+        option_list = ['--source', 'billboard', '--storage-format', 'csv', '--run-timestamp', '20240101000000']
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch('music_trends_master.STAGING_STORAGE_PATH', tmp_dir), \
+                mock.patch('music_trends_master.METRICS_PATH', os.path.join(tmp_dir, 'metrics')), \
+                mock.patch('data_acquisition.billboard_api.BillboardAPI') as billboard_api_class, \
+                mock.patch('music_trends_master.MusicTrends.store_source_data', autospec=True) as store_source_data:
+            billboard_api_class.return_value.get_billboard_hot_100_json.return_value = billboard_json
+            staging_path = os.path.join(tmp_dir, '20240101000000')
+
+            music_trends_cli.main(['acquire'] + option_list)
+            self.assertTrue(os.path.isfile(os.path.join(staging_path, 'acquire', 'billboard', 'hot_100.csv')))
+            self.assertFalse(os.path.exists(os.path.join(staging_path, 'clean')))
+
+            # clean starts from the acquired frames, without fetching the chart again
+            music_trends_cli.main(['clean'] + option_list)
+            self.assertTrue(os.path.isfile(os.path.join(staging_path, 'clean', 'billboard', 'hot_100.csv')))
+            billboard_api_class.return_value.get_billboard_hot_100_json.assert_called_once_with()
+
+            # store starts from the cleaned frames, with their typed schema
+            music_trends_cli.main(['store'] + option_list)
+            billboard_api_class.return_value.get_billboard_hot_100_json.assert_called_once_with()
+            music_trends, source_name = store_source_data.call_args[0]
+            self.assertEqual(source_name, 'billboard')
+            data_df = music_trends.billboard_data['hot_100']
+            self.assertEqual(list(data_df['position']), [1, 2])
+            self.assertEqual(str(data_df['source_date'].dtype), 'datetime64[ns]')
+
+
+if __name__ == '__main__':
+    unittest.main()
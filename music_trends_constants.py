@@ -1,6 +1,38 @@
 """
 Config file to store constants used in the music trends project
 """
+import os
+
+PROJECT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Local sqlite file that keeps state between runs (known artists, etc.)
+LOCAL_CACHE_PATH = os.path.join(PROJECT_PATH, 'cache_music_trends')
+LOCAL_CACHE_DB = os.path.join(LOCAL_CACHE_PATH, 'music_trends_cache.sqlite3')
+
+# Local sqlite file with the trend aggregates, updated after each ingest
+TRENDS_DB = os.path.join(LOCAL_CACHE_PATH, 'music_trends_trends.sqlite3')
+# Weight of the newest snapshot in the rolling (EWMA) popularity of the tracks
+TREND_POPULARITY_ALPHA = 0.3
+# Read side of the trends: results cached for TRENDS_CACHE_TTL seconds (at most
+# TRENDS_CACHE_MAX_ENTRIES of them), all dropped when the generation file is
+# bumped by a run that folded new snapshots, and port of its http server
+TRENDS_GENERATION_PATH = os.path.join(LOCAL_CACHE_PATH, 'music_trends_trends.generation')
+TRENDS_CACHE_TTL = 300
+TRENDS_CACHE_MAX_ENTRIES = 512
+TRENDS_QUERY_PORT = 8766
+
+# Local sqlite file with the index of the spotify artists and tracks names, used
+# to link the billboard and dj mag chart rows to their spotify ids
+ENTITY_INDEX_DB = os.path.join(LOCAL_CACHE_PATH, 'music_trends_entities.sqlite3')
+# MinHash signatures of the names: MINHASH_BANDS bands of MINHASH_ROWS hashes
+# (names with a jaccard from about 0.5 share a bucket, the weaker overlaps rarely)
+MINHASH_BANDS = 10
+MINHASH_ROWS = 3
+# Most LSH candidates compared to a name, the ones sharing the most buckets first
+ENTITY_MAX_CANDIDATES = 50
+# Lowest similarity (jaccard of the names 3-grams) accepted as a match
+ENTITY_MATCH_THRESHOLD = 0.5
+
 TOP_50_PLAYLIST_ID_TABLE = {
     'playlist_GLOBAL': '37i9dQZEVXbMDoHDwVN2tF',
     'playlist_AUS': '37i9dQZEVXbKNHh6NIXu36',
@@ -12,3 +44,156 @@ TOP_50_PLAYLIST_ID_TABLE = {
     'playlist_USA': '37i9dQZEVXbLRQDuF5jeBp',
     'playlist_ZAF': '37i9dQZEVXbMH2jvi6jvjk',
 }
+
+# Registry of the playlists to fetch (json with playlist_name, playlist_id,
+# market and chart_type of each one). TOP_50_PLAYLIST_ID_TABLE is used when
+# the file does not exist
+PLAYLIST_REGISTRY_PATH = os.path.join(PROJECT_PATH, 'playlist_registry.json')
+
+# Outputs of the sharded runs, merged into one snapshot per run timestamp
+SHARD_STORAGE_PATH = os.path.join(PROJECT_PATH, 'shard_music_trends')
+# Frames saved by the partial runs (acquire, clean) for a later step of the same run timestamp
+STAGING_STORAGE_PATH = os.path.join(PROJECT_PATH, 'staging_music_trends')
+
+# Run reports (json) and Prometheus textfile of each run
+METRICS_PATH = os.path.join(PROJECT_PATH, 'metrics_music_trends')
+# Upper bounds (seconds) of the latency histograms buckets
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Number of pipeline stages (sources and sinks) run concurrently
+PIPELINE_MAX_WORKERS = 4
+
+# Sources of the pipeline (the spotify acquisition also brings the artists)
+PIPELINE_SOURCE_LIST = ['billboard', 'dj_mag', 'spotify']
+
+# Daemon mode: seconds between the runs of each source, seconds before a
+# failed source is tried again, and port of its health/status endpoint
+DAEMON_SCHEDULE_TABLE = {
+    'spotify': 3600,
+    'billboard': 86400,
+    'dj_mag': 604800,
+}
+DAEMON_RETRY_SECONDS = 300
+DAEMON_STATUS_PORT = 8765
+
+# Number of playlists fetched concurrently from Spotify (one keep-alive pool)
+SPOTIFY_MAX_WORKERS = 16
+# Seconds before its expiry a cached spotify token is no longer used
+SPOTIFY_TOKEN_EXPIRY_MARGIN = 60
+# Token bucket pacing every spotify call (calls per second), shared by the
+# processes of a run through SPOTIFY_RATE_LIMIT_STATE. The rate grows by
+# increase_step after each success and is multiplied by decrease_factor on a 429
+SPOTIFY_RATE_LIMIT = {
+    'rate': 10.0,
+    'capacity': 10,
+    'min_rate': 1.0,
+    'max_rate': 30.0,
+    'increase_step': 0.1,
+    'decrease_factor': 0.5,
+}
+SPOTIFY_RATE_LIMIT_STATE = os.path.join(LOCAL_CACHE_PATH, 'spotify_rate_limit.json')
+# Retries of a spotify call (429, 5xx and connection errors), with jittered
+# exponential backoff from SPOTIFY_BACKOFF_BASE up to SPOTIFY_BACKOFF_CAP seconds
+SPOTIFY_MAX_RETRIES = 5
+SPOTIFY_BACKOFF_BASE = 0.5
+SPOTIFY_BACKOFF_CAP = 30.0
+# Ids per request of the spotify several-items endpoints (their maximum)
+SPOTIFY_BATCH_SIZE_TABLE = {
+    'artists': 50,
+    'tracks': 50,
+    'albums': 20,
+    'audio-features': 100,
+}
+# Audio features kept in the tracks enrichment
+AUDIO_FEATURE_LIST = [
+    'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+    'instrumentalness', 'liveness', 'valence', 'tempo', 'time_signature',
+]
+
+# Seconds a scraped page is served from the local http cache without revalidation
+HTML_CACHE_TTL_TABLE = {
+    'billboard': 24 * 60 * 60,
+    'dj_mag': 7 * 24 * 60 * 60,
+}
+HTTP_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Columns identifying a row of each table, used to make the sql loads idempotent
+SQL_UPSERT_KEY_TABLE = {
+    'tendencias_musicais_app_spotifydata': ['playlist_id_id', 'source_date', 'position'],
+    'tendencias_musicais_app_artists': ['artist_id'],
+    'tendencias_musicais_app_playlists': ['playlist_id'],
+}
+# Rows sent per COPY FROM STDIN call
+SQL_COPY_CHUNK_ROWS = 100000
+
+# Format of the files in the local storage: parquet (compressed, typed) or csv
+STORAGE_FORMAT = 'parquet'
+PARQUET_COMPRESSION = 'zstd'
+# Rows a parquet writer holds while a column has no value yet (then it is written as strings)
+PARQUET_MAX_PENDING_ROWS = 10000
+# Records per batch in the streaming mode (HTTP pages -> cleaning -> storage)
+STREAMING_BATCH_SIZE = 1000
+
+# Parquet store of the snapshots history, partitioned by source, market and month
+SNAPSHOT_STORE_PATH = os.path.join(PROJECT_PATH, 'snapshots_music_trends')
+# Columns with the track and artist ids of each source, used by the history queries
+SNAPSHOT_ENTITY_COLUMNS = {
+    'spotify': ['track_id', 'main_artist_id_id'],
+    'billboard': ['track_id', 'artist_id'],
+    'dj_mag': ['artist_id'],
+}
+# Market of the charts that are not spotify playlists
+CHART_MARKET_TABLE = {
+    'billboard': 'USA',
+    'dj_mag': 'GLOBAL',
+}
+# Rows per row group of the compacted partitions
+SNAPSHOT_ROW_GROUP_SIZE = 10000
+# Delta snapshots: columns identifying a chart row across the snapshots of
+# each source. A stored delta only has the rows that entered, left or changed
+# since the previous snapshot of the same source and key, and every
+# SNAPSHOT_KEYFRAME_INTERVAL snapshots a full one (keyframe) is stored
+SNAPSHOT_DELTA_KEY_TABLE = {
+    'spotify': ['track_id'],
+    'billboard': ['title', 'artist'],
+    'dj_mag': ['artist'],
+}
+SNAPSHOT_KEYFRAME_INTERVAL = 24
+
+# S3 upload of the storage files
+S3_BUCKET = 'storage-tendencias-musicais'
+S3_MAX_WORKERS = 8
+# None, 'gzip' or 'zstd' (needs the zstandard package)
+S3_COMPRESSION = None
+
+# Cleaning rules of each source, applied by data_cleaning.cleaning_engine
+#   - lowercase: columns made lowercase
+#   - special_chars: columns transliterated to ascii
+#   - music_name: columns with music names to remove the (feat. ...) info from
+#   - metadata: add the source_date column
+CLEANING_RULES_TABLE = {
+    'billboard': {
+        'lowercase': ['title', 'artist'],
+        'special_chars': [],
+        'music_name': [],
+        'metadata': True,
+    },
+    'dj_mag': {
+        'lowercase': ['artist'],
+        'special_chars': [],
+        'music_name': [],
+        'metadata': True,
+    },
+    'spotify': {
+        'lowercase': ['all_artists', 'song_name'],
+        'special_chars': [],
+        'music_name': ['song_name'],
+        'metadata': True,
+    },
+    'artists': {
+        'lowercase': ['name', 'music_genre_1', 'music_genre_2', 'music_genre_3'],
+        'special_chars': [],
+        'music_name': [],
+        'metadata': False,
+    },
+}
@@ -0,0 +1,347 @@
+"""
+Daemon mode of the music trends pipeline: one long-running process runs each
+source on its own schedule (e.g. spotify hourly, dj mag weekly) and keeps its
+clients warm between the runs (http sessions, spotify token, known artists
+and playlist states, s3 client, database engine, trends and entity indexes),
+so each tick only does the incremental work. A small http server reports its
+health, the status of each source and the metrics of the last run
+"""
+import json
+import signal
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from music_trends_constants import DAEMON_SCHEDULE_TABLE, DAEMON_RETRY_SECONDS, DAEMON_STATUS_PORT
+from utilities.local_cache import LocalCache
+from utilities.metrics import METRICS
+
+# attributes of MusicTrends kept by the daemon from one run to the next
+WARM_ATTRIBUTE_LIST = [
+    'spotify_api', 'billboard_api', 'dj_mag_api', 's3_uploader',
+    'trend_aggregator', 'entity_index', 'load_manifest', 'snapshot_deltas', 'snapshot_store',
+]
+
+
+def format_timestamp(timestamp):
+    """
+    DESCRIPTION: format an epoch timestamp for the status report
+    INPUT: timestamp (float or None)
+    OUTPUT: timestamp_str (str or None)
+    """
+    if timestamp is None:
+        return None
+
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+
+class MusicTrendsDaemon():
+    """
+    DESCRIPTION: Scheduler of the pipeline runs in a long-running process. On
+                 each tick the sources whose interval has elapsed since their
+                 last successful run are run together in one MusicTrends
+                 run, which gets the clients kept from the previous runs. The
+                 last successful run of each source is saved in the local
+                 cache, so a restarted daemon keeps the schedule
+    ATTRIBUTES:
+        - schedule_table (dict of seconds between runs by source)
+        - retry_seconds (int): wait before a failed source is run again
+        - run_option_table (dict): options of each MusicTrends run
+        - state_cache (LocalCache): last successful run of each source
+        - warm_object_table (dict of the objects kept between the runs)
+        - source_status_table (dict of the status of each source)
+        - retry_table (dict of the next attempt of each failed source)
+        - last_run_report (dict)
+        - started_at (float)
+        - stop_event (threading.Event)
+        - lock (threading.Lock)
+    METHODS:
+        - get_next_run
+        - get_due_sources
+        - create_music_trends
+        - keep_warm_objects
+        - tick
+        - run_forever
+        - stop
+        - get_status
+        - is_healthy
+        - serve
+    """
+    def __init__(self, schedule_table=DAEMON_SCHEDULE_TABLE, retry_seconds=DAEMON_RETRY_SECONDS,
+                 run_option_table=None, state_cache=None):
+        """
+        Constructor method for MusicTrendsDaemon
+        """
+        self.schedule_table = dict(schedule_table)
+        self.retry_seconds = retry_seconds
+        self.run_option_table = dict(run_option_table or {})
+        self.state_cache = state_cache if state_cache is not None else LocalCache()
+        self.warm_object_table = {}
+        self.source_status_table = {
+            source_name: {'status': 'pending', 'last_run': None, 'duration': None, 'error': None}
+            for source_name in self.schedule_table
+        }
+        self.retry_table = {}
+        self.last_run_report = {}
+        self.started_at = time.time()
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+        for source_name, source_status in self.source_status_table.items():
+            last_run = self.state_cache.get_meta('daemon_last_run_{0}'.format(source_name))
+            if last_run is not None:
+                source_status.update({'status': 'ok', 'last_run': float(last_run)})
+
+
+    def get_next_run(self, source_name):
+        """
+        DESCRIPTION: Get when a source is due: its interval after its last
+                     successful run, or retry_seconds after a failure
+        INPUT: source_name (str)
+        OUTPUT: next_run (float, epoch seconds)
+        """
+        if source_name in self.retry_table:
+            return self.retry_table[source_name]
+
+        last_run = self.source_status_table[source_name]['last_run']
+        if last_run is None:
+            return 0.0
+
+        return last_run + self.schedule_table[source_name]
+
+
+    def get_due_sources(self, now=None):
+        """
+        DESCRIPTION: Get the sources due at a time
+        INPUT: now (float/optional, epoch seconds)
+        OUTPUT: source_name_list (list)
+        """
+        now = time.time() if now is None else now
+
+        return [x for x in self.schedule_table if self.get_next_run(x) <= now]
+
+
+    def create_music_trends(self, source_name_list):
+        """
+        DESCRIPTION: Create the run of some sources with the warm objects of
+                     the previous runs
+        INPUT: source_name_list (list)
+        OUTPUT: music_trends (MusicTrends)
+        """
+        from music_trends_master import MusicTrends
+
+        music_trends = MusicTrends(source_name_list=source_name_list, **self.run_option_table)
+        for attribute_name, warm_object in self.warm_object_table.items():
+            setattr(music_trends, attribute_name, warm_object)
+
+        # the playlist states of a failed run were not committed, so they are fetched again
+        if music_trends.spotify_api is not None:
+            music_trends.spotify_api.pending_playlist_states = {}
+
+        return music_trends
+
+
+    def keep_warm_objects(self, music_trends):
+        """
+        DESCRIPTION: Keep the objects a run created for the next runs
+        INPUT: music_trends (MusicTrends)
+        OUTPUT: None
+        """
+        for attribute_name in WARM_ATTRIBUTE_LIST:
+            warm_object = getattr(music_trends, attribute_name)
+            if warm_object is not None:
+                self.warm_object_table[attribute_name] = warm_object
+
+
+    def tick(self, now=None):
+        """
+        DESCRIPTION: Run the sources that are due, if any, and record their status
+        INPUT: now (float/optional, epoch seconds)
+        OUTPUT: run_report (dict, None when no source was due)
+        """
+        source_name_list = self.get_due_sources(now)
+        if not source_name_list:
+            return None
+
+        with self.lock:
+            for source_name in source_name_list:
+                self.source_status_table[source_name]['status'] = 'running'
+
+        start = time.time()
+        music_trends = self.create_music_trends(source_name_list)
+        run_report = {'status': 'error'}
+        error = None
+        try:
+            run_report = music_trends.run_music_trends()
+        except Exception as run_error:
+            error = '{0}: {1}'.format(type(run_error).__name__, run_error)
+            print('daemon run of {0} failed: {1}'.format(source_name_list, error))
+        finally:
+            self.keep_warm_objects(music_trends)
+
+        end = time.time()
+        with self.lock:
+            self.last_run_report = music_trends.run_report
+            for source_name in source_name_list:
+                source_status = self.source_status_table[source_name]
+                source_status.update({'duration': round(end - start, 3), 'error': error})
+                if error is None:
+                    source_status.update({'status': 'ok', 'last_run': start})
+                    self.retry_table.pop(source_name, None)
+                else:
+                    source_status['status'] = 'error'
+                    self.retry_table[source_name] = end + self.retry_seconds
+
+        if error is None:
+            for source_name in source_name_list:
+                self.state_cache.set_meta('daemon_last_run_{0}'.format(source_name), start)
+
+        return run_report
+
+
+    def run_forever(self, max_wait_seconds=60):
+        """
+        DESCRIPTION: Tick until stopped, sleeping until the next source is due
+        INPUT: max_wait_seconds (float/optional): longest sleep between ticks
+        OUTPUT: None
+        """
+        while not self.stop_event.is_set():
+            self.tick()
+            next_run = min(self.get_next_run(x) for x in self.schedule_table)
+            self.stop_event.wait(min(max(next_run - time.time(), 0.0), max_wait_seconds))
+
+
+    def stop(self, *args):
+        """
+        DESCRIPTION: Stop the daemon after the current tick (also a signal handler)
+        INPUT: args (signal number and frame when used as a handler)
+        OUTPUT: None
+        """
+        self.stop_event.set()
+
+
+    def get_status(self):
+        """
+        DESCRIPTION: Get the status of the daemon and of each source
+        INPUT: None
+        OUTPUT: status_table (dict)
+        """
+        with self.lock:
+            source_table = {}
+            for source_name, source_status in self.source_status_table.items():
+                source_table[source_name] = dict(
+                    source_status,
+                    last_run=format_timestamp(source_status['last_run']),
+                    next_run=format_timestamp(self.get_next_run(source_name)),
+                    interval_seconds=self.schedule_table[source_name],
+                )
+            last_run_report = {
+                key: self.last_run_report.get(key) for key in ['run_name', 'run_timestamp', 'status']
+            }
+
+        return {
+            'healthy': self.is_healthy(),
+            'started_at': format_timestamp(self.started_at),
+            'uptime_seconds': round(time.time() - self.started_at, 3),
+            'warm_objects': sorted(self.warm_object_table),
+            'sources': source_table,
+            'last_run': last_run_report,
+        }
+
+
+    def is_healthy(self):
+        """
+        DESCRIPTION: Check the daemon is running (a failed source is reported
+                     in the status but is retried, so it is not unhealthy)
+        INPUT: None
+        OUTPUT: is_healthy (bool)
+        """
+        return not self.stop_event.is_set()
+
+
+    def serve(self, port=DAEMON_STATUS_PORT, host='127.0.0.1'):
+        """
+        DESCRIPTION: Start the status server in a background thread
+        INPUT: port (int/optional, 0 for any free port), host (str/optional)
+        OUTPUT: status_server (ThreadingHTTPServer)
+        """
+        status_server = ThreadingHTTPServer((host, port), StatusRequestHandler)
+        status_server.daemon_threads = True
+        status_server.music_trends_daemon = self
+        threading.Thread(target=status_server.serve_forever, daemon=True).start()
+
+        return status_server
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """
+    DESCRIPTION: Handler of the status server: /health (200 or 503), /status
+                 (json) and /metrics (Prometheus text of the last run)
+    METHODS:
+        - do_GET
+        - send_body
+        - log_message
+    """
+    def do_GET(self):
+        """
+        DESCRIPTION: Answer a status request
+        INPUT: None
+        OUTPUT: None
+        """
+        music_trends_daemon = self.server.music_trends_daemon
+        path = self.path.split('?', 1)[0]
+        if path == '/health':
+            is_healthy = music_trends_daemon.is_healthy()
+            self.send_body(200 if is_healthy else 503, 'ok\n' if is_healthy else 'stopping\n', 'text/plain')
+        elif path == '/status':
+            self.send_body(200, json.dumps(music_trends_daemon.get_status(), default=str), 'application/json')
+        elif path == '/metrics':
+            self.send_body(200, METRICS.get_prometheus_text(), 'text/plain; version=0.0.4')
+        else:
+            self.send_body(404, 'not found\n', 'text/plain')
+
+
+    def send_body(self, status, body, content_type):
+        """
+        DESCRIPTION: Send an answer
+        INPUT: status (int), body (str), content_type (str)
+        OUTPUT: None
+        """
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        """
+        DESCRIPTION: Do not log each status request
+        INPUT: format (str), args (tuple)
+        OUTPUT: None
+        """
+        return
+
+
+def run_daemon(port=DAEMON_STATUS_PORT, run_option_table=None, once=False):
+    """
+    DESCRIPTION: Run the daemon with its status server until SIGTERM or SIGINT,
+                 or a single tick with once
+    INPUT: port (int/optional), run_option_table (dict/optional), once (bool/optional)
+    OUTPUT: None
+    """
+    music_trends_daemon = MusicTrendsDaemon(run_option_table=run_option_table)
+    if once:
+        music_trends_daemon.tick()
+        return
+
+    status_server = music_trends_daemon.serve(port)
+    signal.signal(signal.SIGTERM, music_trends_daemon.stop)
+    signal.signal(signal.SIGINT, music_trends_daemon.stop)
+    try:
+        music_trends_daemon.run_forever()
+    finally:
+        status_server.shutdown()
+        status_server.server_close()
@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+from unittest import mock
+
+from music_trends_daemon import MusicTrendsDaemon, WARM_ATTRIBUTE_LIST
+from utilities.local_cache import LocalCache
+
+
+class FakeMusicTrends():
+    """
+    MusicTrends recording its runs, creating the clients lazily like the real one
+    """
+    run_list = []
+    fail = False
+
+    def __init__(self, source_name_list=None, **option_table):
+        self.source_name_list = source_name_list
+        self.run_report = {}
+        for attribute_name in WARM_ATTRIBUTE_LIST:
+            setattr(self, attribute_name, None)
+
+    def run_music_trends(self):
+        if self.spotify_api is None:
+            self.spotify_api = mock.Mock(pending_playlist_states={})
+        FakeMusicTrends.run_list.append((self.source_name_list, self.spotify_api))
+        self.run_report = {'run_name': 'run', 'status': 'error' if self.fail else 'ok'}
+        if self.fail:
+            raise RuntimeError('source down')
+        return self.run_report
+
+
+class TestMusicTrendsDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_cache = LocalCache(os.path.join(self.tmp_dir.name, 'cache.sqlite3'))
+        FakeMusicTrends.run_list = []
+        FakeMusicTrends.fail = False
+        patcher = mock.patch('music_trends_master.MusicTrends', FakeMusicTrends)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.state_cache.connection.close()
+        self.tmp_dir.cleanup()
+
+    def get_daemon(self):
+        return MusicTrendsDaemon(
+            schedule_table={'spotify': 3600, 'dj_mag': 604800}, retry_seconds=300, state_cache=self.state_cache
+        )
+
+    def test_schedules_and_warm_clients(self):
+        music_trends_daemon = self.get_daemon()
+        self.assertIsNotNone(music_trends_daemon.tick())
+        self.assertIsNone(music_trends_daemon.tick())
+
+        last_run = music_trends_daemon.source_status_table['spotify']['last_run']
+        music_trends_daemon.tick(last_run + 3601)
+
+        (first_sources, first_api), (second_sources, second_api) = FakeMusicTrends.run_list
+        self.assertEqual(first_sources, ['spotify', 'dj_mag'])
+        self.assertEqual(second_sources, ['spotify'])
+        # the spotify client (session, token, caches) is kept between the runs
+        self.assertIs(first_api, second_api)
+
+        # a restarted daemon keeps the schedule
+        self.assertEqual(self.get_daemon().get_due_sources(), [])
+
+    def test_failed_run_is_retried(self):
+        FakeMusicTrends.fail = True
+        music_trends_daemon = self.get_daemon()
+        music_trends_daemon.tick()
+
+        status_table = music_trends_daemon.get_status()
+        self.assertEqual(status_table['sources']['spotify']['status'], 'error')
+        self.assertIn('source down', status_table['sources']['spotify']['error'])
+        self.assertEqual(music_trends_daemon.get_due_sources(), [])
+
+        FakeMusicTrends.fail = False
+        music_trends_daemon.tick(music_trends_daemon.get_next_run('spotify'))
+        self.assertEqual(music_trends_daemon.source_status_table['spotify']['status'], 'ok')
+        self.assertEqual(len(FakeMusicTrends.run_list), 2)
+
+    def test_status_server(self):
+        music_trends_daemon = self.get_daemon()
+        music_trends_daemon.tick()
+        status_server = music_trends_daemon.serve(port=0)
+        self.addCleanup(status_server.server_close)
+        self.addCleanup(status_server.shutdown)
+        url = 'http://127.0.0.1:{0}'.format(status_server.server_address[1])
+
+        with urllib.request.urlopen(url + '/health') as response:
+            self.assertEqual(response.status, 200)
+        with urllib.request.urlopen(url + '/status') as response:
+            status_table = json.loads(response.read())
+        self.assertEqual(status_table['sources']['dj_mag']['status'], 'ok')
+        self.assertEqual(status_table['warm_objects'], ['spotify_api'])
+
+        music_trends_daemon.stop()
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(url + '/health')
+        self.assertEqual(context.exception.code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
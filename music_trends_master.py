@@ -1,18 +1,25 @@
 """
 Master script for the different processes of the music trend analysis software
 """
+import json
 import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-import boto3
-import pandas as pd
 
 from credentials import SPOTIFY_CLIENT_ID, SPOTIFY_SECRET
-from music_trends_constants import TOP_50_PLAYLIST_ID_TABLE
-from data_acquisition.billboard_api import BillboardAPI
-from data_acquisition.djmag_api import DJMagAPI
-from data_acquisition.spotify_api import SpotifyAPI
-from data_cleaning.cleaning_functions import clean_music_name, make_cols_lowercase, add_metadata
-from utilities.load_to_sql import load_files_in_storage
+from music_trends_constants import PIPELINE_MAX_WORKERS, STORAGE_FORMAT, STREAMING_BATCH_SIZE, \
+    SHARD_STORAGE_PATH, STAGING_STORAGE_PATH, METRICS_PATH, CHART_MARKET_TABLE, PIPELINE_SOURCE_LIST, SNAPSHOT_DELTA_KEY_TABLE
+from utilities.local_cache import LoadManifest, PlaylistStateCache
+from utilities.metrics import METRICS
+from utilities.load_to_sql import TABLE_LOOKUP, get_engine, get_new_storage_files, load_with_manifest, \
+    read_storage_frame
+from utilities.playlist_registry import PlaylistRegistry
+from utilities.s3_upload import S3Uploader, upload_storage_files
+from utilities.stage_scheduler import StageScheduler
+from utilities.storage_formats import get_file_checksum, get_file_storage_format, open_frame_writer, \
+    read_frame, write_frame
 
 
 class MusicTrends():
@@ -24,9 +31,41 @@ class MusicTrends():
         - dj_mag_data: dict of dataframes
         - billboard_data: dict of dataframes
         - spotify_playlists_data: dict of dataframes
+        - spotify_api: SpotifyAPI used in the acquisition
+        - billboard_api, dj_mag_api: BillboardAPI and DJMagAPI used in the acquisition
+        - s3_uploader: S3Uploader of the storage files
+        - source_name_list: list, sources acquired by this run (all by default)
+        - run_report: dict with the stages timing and memory use of the last run
+        - storage_format: str, format of the stored files (parquet or csv)
+        - in_memory_handoff: bool, load the sql from the frames in memory
+          instead of reading the stored files back
+        - stored_file_table: dict of the files written in this run, by source
+        - load_manifest: LoadManifest of the files already loaded in the database
+        - streaming: bool, stream the spotify records in batches from the api
+          to the storage files instead of holding whole dataframes
+        - batch_size: int, records per batch in the streaming mode
+        - shard_index, shard_count: int, part of the playlist registry this run handles
+        - playlists_table: dict of the playlists fetched by this run
+        - shard_path: str, where the shards of this run timestamp write their outputs
+        - shard_playlist_states: dict of playlist states saved by the shards,
+          committed by the merge step
+        - metrics_path: str, where the run reports and the Prometheus textfile go
+        - profile: bool, run each stage under cProfile (stats in metrics_path)
+        - run_name: str, name of the last run in its reports (run, shard_i or merge)
+        - market_table: dict of the market of each playlist of the registry
+        - chart_table: dict of the (market, chart_type) of each playlist of the registry
+        - trend_aggregator: TrendAggregator folding each run into the trends
+        - entity_index: EntityIndex linking the chart rows to the spotify ids
+        - snapshot_store: SnapshotStore keeping the history of the snapshots
+        - delta_snapshots: bool, store the charts as deltas against their
+          previous snapshot, with periodic keyframes
+        - snapshot_deltas: SnapshotDeltaIndex of the stored keyframes and deltas
     """
-    def __init__(self):
-        self.timestamp = datetime.now()
+    def __init__(self, storage_format=STORAGE_FORMAT, in_memory_handoff=True,
+                 streaming=False, batch_size=STREAMING_BATCH_SIZE, timestamp=None,
+                 shard_index=0, shard_count=1, registry=None, profile=False, source_name_list=None,
+                 delta_snapshots=False):
+        self.timestamp = timestamp if timestamp is not None else datetime.now()
         self.timestamp_str_compact = self.timestamp.strftime('%Y%m%d%H%M%S')
         self.dj_mag_data = {}
         self.billboard_data = {}
@@ -42,21 +81,401 @@ class MusicTrends():
             os.path.dirname(os.path.abspath(__file__)),
             'storage_music_trends'
         )
+        self.archive_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'archive_music_trends'
+        )
         self.sql_upload_list = ['artists', 'playlists', 'spotify']
+        self.spotify_api = None
+        self.billboard_api = None
+        self.dj_mag_api = None
+        self.s3_uploader = None
+        self.source_name_list = list(source_name_list or PIPELINE_SOURCE_LIST)
+        self.run_report = {}
+        self.storage_format = storage_format
+        # the streamed batches are not kept in memory, so they are loaded from the files
+        self.in_memory_handoff = in_memory_handoff and not streaming
+        self.streaming = streaming
+        self.batch_size = batch_size
+        self.stored_file_table = {source_name: {} for source_name in self.data_source_table}
+        self.load_manifest = None
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        if registry is None:
+            registry = PlaylistRegistry()
+        self.playlists_table = registry.get_playlists_table(shard_index, shard_count)
+        self.market_table = {x['playlist_name']: x['market'] for x in registry.get_entries()}
+        self.chart_table = {x['playlist_name']: (x['market'], x['chart_type']) for x in registry.get_entries()}
+        self.trend_aggregator = None
+        self.entity_index = None
+        self.snapshot_store = None
+        # the streamed batches and the shard outputs are not whole snapshots
+        self.delta_snapshots = delta_snapshots and not streaming
+        self.snapshot_deltas = None
+        self.shard_path = os.path.join(SHARD_STORAGE_PATH, self.timestamp_str_compact)
+        self.shard_playlist_states = {}
+        self.metrics_path = METRICS_PATH
+        self.profile = profile
+        self.run_name = 'run'
 
 
     def run_music_trends(self):
         """
-        DESCRIPTION: runs all the methods needed to get the music trends
+        DESCRIPTION: runs all the methods needed to get the music trends. The
+                     stages run as a dependency graph, so independent sources
+                     and sinks run concurrently, and the timing breakdown of the
+                     run is printed at the end
+        INPUT: None
+        OUTPUT: run_report (dict)
+        """
+        self.run_name = 'run'
+
+        return self.run_stage_scheduler(self.build_stage_scheduler())
+
+
+    def run_sources(self, source_name_list, last_step='store'):
+        """
+        DESCRIPTION: Run a part of the pipeline for some sources only, e.g. a
+                     cron job refreshing one chart: acquisition, then cleaning
+                     and storage depending on last_step. No sink runs. The
+                     acquire and clean steps save their frames in the staging
+                     path of the run timestamp, and a later step of the same
+                     run timestamp starts from them instead of fetching again
+        INPUT: source_name_list (list of billboard, dj_mag, spotify),
+               last_step (str/optional: acquire, clean or store)
+        OUTPUT: run_report (dict)
+        """
+        step_list = ['acquire', 'clean', 'store']
+        if last_step not in step_list:
+            raise ValueError('last_step must be one of {0}'.format(step_list))
+        self.run_name = last_step
+
+        acquisition_table = {
+            'billboard': self.acquire_billboard_data,
+            'dj_mag': self.acquire_dj_mag_data,
+            'spotify': self.acquire_spotify_data,
+        }
+        scheduler = self.create_stage_scheduler()
+        for source_name in source_name_list:
+            # the spotify acquisition also brings the artists of its tracks
+            data_name_list = [source_name] + (['artists'] if source_name == 'spotify' else [])
+            staged_step = self.get_staged_step(source_name, step_list[:step_list.index(last_step)])
+            if staged_step is None:
+                first_stage = 'acquire_{0}'.format(source_name)
+                scheduler.add_stage(first_stage, acquisition_table[source_name])
+            else:
+                first_stage = 'load_{0}_{1}'.format(staged_step, source_name)
+                scheduler.add_stage(
+                    first_stage,
+                    lambda staged_step=staged_step, data_name_list=data_name_list: [
+                        self.load_staged_frames(staged_step, x) for x in data_name_list
+                    ]
+                )
+
+            for data_name in data_name_list:
+                last_stage = first_stage
+                if last_step != 'acquire' and staged_step != 'clean':
+                    last_stage = 'clean_{0}'.format(data_name)
+                    scheduler.add_stage(
+                        last_stage,
+                        lambda data_name=data_name: self.clean_source_data(data_name),
+                        depends_on=[first_stage]
+                    )
+                if last_step == 'store':
+                    scheduler.add_stage(
+                        'store_{0}'.format(data_name),
+                        lambda data_name=data_name: self.store_source_data(data_name),
+                        depends_on=[last_stage]
+                    )
+                else:
+                    scheduler.add_stage(
+                        'save_{0}_{1}'.format(last_step, data_name),
+                        lambda data_name=data_name: self.save_staged_frames(last_step, data_name),
+                        depends_on=[last_stage]
+                    )
+
+        return self.run_stage_scheduler(scheduler)
+
+
+    def get_staging_path(self, step_name, data_name):
+        """
+        DESCRIPTION: Get the staging directory of the frames of a source saved
+                     by a step of this run timestamp
+        INPUT: step_name (str: acquire or clean), data_name (str)
+        OUTPUT: staging_path (str)
+        """
+        return os.path.join(STAGING_STORAGE_PATH, self.timestamp_str_compact, step_name, data_name)
+
+
+    def get_staged_step(self, source_name, step_name_list):
+        """
+        DESCRIPTION: Find the latest of some steps that saved the frames of a
+                     source for this run timestamp
+        INPUT: source_name (str), step_name_list (list, in pipeline order)
+        OUTPUT: step_name (str, None when no step saved them)
+        """
+        for step_name in reversed(step_name_list):
+            if os.path.isdir(self.get_staging_path(step_name, source_name)):
+                return step_name
+
+        return None
+
+
+    def save_staged_frames(self, step_name, data_name):
+        """
+        DESCRIPTION: Save the frames of a source after a step in the staging
+                     path, one file per key (the directory is created even
+                     without frames, so the step is known to be done)
+        INPUT: step_name (str: acquire or clean), data_name (str)
+        OUTPUT: file_path_list (list)
+        """
+        staging_path = self.get_staging_path(step_name, data_name)
+        os.makedirs(staging_path, exist_ok=True)
+
+        file_path_list = []
+        for key, data_df in self.data_source_table[data_name].items():
+            file_path = write_frame(data_df, os.path.join(staging_path, key), self.storage_format)
+            file_path_list.append(file_path)
+            METRICS.inc('bytes_total', os.path.getsize(file_path), stage=step_name, source=data_name)
+
+        return file_path_list
+
+
+    def load_staged_frames(self, step_name, data_name):
+        """
+        DESCRIPTION: Load the frames of a source saved by a step in the
+                     staging path. The cleaned frames get their typed schema
+                     back (a csv file does not keep it)
+        INPUT: step_name (str: acquire or clean), data_name (str)
+        OUTPUT: None
+        """
+        from data_cleaning.schemas import apply_source_schema
+
+        staging_path = self.get_staging_path(step_name, data_name)
+        if not os.path.isdir(staging_path):
+            return
+
+        data_dict = self.data_source_table[data_name]
+        for file_name in sorted(os.listdir(staging_path)):
+            if get_file_storage_format(file_name) is None:
+                continue
+
+            data_df = read_frame(os.path.join(staging_path, file_name))
+            if step_name == 'clean':
+                data_df = apply_source_schema(data_df, data_name)
+            data_dict[os.path.splitext(file_name)[0]] = data_df
+        self.record_rows('load_{0}'.format(step_name), data_name)
+
+
+    def run_stage_scheduler(self, scheduler):
+        """
+        DESCRIPTION: Run the stages of a scheduler, print the timing breakdown
+                     and the memory report, and export the run metrics (also
+                     when a stage fails)
+        INPUT: scheduler (StageScheduler)
+        OUTPUT: run_report (dict)
+        """
+        METRICS.reset()
+        self.run_report = {'run_name': self.run_name, 'run_timestamp': self.timestamp_str_compact}
+        run_status = 'error'
+        try:
+            self.run_report.update(scheduler.run())
+            run_status = 'ok'
+        finally:
+            self.run_report['status'] = run_status
+            self.export_metrics()
+
+        scheduler.print_report(self.run_report)
+        from data_cleaning.schemas import print_memory_report
+
+        print_memory_report(self.run_report.get('memory', {}))
+
+        return self.run_report
+
+
+    def create_stage_scheduler(self):
+        """
+        DESCRIPTION: Create an empty stage scheduler recording to the run metrics
+        INPUT: None
+        OUTPUT: scheduler (StageScheduler)
+        """
+        profile_path = None
+        if self.profile:
+            profile_path = os.path.join(
+                self.metrics_path, 'profile_{0}_{1}'.format(self.run_name, self.timestamp_str_compact)
+            )
+
+        return StageScheduler(max_workers=PIPELINE_MAX_WORKERS, metrics=METRICS, profile_path=profile_path)
+
+
+    def export_metrics(self):
+        """
+        DESCRIPTION: Write the run report with the metrics as json, and the
+                     metrics as a Prometheus textfile
+        INPUT: None
+        OUTPUT: None
+        """
+        METRICS.write_json(
+            os.path.join(self.metrics_path, '{0}_{1}.json'.format(self.run_name, self.timestamp_str_compact)),
+            self.run_report
+        )
+        METRICS.write_prometheus_textfile(
+            os.path.join(self.metrics_path, 'music_trends_{0}.prom'.format(self.run_name))
+        )
+
+
+    def record_rows(self, stage_name, source_name):
+        """
+        DESCRIPTION: Count the rows a stage left in the dataframes of a source
+        INPUT: stage_name (str), source_name (str)
+        OUTPUT: None
+        """
+        n_rows = sum(len(data_df) for data_df in self.data_source_table[source_name].values())
+        METRICS.inc('rows_total', n_rows, stage=stage_name, source=source_name)
+
+
+    def run_shard(self):
+        """
+        DESCRIPTION: Run the source stages of one shard (acquisition, cleaning
+                     and storage) writing to the shard path of the run timestamp.
+                     The sinks run once for all the shards, in merge_shards.
+                     Billboard and DJ Mag are fetched by the shard 0 only
+        INPUT: None
+        OUTPUT: run_report (dict)
+        """
+        self.storage_path = os.path.join(self.shard_path, 'shard_{0}'.format(self.shard_index))
+        self.in_memory_handoff = False
+        self.delta_snapshots = False
+        self.run_name = 'shard_{0}'.format(self.shard_index)
+
+        scheduler = self.create_stage_scheduler()
+        store_stage_list = self.add_source_stages(scheduler)
+        scheduler.add_stage('save_shard_states', self.save_shard_states, depends_on=store_stage_list)
+
+        return self.run_stage_scheduler(scheduler)
+
+
+    def merge_shards(self):
+        """
+        DESCRIPTION: Merge the outputs of the shards of the run timestamp into one
+                     snapshot in the storage, then run the sinks (s3, sql, states
+                     commit and cleanup) once for all of them
         INPUT: None
+        OUTPUT: run_report (dict)
+        """
+        self.in_memory_handoff = False
+        self.delta_snapshots = False
+        self.run_name = 'merge'
+
+        scheduler = self.create_stage_scheduler()
+        scheduler.add_stage('merge_shards', self.merge_shard_outputs)
+        self.add_sink_stages(scheduler, ['merge_shards'])
+
+        run_report = self.run_stage_scheduler(scheduler)
+        shutil.rmtree(self.shard_path, ignore_errors=True)
+
+        return run_report
+
+
+    def build_stage_scheduler(self):
+        """
+        DESCRIPTION: Build the dependency graph of the pipeline stages
+        INPUT: None
+        OUTPUT: scheduler (StageScheduler)
+        """
+        scheduler = self.create_stage_scheduler()
+        store_stage_list = self.add_source_stages(scheduler)
+        self.add_sink_stages(scheduler, store_stage_list)
+
+        return scheduler
+
+
+    def add_source_stages(self, scheduler):
+        """
+        DESCRIPTION: Add the acquisition, cleaning and storage stages of each source
+        INPUT: scheduler (StageScheduler)
+        OUTPUT: store_stage_list (list)
+        """
+        source_acquisition_table = {}
+        if self.shard_index == 0:
+            for source_name, acquisition_function in [
+                    ('billboard', self.acquire_billboard_data),
+                    ('dj_mag', self.acquire_dj_mag_data),
+            ]:
+                if source_name in self.source_name_list:
+                    scheduler.add_stage('acquire_{0}'.format(source_name), acquisition_function)
+                    source_acquisition_table[source_name] = 'acquire_{0}'.format(source_name)
+
+        store_stage_list = []
+        has_spotify = 'spotify' in self.source_name_list
+        if has_spotify and self.streaming:
+            scheduler.add_stage('stream_spotify', self.stream_spotify_data)
+            store_stage_list.append('stream_spotify')
+        elif has_spotify:
+            scheduler.add_stage('acquire_spotify', self.acquire_spotify_data)
+            source_acquisition_table['spotify'] = 'acquire_spotify'
+            source_acquisition_table['artists'] = 'acquire_spotify'
+
+        for source_name, acquisition_stage in source_acquisition_table.items():
+            scheduler.add_stage(
+                'clean_{0}'.format(source_name),
+                lambda source_name=source_name: self.clean_source_data(source_name),
+                depends_on=[acquisition_stage]
+            )
+
+        # the charts are stored once their rows are linked to the spotify ids
+        chart_depends_on = []
+        if self.shard_index == 0:
+            scheduler.add_stage(
+                'resolve_entities',
+                self.resolve_chart_entities,
+                depends_on=['clean_{0}'.format(x) for x in source_acquisition_table] + (
+                    ['stream_spotify'] if has_spotify and self.streaming else []
+                )
+            )
+            chart_depends_on = ['resolve_entities']
+
+        # the tracks not seen before are enriched (audio features, album) once in their lifetime
+        if has_spotify:
+            scheduler.add_stage(
+                'enrich_tracks',
+                self.enrich_spotify_tracks,
+                depends_on=['stream_spotify' if self.streaming else 'clean_spotify']
+            )
+            store_stage_list.append('enrich_tracks')
+
+        for source_name in source_acquisition_table:
+            store_stage = 'store_{0}'.format(source_name)
+            scheduler.add_stage(
+                store_stage,
+                lambda source_name=source_name: self.store_source_data(source_name),
+                depends_on=['clean_{0}'.format(source_name)] + (
+                    chart_depends_on if source_name in ['billboard', 'dj_mag'] else []
+                )
+            )
+            store_stage_list.append(store_stage)
+
+        return store_stage_list
+
+
+    def add_sink_stages(self, scheduler, store_stage_list):
+        """
+        DESCRIPTION: Add the stages that run once the storage is written: memory
+                     report, s3 and sql uploads, states commit and cleanup
+        INPUT: scheduler (StageScheduler), store_stage_list (list)
         OUTPUT: None
         """
-        self.data_acquisition()
-        self.data_cleaning()
-        self.data_local_storage()
-        self.data_s3_upload()
-        self.data_sql_upload()
-        self.local_storage_cleanup()
+        scheduler.add_stage('memory_report', self.report_memory_usage, depends_on=store_stage_list)
+        scheduler.add_stage('s3_upload', self.data_s3_upload, depends_on=store_stage_list)
+        scheduler.add_stage('sql_upload', self.data_sql_upload, depends_on=store_stage_list)
+        scheduler.add_stage('aggregate_trends', self.aggregate_trends, depends_on=['sql_upload'])
+        scheduler.add_stage('commit_states', self.commit_source_states, depends_on=['sql_upload'])
+        scheduler.add_stage('store_snapshots', self.store_snapshots, depends_on=store_stage_list)
+        scheduler.add_stage(
+            'storage_cleanup',
+            self.local_storage_cleanup,
+            depends_on=['s3_upload', 'commit_states', 'aggregate_trends', 'store_snapshots']
+        )
 
 
     def get_artist_list(self):
@@ -66,7 +485,12 @@ class MusicTrends():
         OUTPUT: artist_list (list)
         """
         spotify_playlist_df_list = self.spotify_playlists_data.values()
-        spotify_playlist_df = pd.concat(spotify_playlist_df_list, ignore_index=True)
+        if not spotify_playlist_df_list:
+            return []
+
+        from data_cleaning.schemas import concat_source_frames
+
+        spotify_playlist_df = concat_source_frames(list(spotify_playlist_df_list), 'spotify')
         artist_list = list(spotify_playlist_df['main_artist_id_id'].unique())
         return artist_list
 
@@ -78,22 +502,80 @@ class MusicTrends():
                      - self.dj_mag_data
                      - self.billboard_data
                      - self.spotify_playlists_data
+                     - self.artists_data
         INPUT: None
         OUTPUT: None
         """
-        billboard_api = BillboardAPI()
-        djmag_api = DJMagAPI()
-        spotify_api = SpotifyAPI(SPOTIFY_CLIENT_ID, SPOTIFY_SECRET)
+        self.acquire_dj_mag_data()
+        self.acquire_billboard_data()
+        self.acquire_spotify_data()
 
-        dj_mag_data_json = djmag_api.get_top_100_djs_json()
+
+    def get_spotify_api(self):
+        """
+        DESCRIPTION: Get the SpotifyAPI of the acquisition (kept between the runs
+                     of a daemon, with its session, token and caches)
+        INPUT: None
+        OUTPUT: spotify_api (SpotifyAPI)
+        """
+        if self.spotify_api is None:
+            from data_acquisition.spotify_api import SpotifyAPI
+
+            self.spotify_api = SpotifyAPI(SPOTIFY_CLIENT_ID, SPOTIFY_SECRET)
+
+        return self.spotify_api
+
+
+    def acquire_dj_mag_data(self):
+        """
+        DESCRIPTION: Fetch the top 100 djs from dj mag into self.dj_mag_data
+        INPUT: None
+        OUTPUT: None
+        """
+        import pandas as pd
+
+        if self.dj_mag_api is None:
+            from data_acquisition.djmag_api import DJMagAPI
+
+            self.dj_mag_api = DJMagAPI()
+
+        dj_mag_data_json = self.dj_mag_api.get_top_100_djs_json()
         for key, value in dj_mag_data_json.items():
             self.dj_mag_data[key] = pd.DataFrame(value)
+        self.record_rows('acquire', 'dj_mag')
+
+
+    def acquire_billboard_data(self):
+        """
+        DESCRIPTION: Fetch the hot 100 from billboard into self.billboard_data
+        INPUT: None
+        OUTPUT: None
+        """
+        import pandas as pd
+
+        if self.billboard_api is None:
+            from data_acquisition.billboard_api import BillboardAPI
+
+            self.billboard_api = BillboardAPI()
 
-        billboard_data_json = billboard_api.get_billboard_hot_100_json()
+        billboard_data_json = self.billboard_api.get_billboard_hot_100_json()
         for key, value in billboard_data_json.items():
             self.billboard_data[key] = pd.DataFrame(value)
+        self.record_rows('acquire', 'billboard')
+
+
+    def acquire_spotify_data(self):
+        """
+        DESCRIPTION: Fetch the playlists and their new artists from spotify into
+                     self.spotify_playlists_data and self.artists_data
+        INPUT: None
+        OUTPUT: None
+        """
+        import pandas as pd
+
+        spotify_api = self.get_spotify_api()
 
-        spotify_playlists_data_json = spotify_api.get_several_playlists_data(TOP_50_PLAYLIST_ID_TABLE)
+        spotify_playlists_data_json = spotify_api.get_several_playlists_data(self.playlists_table)
         for key, value in spotify_playlists_data_json.items():
             self.spotify_playlists_data[key] = pd.DataFrame(value)
 
@@ -101,6 +583,114 @@ class MusicTrends():
         spotify_artists_data_json = spotify_api.get_several_artists_data(artists_list)
         for key, value in spotify_artists_data_json.items():
             self.artists_data[key] = pd.DataFrame(value)
+        self.record_rows('acquire', 'spotify')
+        self.record_rows('acquire', 'artists')
+
+
+    def stream_spotify_data(self):
+        """
+        DESCRIPTION: Streaming version of the spotify acquisition, cleaning and
+                     storage. The track records flow in batches from the api
+                     pages to the cleaning and then to the storage files, and
+                     the artist ids are collected along the way to stream the
+                     new artists the same way. Peak memory depends on the batch
+                     size, not on the number of playlists.
+        INPUT: None
+        OUTPUT: None
+        """
+        spotify_api = self.get_spotify_api()
+
+        # a dict keeps the artist ids unique and in the order they were found
+        artist_id_table = {}
+        playlist_batches = spotify_api.iter_several_playlists_batches(
+            self.playlists_table, self.batch_size
+        )
+        for data_df in self.store_source_batches('spotify', playlist_batches):
+            artist_id_table.update(dict.fromkeys(data_df['main_artist_id_id']))
+
+        artist_batches = (
+            ('artists', record_batch)
+            for record_batch in spotify_api.iter_several_artists_batches(artist_id_table, self.batch_size)
+        )
+        for _ in self.store_source_batches('artists', artist_batches):
+            pass
+
+
+    def enrich_spotify_tracks(self):
+        """
+        DESCRIPTION: Enrich the spotify tracks of this run that are not in the
+                     enrichment cache yet
+        INPUT: None
+        OUTPUT: n_new_tracks (int)
+        """
+        if self.spotify_api is None:
+            return 0
+
+        track_id_list = []
+        for data_df in self.get_source_frames('spotify').values():
+            if 'track_id' in data_df.columns:
+                track_id_list += data_df['track_id'].dropna().astype(str).tolist()
+
+        n_new_tracks = self.spotify_api.enrich_tracks(track_id_list)
+        self.run_report['enriched_tracks'] = n_new_tracks
+        METRICS.inc('rows_total', n_new_tracks, stage='enrich', source='tracks')
+
+        return n_new_tracks
+
+    def store_source_batches(self, source_name, keyed_record_batches):
+        """
+        DESCRIPTION: Clean record batches of one source and append them to its
+                     storage files. The batches of a key must come together, so
+                     only one file is open at a time. A file left incomplete by
+                     an error is removed.
+        INPUT: source_name (str), keyed_record_batches (iterable of (key, list of dicts))
+        OUTPUT: data_df (generator of the cleaned batches)
+        """
+        import pandas as pd
+        from data_cleaning.cleaning_engine import CleaningEngine
+
+        os.makedirs(self.storage_path, exist_ok=True)
+        cleaning_engine = CleaningEngine()
+        metadata_dict = {
+            'source_date': self.timestamp,
+        }
+
+        current_key = None
+        frame_writer = None
+        try:
+            for key, record_batch in keyed_record_batches:
+                if key != current_key:
+                    if frame_writer is not None:
+                        self.close_stream_file(source_name, current_key, frame_writer)
+                    current_key = key
+                    frame_writer = open_frame_writer(
+                        self.get_file_path_base(source_name, key), self.storage_format
+                    )
+
+                data_df = cleaning_engine.clean_frame(source_name, pd.DataFrame(record_batch), metadata_dict)
+                frame_writer.write(data_df)
+                METRICS.inc('rows_total', len(data_df), stage='stream', source=source_name)
+                yield data_df
+        except BaseException:
+            if frame_writer is not None:
+                frame_writer.close()
+                if os.path.exists(frame_writer.file_path):
+                    os.remove(frame_writer.file_path)
+            raise
+
+        if frame_writer is not None:
+            self.close_stream_file(source_name, current_key, frame_writer)
+
+
+    def close_stream_file(self, source_name, key, frame_writer):
+        """
+        DESCRIPTION: Close a finished streamed file and register it as stored
+        INPUT: source_name (str), key (str), frame_writer (frame writer)
+        OUTPUT: None
+        """
+        frame_writer.close()
+        self.stored_file_table[source_name][key] = frame_writer.file_path
+        METRICS.inc('bytes_total', os.path.getsize(frame_writer.file_path), stage='stream', source=source_name)
 
 
     def data_cleaning(self):
@@ -110,72 +700,455 @@ class MusicTrends():
                      - self.dj_mag_data
                      - self.billboard_data
                      - self.spotify_playlists_data
+                     - self.artists_data
         INPUT: None
         OUTPUT: None
         """
-        # Note that I am not using the remove_special_chars for now for simplicity
-        lowercase_columns_table = {
-            'billboard': ['title', 'artist'],
-            'dj_mag': ['artist'],
-            'spotify': ['all_artists', 'song_name'],
-            'artists': ['name', 'music_genre_1', 'music_genre_2', 'music_genre_3']
-        }
+        for source_name in self.data_source_table:
+            self.clean_source_data(source_name)
 
-        for source_name, data_dict in self.data_source_table.items():
-            lowercase_columns = lowercase_columns_table[source_name]
 
-            for key, data_df in data_dict.items():
-                if data_dict[key].empty:
-                    continue
+    def clean_source_data(self, source_name):
+        """
+        DESCRIPTION: Clean the data acquired from one source, following its rules
+                     in CLEANING_RULES_TABLE, and cast it to its typed schema
+        INPUT: source_name (str)
+        OUTPUT: None
+        """
+        from data_cleaning.cleaning_engine import CleaningEngine
+        from data_cleaning.schemas import apply_source_schema
 
-                # make lowercase
-                data_dict[key] = make_cols_lowercase(data_df, lowercase_columns)
+        data_dict = self.data_source_table[source_name]
+        metadata_dict = {
+            'source_date': self.timestamp,
+        }
 
-                if source_name != 'artists':
-                    # Add metadata
-                    metadata_dict = {
-                        'source_date': self.timestamp,
-                    }
-                    data_dict[key] = add_metadata(data_df, metadata_dict)
+        cleaned_data_dict = CleaningEngine().clean_source(source_name, data_dict, metadata_dict)
+        for key, data_df in cleaned_data_dict.items():
+            cleaned_data_dict[key] = apply_source_schema(data_df, source_name)
+        data_dict.update(cleaned_data_dict)
+        self.record_rows('clean', source_name)
 
-                    # clean music name
-                    if source_name == 'spotify':
-                        data_dict[key]['song_name'] = data_dict[key]['song_name'].apply(clean_music_name)
+    def report_memory_usage(self):
+        """
+        DESCRIPTION: Add the memory used by the dataframes of each source to
+                     the run report
+        INPUT: None
+        OUTPUT: memory_report (dict)
+        """
+        from data_cleaning.schemas import get_memory_report
+
+        memory_report = get_memory_report(self.data_source_table)
+        self.run_report['memory'] = memory_report
+
+        return memory_report
 
     def data_local_storage(self):
         """
-        DESCRIPTION: Store each data dataframe as csv
+        DESCRIPTION: Store each data dataframe in the storage format
         INPUT: None
         OUTPUT: None
         """
-        if not os.path.exists(self.storage_path):
-            os.makedirs(self.storage_path)
+        for source_name in self.data_source_table:
+            self.store_source_data(source_name)
 
-        file_path_base = '{0}/{1}_{2}_{3}.csv'
+    def store_source_data(self, source_name):
+        """
+        DESCRIPTION: Store each dataframe of one source in the storage format
+        INPUT: source_name (str)
+        OUTPUT: None
+        """
+        os.makedirs(self.storage_path, exist_ok=True)
+        is_delta_source = self.delta_snapshots and source_name in SNAPSHOT_DELTA_KEY_TABLE
 
-        for source_name, data_dict in self.data_source_table.items():
-            for key, data_df in data_dict.items():
-                file_path = file_path_base.format(
-                    self.storage_path, source_name, key, self.timestamp_str_compact
+        for key, data_df in self.data_source_table[source_name].items():
+            if not data_df.empty:
+                frame_df = data_df
+                if is_delta_source:
+                    frame_type, frame_df = self.get_snapshot_deltas().encode(source_name, key, data_df)
+                file_path = write_frame(
+                    frame_df, self.get_file_path_base(source_name, key), self.storage_format
                 )
-                if not data_df.empty:
-                    data_df.to_csv(file_path, index=False)
+                if is_delta_source:
+                    self.get_snapshot_deltas().record(
+                        source_name, key, self.timestamp, frame_type, file_path, data_df
+                    )
+                    METRICS.inc('snapshot_frames_total', source=source_name, frame_type=frame_type)
+                self.stored_file_table[source_name][key] = file_path
+                METRICS.inc('rows_total', len(frame_df), stage='store', source=source_name)
+                METRICS.inc('bytes_total', os.path.getsize(file_path), stage='store', source=source_name)
+
+    def get_snapshot_deltas(self):
+        """
+        DESCRIPTION: Get the index of the stored keyframes and deltas, looking
+                     for their files in the storage and in the archive
+        INPUT: None
+        OUTPUT: snapshot_deltas (SnapshotDeltaIndex)
+        """
+        if self.snapshot_deltas is None:
+            from utilities.snapshot_delta import SnapshotDeltaIndex
+
+            self.snapshot_deltas = SnapshotDeltaIndex(search_path_list=[self.storage_path, self.archive_path])
+
+        return self.snapshot_deltas
+
+    def get_file_path_base(self, source_name, key):
+        """
+        DESCRIPTION: Get the path of a storage file of this run, without extension
+        INPUT: source_name (str), key (str)
+        OUTPUT: file_path_base (str)
+        """
+        return '{0}/{1}_{2}_{3}'.format(
+            self.storage_path, source_name, key, self.timestamp_str_compact
+        )
 
     def data_s3_upload(self):
-        s3_client = boto3.client('s3')
-        bucket = 'storage-tendencias-musicais'
-        for object_name in os.listdir(self.storage_path):
-            file_name = os.path.join(self.storage_path, object_name)
-            s3_client.upload_file(file_name, bucket, object_name)
+        """
+        DESCRIPTION: Upload the storage files to S3, concurrently and skipping the
+                     files whose content is already in the bucket
+        INPUT: None
+        OUTPUT: upload_status_table (dict)
+        """
+        if self.s3_uploader is None:
+            self.s3_uploader = S3Uploader(source_name_list=list(self.data_source_table))
+
+        return upload_storage_files(self.storage_path, list(self.data_source_table), self.s3_uploader)
+
+    def get_load_manifest(self):
+        """
+        DESCRIPTION: Get the manifest of the files already loaded in the database
+        INPUT: None
+        OUTPUT: load_manifest (LoadManifest)
+        """
+        if self.load_manifest is None:
+            self.load_manifest = LoadManifest()
+
+        return self.load_manifest
 
     def data_sql_upload(self):
-        for source_data_type in self.sql_upload_list:
-            load_files_in_storage(source_data_type)
+        """
+        DESCRIPTION: Load the new data into the database, all of it in a single
+                     transaction, and record the loaded files in the manifest.
+                     With in_memory_handoff the frames of this run are loaded
+                     directly and only older files missing from the manifest
+                     (e.g. from a failed run) are read from the storage.
+                     Without it (e.g. in streaming mode) every new file is read.
+                     The database keeps whole snapshots, so a stored delta is
+                     loaded as the snapshot rebuilt from its chain
+        INPUT: None
+        OUTPUT: None
+        """
+        load_manifest = self.get_load_manifest()
+
+        frame_table = {}
+        manifest_entry_list = []
+        handoff_source_list = self.sql_upload_list if self.in_memory_handoff else []
+        for source_name in handoff_source_list:
+            for key, file_path in self.stored_file_table.get(source_name, {}).items():
+                data_df = self.data_source_table[source_name][key]
+                frame_table.setdefault(TABLE_LOOKUP[source_name], []).append(data_df)
+                manifest_entry_list.append({
+                    'file_name': os.path.basename(file_path),
+                    'checksum': get_file_checksum(file_path),
+                    'row_count': len(data_df),
+                    'target_table': TABLE_LOOKUP[source_name],
+                })
+
+        this_run_file_set = {x['file_name'] for x in manifest_entry_list}
+        for manifest_entry in get_new_storage_files(self.sql_upload_list, load_manifest, self.storage_path):
+            if manifest_entry['file_name'] in this_run_file_set:
+                continue
+            # a delta of a failed run is loaded as its whole snapshot
+            data_df = read_storage_frame(manifest_entry['file_path'], self.get_snapshot_deltas())
+            manifest_entry['row_count'] = len(data_df)
+            frame_table.setdefault(manifest_entry['target_table'], []).append(data_df)
+            manifest_entry_list.append(manifest_entry)
+
+        load_with_manifest(frame_table, manifest_entry_list, load_manifest, get_engine())
+
+    def save_shard_states(self):
+        """
+        DESCRIPTION: Save the playlist states of a shard next to its outputs, to be
+                     committed by the merge step once the data is loaded
+        INPUT: None
+        OUTPUT: None
+        """
+        playlist_states = {}
+        if self.spotify_api is not None:
+            playlist_states = self.spotify_api.pending_playlist_states
+
+        os.makedirs(self.storage_path, exist_ok=True)
+        with open(os.path.join(self.storage_path, 'playlist_states.json'), 'w') as states_file:
+            json.dump(playlist_states, states_file)
+
+    def merge_shard_outputs(self):
+        """
+        DESCRIPTION: Combine the files written by the shards of the run timestamp
+                     into the storage. Files with the same name (e.g. the artists
+                     of each shard) are concatenated without duplicated rows
+        INPUT: None
+        OUTPUT: merged_file_list (list)
+        """
+        import pandas as pd
+
+        if not os.path.exists(self.shard_path):
+            return []
+
+        shard_file_table = {}
+        for shard_name in sorted(os.listdir(self.shard_path)):
+            shard_dir = os.path.join(self.shard_path, shard_name)
+            for file_name in sorted(os.listdir(shard_dir)):
+                file_path = os.path.join(shard_dir, file_name)
+                if file_name == 'playlist_states.json':
+                    with open(file_path) as states_file:
+                        self.shard_playlist_states.update(json.load(states_file))
+                elif get_file_storage_format(file_name) is not None:
+                    shard_file_table.setdefault(file_name, []).append(file_path)
+
+        os.makedirs(self.storage_path, exist_ok=True)
+        for file_name, file_path_list in shard_file_table.items():
+            merged_file_path = os.path.join(self.storage_path, file_name)
+            if len(file_path_list) == 1:
+                shutil.move(file_path_list[0], merged_file_path)
+            else:
+                data_df = pd.concat([read_frame(x) for x in file_path_list], ignore_index=True)
+                write_frame(
+                    data_df.drop_duplicates(),
+                    os.path.splitext(merged_file_path)[0],
+                    get_file_storage_format(file_name)
+                )
+            self.register_stored_file(merged_file_path)
+
+        return sorted(shard_file_table)
+
+    def get_source_frames(self, source_name):
+        """
+        DESCRIPTION: Get the dataframes of a source in this run, from memory or,
+                     when they were not kept (streaming or merged shards), from
+                     the files stored in this run
+        INPUT: source_name (str)
+        OUTPUT: data_dict (dict of dataframes)
+        """
+        data_dict = self.data_source_table[source_name]
+        if data_dict:
+            return data_dict
+
+        return {
+            key: read_frame(file_path)
+            for key, file_path in self.stored_file_table[source_name].items()
+            if os.path.exists(file_path)
+        }
+
+    def store_snapshots(self):
+        """
+        DESCRIPTION: Add the chart snapshots of this run (spotify playlists,
+                     billboard and dj mag) to the partitioned snapshot store and
+                     compact the months before the current one
+        INPUT: None
+        OUTPUT: None
+        """
+        snapshot_store = self.get_snapshot_store()
+        for source_name in ['spotify', 'billboard', 'dj_mag']:
+            for key, data_df in self.get_source_frames(source_name).items():
+                if source_name == 'spotify':
+                    market = self.market_table.get(key, key.split('_', 1)[-1])
+                else:
+                    market = CHART_MARKET_TABLE[source_name]
+
+                file_path = snapshot_store.write_snapshot(source_name, market, data_df, self.timestamp)
+                if file_path is not None:
+                    METRICS.inc('rows_total', len(data_df), stage='snapshot_store', source=source_name)
+
+        # the months done are merged in one file each, so long histories stay fast
+        snapshot_store.compact(self.timestamp)
+
+    def get_snapshot_store(self):
+        """
+        DESCRIPTION: Get the partitioned store of the chart snapshots
+        INPUT: None
+        OUTPUT: snapshot_store (SnapshotStore)
+        """
+        if self.snapshot_store is None:
+            from utilities.snapshot_store import SnapshotStore
+
+            self.snapshot_store = SnapshotStore()
+
+        return self.snapshot_store
+
+    def get_trend_aggregator(self):
+        """
+        DESCRIPTION: Get the aggregator of the music trends
+        INPUT: None
+        OUTPUT: trend_aggregator (TrendAggregator)
+        """
+        if self.trend_aggregator is None:
+            from data_analysis.trend_aggregation import TrendAggregator
+
+            self.trend_aggregator = TrendAggregator()
+
+        return self.trend_aggregator
+
+    def get_entity_index(self):
+        """
+        DESCRIPTION: Get the index of the spotify artists and tracks names
+        INPUT: None
+        OUTPUT: entity_index (EntityIndex)
+        """
+        if self.entity_index is None:
+            from data_analysis.entity_resolution import EntityIndex
+
+            self.entity_index = EntityIndex()
+
+        return self.entity_index
+
+    def resolve_chart_entities(self):
+        """
+        DESCRIPTION: Index the spotify artists and tracks of this run and link
+                     each billboard and dj mag chart row to its spotify artist
+                     (and track) id, so the charts can be compared across sources
+        INPUT: None
+        OUTPUT: None
+        """
+        entity_index = self.get_entity_index()
+        entity_index.add_spotify_data(
+            self.get_source_frames('spotify'),
+            list(self.get_source_frames('artists').values())
+        )
+
+        for source_name in ['billboard', 'dj_mag']:
+            data_dict = self.data_source_table[source_name]
+            for key, data_df in data_dict.items():
+                with METRICS.timer('entity_resolution_seconds', source=source_name):
+                    data_dict[key] = entity_index.resolve_chart(source_name, data_df)
+                if 'artist_id' in data_dict[key].columns:
+                    METRICS.inc(
+                        'entities_resolved_total', int(data_dict[key]['artist_id'].notnull().sum()),
+                        source=source_name
+                    )
+
+    def aggregate_trends(self):
+        """
+        DESCRIPTION: Fold the spotify snapshots of this run into the trend
+                     aggregates (positions, days on chart, popularity, genre
+                     share, entries and exits), once they are in the database,
+                     and bump the trends generation so the cached query
+                     results are dropped
+        INPUT: None
+        OUTPUT: summary_table (dict of summaries by playlist name)
+        """
+        from data_analysis.trends_query import bump_trends_generation
+
+        trend_aggregator = self.get_trend_aggregator()
+        # the artists already known are not in the frames of this run
+        trend_aggregator.sync_artist_genres(get_engine())
+        summary_table = trend_aggregator.fold_run(
+            self.get_source_frames('spotify'),
+            list(self.get_source_frames('artists').values()),
+            self.chart_table
+        )
+        self.run_report['trends'] = summary_table
+        if summary_table:
+            self.run_report['trends_generation'] = bump_trends_generation()
+
+        return summary_table
+
+    def register_stored_file(self, file_path):
+        """
+        DESCRIPTION: Register a file of this run in stored_file_table, finding
+                     its source and key from its name ({source}_{key}_{timestamp})
+        INPUT: file_path (str)
+        OUTPUT: None
+        """
+        file_stem = os.path.splitext(os.path.basename(file_path))[0]
+        suffix = '_{0}'.format(self.timestamp_str_compact)
+        if not file_stem.endswith(suffix):
+            return
+
+        file_stem = file_stem[:-len(suffix)]
+        for source_name in sorted(self.data_source_table, key=len, reverse=True):
+            if file_stem.startswith(source_name + '_'):
+                self.stored_file_table[source_name][file_stem[len(source_name) + 1:]] = file_path
+                return
+
+    def commit_source_states(self):
+        """
+        DESCRIPTION: Save the state of the sources fetched in this run (e.g. the
+                     playlists snapshot ids), once their data is stored, so the
+                     next run only processes what has changed
+        INPUT: None
+        OUTPUT: None
+        """
+        if self.spotify_api is not None:
+            self.spotify_api.commit_playlist_states()
+        if self.shard_playlist_states:
+            PlaylistStateCache().set_states(self.shard_playlist_states)
+            self.shard_playlist_states = {}
 
     def local_storage_cleanup(self):
-        pass
+        """
+        DESCRIPTION: Move the files that are done (uploaded, and loaded in the
+                     database when their type goes to sql) from the storage to
+                     the archive, partitioned by date, so the next runs only
+                     see new files
+        INPUT: None
+        OUTPUT: archived_file_list (list)
+        """
+        if not os.path.exists(self.storage_path):
+            return []
+
+        loaded_file_set = self.get_load_manifest().get_loaded_file_names()
+        sql_file_type_list = [x for x in self.sql_upload_list if TABLE_LOOKUP.get(x)]
+
+        archived_file_list = []
+        for file_name in sorted(os.listdir(self.storage_path)):
+            goes_to_sql = any(file_name.startswith(x) for x in sql_file_type_list)
+            if goes_to_sql and file_name not in loaded_file_set:
+                continue
+
+            file_date = os.path.splitext(file_name)[0].rsplit('_', 1)[-1][:8]
+            archive_dir = os.path.join(self.archive_path, file_date)
+            os.makedirs(archive_dir, exist_ok=True)
+            shutil.move(os.path.join(self.storage_path, file_name), os.path.join(archive_dir, file_name))
+            archived_file_list.append(file_name)
+
+        return archived_file_list
+
+
+def run_shard(shard_index, shard_count, timestamp_str, profile=False):
+    """
+    DESCRIPTION: Run one shard in a worker process
+    INPUT: shard_index (int), shard_count (int), timestamp_str (str, %Y%m%d%H%M%S),
+           profile (bool/optional)
+    OUTPUT: None
+    """
+    timestamp = datetime.strptime(timestamp_str, '%Y%m%d%H%M%S')
+    MusicTrends(
+        timestamp=timestamp, shard_index=shard_index, shard_count=shard_count, profile=profile
+    ).run_shard()
+
+
+def run_sharded(worker_count, timestamp=None, profile=False):
+    """
+    DESCRIPTION: Partition the playlist registry across worker processes, each
+                 running one shard, and merge their outputs into one snapshot
+    INPUT: worker_count (int), timestamp (datetime/optional), profile (bool/optional)
+    OUTPUT: run_report (dict)
+    """
+    music_trends = MusicTrends(timestamp=timestamp, profile=profile)
+    timestamp_str = music_trends.timestamp_str_compact
+
+    with ProcessPoolExecutor(max_workers=worker_count) as executor:
+        future_list = [
+            executor.submit(run_shard, shard_index, worker_count, timestamp_str, profile)
+            for shard_index in range(worker_count)
+        ]
+        for future in future_list:
+            future.result()
+
+    return music_trends.merge_shards()
 
 
 if __name__ == '__main__':
-    music_trends = MusicTrends()
-    music_trends.run_music_trends()
+    # same options as the run subcommand of music_trends_cli
+    from music_trends_cli import main
+    main(['run'] + sys.argv[1:])
@@ -1,17 +1,24 @@
 import sqlite3
-import psycopg2
-from sqlalchemy import create_engine
+import threading
 
 from credentials import DB_USER, DB_PASSWORD, DB_DATABASE, DB_HOST
 
+SQLITE_DB_PATH = '/Users/marcusmelo/Desktop/projeto_m4_gh/tendencias_musicais_web/db.sqlite3'
+
+# engines are created once per process and shared, so their pool is reused
+ENGINE_TABLE = {}
+ENGINE_LOCK = threading.Lock()
+
 def get_db_connection():
-    conn = sqlite3.connect('/Users/marcusmelo/Desktop/projeto_m4_gh/tendencias_musicais_web/db.sqlite3')
+    conn = sqlite3.connect(SQLITE_DB_PATH)
     conn.text_factory = str
 
     return conn
 
 
 def get_postgres_db_conn():
+    import psycopg2
+
     conn = psycopg2.connect(
         database=DB_DATABASE,
         user=DB_USER,
@@ -22,6 +29,21 @@ def get_postgres_db_conn():
 
     return conn
 
+def get_shared_engine(engine_str):
+    """
+    DESCRIPTION: get the long-lived engine (and connection pool) of a database
+    INPUT: engine_str (str)
+    OUTPUT: engine (sqlalchemy engine)
+    """
+    from sqlalchemy import create_engine
+
+    with ENGINE_LOCK:
+        if engine_str not in ENGINE_TABLE:
+            ENGINE_TABLE[engine_str] = create_engine(engine_str, pool_pre_ping=True)
+
+        return ENGINE_TABLE[engine_str]
+
+
 def get_postgress_engine():
     engine_str = 'postgresql+psycopg2://{0}:{1}@{2}:{3}/{4}'.format(
         DB_USER,
@@ -30,6 +52,12 @@ def get_postgress_engine():
         '5432',
         DB_DATABASE
     )
-    engine = create_engine(engine_str)
+    engine = get_shared_engine(engine_str)
+
+    return engine
+
+
+def get_sqlite_engine():
+    engine = get_shared_engine('sqlite:///{0}'.format(SQLITE_DB_PATH))
 
     return engine
@@ -0,0 +1,173 @@
+"""
+Module to handle the on-disk cache of http responses
+"""
+import hashlib
+import os
+import time
+
+from music_trends_constants import LOCAL_CACHE_DB, LOCAL_CACHE_PATH, HTTP_CACHE_MAX_BYTES
+from utilities.local_cache import LocalCache
+
+
+class HttpCache(LocalCache):
+    """
+    DESCRIPTION: Cache of http response bodies. The bodies are stored on disk
+                 addressed by their sha256, and an index keyed by url keeps the
+                 validators (ETag/Last-Modified) and the access times used for
+                 the TTL and for the LRU eviction.
+    ATTRIBUTES:
+        - db_path (str)
+        - objects_path (str)
+        - max_bytes (int)
+    METHODS:
+        - get_entry
+        - read_body
+        - store
+        - touch
+        - evict
+    """
+    schema = """
+        create table if not exists http_cache (
+            url text primary key,
+            digest text,
+            etag text,
+            last_modified text,
+            size integer,
+            fetched_at real,
+            last_access real
+        );
+        create index if not exists http_cache_last_access on http_cache (last_access);
+    """
+
+    def __init__(self, db_path=LOCAL_CACHE_DB, objects_path=None, max_bytes=HTTP_CACHE_MAX_BYTES):
+        """
+        Constructor method for HttpCache
+        """
+        super().__init__(db_path)
+        if objects_path is None:
+            objects_path = os.path.join(LOCAL_CACHE_PATH, 'http_objects')
+        self.objects_path = objects_path
+        self.max_bytes = max_bytes
+
+
+    def get_object_path(self, digest):
+        """
+        DESCRIPTION: Get the path of a stored body from its digest
+        INPUT: digest (str)
+        OUTPUT: object_path (str)
+        """
+        return os.path.join(self.objects_path, digest[:2], digest)
+
+
+    def get_entry(self, url):
+        """
+        DESCRIPTION: Get the index entry of a cached url
+        INPUT: url (str)
+        OUTPUT: entry (dict), empty if the url is not cached
+        """
+        rows = self.query(
+            'select digest, etag, last_modified, fetched_at from http_cache where url = ?',
+            (url,)
+        )
+        if not rows:
+            return {}
+
+        digest, etag, last_modified, fetched_at = rows[0]
+        if not os.path.exists(self.get_object_path(digest)):
+            return {}
+
+        return {
+            'digest': digest,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+        }
+
+
+    def read_body(self, digest):
+        """
+        DESCRIPTION: Read a stored body
+        INPUT: digest (str)
+        OUTPUT: body (bytes)
+        """
+        with open(self.get_object_path(digest), 'rb') as object_file:
+            return object_file.read()
+
+
+    def store(self, url, body, etag=None, last_modified=None):
+        """
+        DESCRIPTION: Store a fresh response body for the url
+        INPUT: url (str), body (bytes), etag (str/optional), last_modified (str/optional)
+        OUTPUT: digest (str)
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        object_path = self.get_object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = '{0}.{1}.tmp'.format(object_path, os.getpid())
+            with open(tmp_path, 'wb') as object_file:
+                object_file.write(body)
+            os.replace(tmp_path, object_path)
+
+        now = time.time()
+        self.execute(
+            """
+            insert or replace into http_cache
+                (url, digest, etag, last_modified, size, fetched_at, last_access)
+            values (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(url, digest, etag, last_modified, len(body), now, now)]
+        )
+        self.evict()
+
+        return digest
+
+
+    def touch(self, url, refreshed=False):
+        """
+        DESCRIPTION: Mark a cached url as used, and as revalidated when refreshed
+                     is True (e.g. after a 304 Not Modified)
+        INPUT: url (str), refreshed (bool/optional)
+        OUTPUT: None
+        """
+        now = time.time()
+        if refreshed:
+            statement = 'update http_cache set last_access = ?, fetched_at = ? where url = ?'
+            params = (now, now, url)
+        else:
+            statement = 'update http_cache set last_access = ? where url = ?'
+            params = (now, url)
+
+        self.execute(statement, [params])
+
+
+    def evict(self):
+        """
+        DESCRIPTION: Remove the least recently used entries until the stored
+                     bodies fit in max_bytes
+        INPUT: None
+        OUTPUT: evicted_urls (list)
+        """
+        rows = self.query('select url, digest, size from http_cache order by last_access desc')
+
+        total_bytes = 0
+        kept_digests = set()
+        evicted_rows = []
+        for url, digest, size in rows:
+            if digest in kept_digests:
+                continue
+            if total_bytes + size > self.max_bytes and kept_digests:
+                evicted_rows.append((url, digest))
+                continue
+            total_bytes += size
+            kept_digests.add(digest)
+
+        if not evicted_rows:
+            return []
+
+        self.execute('delete from http_cache where url = ?', [(url,) for url, _ in evicted_rows])
+        for _, digest in evicted_rows:
+            if digest not in kept_digests and os.path.exists(self.get_object_path(digest)):
+                os.remove(self.get_object_path(digest))
+
+        return [url for url, _ in evicted_rows]
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+import urllib.error
+from unittest import mock
+
+from data_acquisition.html_api import HtmlAPI
+from utilities.http_cache import HttpCache
+
+
+class TestHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.http_cache = HttpCache(
+            os.path.join(self.tmp_dir.name, 'cache.sqlite3'),
+            objects_path=os.path.join(self.tmp_dir.name, 'objects'),
+            max_bytes=25
+        )
+
+    def tearDown(self):
+        self.http_cache.connection.close()
+        self.tmp_dir.cleanup()
+
+    def test_content_addressed_store(self):
+        digest_a = self.http_cache.store('http://a/', b'same body')
+        digest_b = self.http_cache.store('http://b/', b'same body')
+
+        self.assertEqual(digest_a, digest_b)
+        self.assertEqual(self.http_cache.read_body(digest_a), b'same body')
+
+    def test_lru_eviction(self):
+        self.http_cache.store('http://a/', b'a' * 10)
+        self.http_cache.store('http://b/', b'b' * 10)
+        self.http_cache.touch('http://a/')
+        self.http_cache.store('http://c/', b'c' * 10)
+
+        self.assertTrue(self.http_cache.get_entry('http://a/'))
+        self.assertFalse(self.http_cache.get_entry('http://b/'))
+        self.assertTrue(self.http_cache.get_entry('http://c/'))
+
+    def test_html_api_ttl_and_conditional_get(self):
+        html_api = HtmlAPI(url='http://site/', cache_ttl=3600, http_cache=self.http_cache)
+        response = mock.Mock()
+        response.read.return_value = b'<html></html>'
+        response.headers = {'ETag': '"v1"'}
+
+        with mock.patch('urllib.request.urlopen', return_value=response) as urlopen:
+            html_api.fetch_page('chart')
+            html_api.fetch_page('chart')
+        self.assertEqual(urlopen.call_count, 1)
+
+        html_api.cache_ttl = 0
+        not_modified = urllib.error.HTTPError('http://site/chart', 304, 'Not Modified', {}, None)
+        with mock.patch('urllib.request.urlopen', side_effect=not_modified) as urlopen:
+            page = html_api.fetch_page('chart')
+        self.assertEqual(page, b'<html></html>')
+        self.assertEqual(urlopen.call_args[0][0].get_header('If-none-match'), '"v1"')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,60 +1,320 @@
+"""
+Module to load the storage files into the database. pandas and sqlalchemy are
+imported when there is something to load, so the command line starts fast
+"""
+import io
 import os
 import sys
-import pandas as pd
 
-from utilities.db_access import get_db_connection, get_postgres_db_conn, get_postgress_engine
+from music_trends_constants import SQL_UPSERT_KEY_TABLE, SQL_COPY_CHUNK_ROWS
+from utilities.db_access import get_postgress_engine, get_sqlite_engine
+from utilities.local_cache import LoadManifest
+from utilities.metrics import METRICS
+from utilities.storage_formats import get_file_checksum, get_file_storage_format, read_frame
 
 
-def load_to_postgres(table_name, csv_path):
+TABLE_LOOKUP = {
+    'spotify': 'tendencias_musicais_app_spotifydata',
+    'billboard': '',
+    'playlists': 'tendencias_musicais_app_playlists',
+    'artists': 'tendencias_musicais_app_artists',
+    'djmag': ''
+}
+
+
+def get_table_columns(conn, table_name):
     """
+    DESCRIPTION: get the columns of a table in the database
+    INPUT: conn (sqlalchemy connection), table_name (str)
+    OUTPUT: column_list (list)
     """
-    engine = get_postgress_engine()
-    data_df = pd.read_csv(csv_path)
+    from sqlalchemy import inspect
 
-    data_df.to_sql(table_name, con=engine, if_exists='append', index=False)
+    return [column['name'] for column in inspect(conn).get_columns(table_name)]
 
 
-def load_to_sqlite(table_name, csv_path):
+def copy_frame_to_staging(conn, staging_table, data_df):
     """
+    DESCRIPTION: stream the rows of a dataframe into the staging table, with
+                 COPY FROM STDIN on postgres and executemany elsewhere
+    INPUT: conn (sqlalchemy connection), staging_table (str), data_df (DataFrame)
+    OUTPUT: None
     """
-    conn = get_db_connection()
-    data_df = pd.read_csv(csv_path)
+    import pandas as pd
 
-    data_df.to_sql(table_name, con=conn, if_exists='append', index=False)
+    column_str = ', '.join(data_df.columns)
 
-    conn.commit()
-    conn.close()
+    if conn.dialect.name == 'postgresql':
+        copy_sql = "COPY {0} ({1}) FROM STDIN WITH (FORMAT csv, HEADER true, NULL '\\N')".format(
+            staging_table, column_str
+        )
+        cursor = conn.connection.cursor()
+        for i in range(0, len(data_df), SQL_COPY_CHUNK_ROWS):
+            buffer = io.StringIO()
+            data_df.iloc[i:i + SQL_COPY_CHUNK_ROWS].to_csv(buffer, index=False, na_rep='\\N')
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+        cursor.close()
+    else:
+        insert_sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            staging_table, column_str, ', '.join('?' * len(data_df.columns))
+        )
+        rows = data_df.astype(object).where(data_df.notnull(), None)
+        rows = [
+            tuple(value.isoformat(' ') if isinstance(value, pd.Timestamp) else value for value in row)
+            for row in rows.itertuples(index=False, name=None)
+        ]
+        conn.connection.cursor().executemany(insert_sql, rows)
 
 
-def load_files_in_storage(file_type='spotify', db_type='postgres'):
+def upsert_frame(conn, table_name, data_df):
+    """
+    DESCRIPTION: load a dataframe into a table through a staging table. Rows whose
+                 key (SQL_UPSERT_KEY_TABLE) is already in the table are skipped,
+                 so loading the same data twice does not duplicate it
+    INPUT: conn (sqlalchemy connection), table_name (str), data_df (DataFrame)
+    OUTPUT: None
+    """
+    from sqlalchemy import text
+
+    table_column_list = get_table_columns(conn, table_name)
+    column_list = [x for x in data_df.columns if x in table_column_list]
+    data_df = data_df[column_list]
+    column_str = ', '.join(column_list)
+    staging_table = 'staging_{0}'.format(table_name)
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            'CREATE TEMP TABLE {0} ON COMMIT DROP AS SELECT {1} FROM {2} WITH NO DATA'.format(
+                staging_table, column_str, table_name
+            )
+        ))
+    else:
+        conn.execute(text('DROP TABLE IF EXISTS temp.{0}'.format(staging_table)))
+        conn.execute(text('CREATE TEMP TABLE {0} AS SELECT {1} FROM {2} WHERE 0'.format(
+            staging_table, column_str, table_name
+        )))
+
+    copy_frame_to_staging(conn, staging_table, data_df)
+
+    key_list = [x for x in SQL_UPSERT_KEY_TABLE.get(table_name, []) if x in column_list]
+    if key_list:
+        not_exists_str = 'NOT EXISTS (SELECT 1 FROM {0} t WHERE {1})'.format(
+            table_name,
+            ' AND '.join('t.{0} = s.{0}'.format(key) for key in key_list)
+        )
+    else:
+        not_exists_str = '1 = 1'
+
+    conn.execute(text("""
+        INSERT INTO {0} ({1})
+        SELECT DISTINCT {2} FROM {3} s
+        WHERE {4}
+        ON CONFLICT DO NOTHING
+    """.format(
+        table_name,
+        column_str,
+        ', '.join('s.{0}'.format(x) for x in column_list),
+        staging_table,
+        not_exists_str
+    )))
+
+    if conn.dialect.name != 'postgresql':
+        conn.execute(text('DROP TABLE temp.{0}'.format(staging_table)))
+
+    METRICS.inc('rows_total', len(data_df), stage='sql_load', source=table_name)
+
+
+def bulk_load_frames(frame_table, engine):
+    """
+    DESCRIPTION: load several dataframes in a single transaction. Either all the
+                 tables are loaded or none is
+    INPUT: frame_table (dict of lists of dataframes, by table name), engine (sqlalchemy engine)
+    OUTPUT: None
+    """
+    import pandas as pd
+
+    with engine.begin() as conn:
+        for table_name, data_df_list in frame_table.items():
+            data_df_list = [x for x in data_df_list if not x.empty]
+            if not table_name or not data_df_list:
+                continue
+
+            data_df = pd.concat(data_df_list, ignore_index=True)
+            with METRICS.timer('sql_load_seconds', table=table_name):
+                upsert_frame(conn, table_name, data_df)
+
+
+def get_engine(db_type='postgres'):
+    """
+    DESCRIPTION: get the shared engine of the selected database
+    INPUT: db_type (str/optional)
+    OUTPUT: engine (sqlalchemy engine)
+    """
+    if db_type == 'sqlite':
+        return get_sqlite_engine()
+    elif db_type == 'postgres':
+        return get_postgress_engine()
+
+    raise ValueError('please select a valid db type [sqlite, postgres]')
+
+
+def load_to_postgres(table_name, file_path):
+    """
+    DESCRIPTION: load a stored file into a postgres table
+    INPUT: table_name (str), file_path (str)
+    OUTPUT: None
+    """
+    bulk_load_frames({table_name: [read_frame(file_path)]}, get_postgress_engine())
+
+
+def load_to_sqlite(table_name, file_path):
+    """
+    DESCRIPTION: load a stored file into a sqlite table
+    INPUT: table_name (str), file_path (str)
+    OUTPUT: None
     """
+    bulk_load_frames({table_name: [read_frame(file_path)]}, get_sqlite_engine())
+
+
+def get_storage_path():
     """
-    storage_path = os.path.join(
+    DESCRIPTION: get the path of the local storage of the music trends files
+    INPUT: None
+    OUTPUT: storage_path (str)
+    """
+    return os.path.join(
         os.path.dirname(os.path.abspath(__file__)),
         '..',
         'storage_music_trends'
     )
-    storage_file_list = os.listdir(storage_path)
-    selected_files = [x for x in storage_file_list if x.startswith(file_type)]
-
-    table_lookup = {
-        'spotify': 'tendencias_musicais_app_spotifydata',
-        'billboard': '',
-        'playlists': 'tendencias_musicais_app_playlists',
-        'artists': 'tendencias_musicais_app_artists',
-        'djmag': ''
-    }
-    table_name = table_lookup[file_type]
-
-    for file_name in selected_files:
-        print(file_name)
-        file_path = os.path.join(storage_path, file_name)
-        if db_type == 'sqlite':
-            load_to_sqlite(table_name, file_path)
-        elif db_type == 'postgres':
-            load_to_postgres(table_name, file_path)
-        else:
-            print('please select a valid db type [sqlite, postgres]')
+
+
+def get_archive_path():
+    """
+    DESCRIPTION: get the path of the archive of the stored files, by date
+    INPUT: None
+    OUTPUT: archive_path (str)
+    """
+    return os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        '..',
+        'archive_music_trends'
+    )
+
+
+def read_storage_frame(file_path, snapshot_deltas=None):
+    """
+    DESCRIPTION: read a stored file to load it in the database. The database
+                 keeps whole snapshots, so a delta is loaded as the snapshot
+                 rebuilt from its chain of keyframe and deltas
+    INPUT: file_path (str), snapshot_deltas (SnapshotDeltaIndex/optional)
+    OUTPUT: data_df (DataFrame)
+    """
+    from utilities import snapshot_delta
+
+    data_df = read_frame(file_path)
+    if not snapshot_delta.is_delta_frame(data_df):
+        return data_df
+
+    if snapshot_deltas is None:
+        snapshot_deltas = snapshot_delta.SnapshotDeltaIndex(
+            search_path_list=[os.path.dirname(file_path), get_archive_path()]
+        )
+    snapshot_df = snapshot_deltas.reconstruct_file(os.path.basename(file_path))
+    if snapshot_df is None:
+        raise ValueError('can not rebuild the snapshot of the delta file {0}'.format(file_path))
+
+    return snapshot_df
+
+
+def get_new_storage_files(file_type_list, load_manifest, storage_path=None):
+    """
+    DESCRIPTION: list the storage files of the given types that are not in the
+                 load manifest yet (or whose content changed since loaded)
+    INPUT: file_type_list (list), load_manifest (LoadManifest), storage_path (str/optional)
+    OUTPUT: manifest_entry_list (list of dicts)
+    """
+    if storage_path is None:
+        storage_path = get_storage_path()
+    if not os.path.exists(storage_path):
+        return []
+
+    storage_file_list = sorted(os.listdir(storage_path))
+
+    manifest_entry_list = []
+    for file_type in file_type_list:
+        table_name = TABLE_LOOKUP[file_type]
+        if not table_name:
+            continue
+
+        selected_files = [
+            x for x in storage_file_list
+            if x.startswith(file_type) and get_file_storage_format(x) is not None
+        ]
+        for file_name in selected_files:
+            file_path = os.path.join(storage_path, file_name)
+            checksum = get_file_checksum(file_path)
+            if load_manifest.is_loaded(file_name, checksum):
+                continue
+
+            manifest_entry_list.append({
+                'file_name': file_name,
+                'file_path': file_path,
+                'checksum': checksum,
+                'target_table': table_name,
+            })
+
+    return manifest_entry_list
+
+
+def load_with_manifest(frame_table, manifest_entry_list, load_manifest, engine):
+    """
+    DESCRIPTION: load the dataframes in one transaction and, once it is committed,
+                 record their files in the load manifest
+    INPUT: frame_table (dict), manifest_entry_list (list), load_manifest (LoadManifest),
+           engine (sqlalchemy engine)
+    OUTPUT: None
+    """
+    bulk_load_frames(frame_table, engine)
+    if manifest_entry_list:
+        load_manifest.record_loads(manifest_entry_list)
+
+
+def load_storage_to_sql(file_type_list, db_type='postgres', load_manifest=None, storage_path=None):
+    """
+    DESCRIPTION: load the new storage files of several types in one transaction.
+                 Files already in the load manifest are skipped, and the delta
+                 files are loaded as their rebuilt snapshots
+    INPUT: file_type_list (list), db_type (str/optional), load_manifest (LoadManifest/optional),
+           storage_path (str/optional)
+    OUTPUT: None
+    """
+    if load_manifest is None:
+        load_manifest = LoadManifest()
+
+    manifest_entry_list = get_new_storage_files(file_type_list, load_manifest, storage_path)
+    if not manifest_entry_list:
+        print('no new files to load')
+        return
+
+    frame_table = {}
+    for manifest_entry in manifest_entry_list:
+        print(manifest_entry['file_name'])
+        data_df = read_storage_frame(manifest_entry['file_path'])
+        manifest_entry['row_count'] = len(data_df)
+        frame_table.setdefault(manifest_entry['target_table'], []).append(data_df)
+
+    load_with_manifest(frame_table, manifest_entry_list, load_manifest, get_engine(db_type))
+
+
+def load_files_in_storage(file_type='spotify', db_type='postgres'):
+    """
+    DESCRIPTION: load the storage files of one type
+    INPUT: file_type (str/optional), db_type (str/optional)
+    OUTPUT: None
+    """
+    load_storage_to_sql([file_type], db_type)
 
 
 if __name__ == '__main__':
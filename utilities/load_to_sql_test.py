@@ -0,0 +1,175 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+import music_trends_cli
+from data_cleaning.schemas import apply_source_schema
+from utilities.local_cache import LoadManifest
+from utilities.load_to_sql import bulk_load_frames, get_new_storage_files
+from utilities.snapshot_delta import SnapshotDeltaIndex
+from utilities.storage_formats import write_frame
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                create table tendencias_musicais_app_artists (
+                    id integer primary key, artist_id text unique, name text,
+                    music_genre_1 text, music_genre_2 text, music_genre_3 text
+                )
+            """))
+            conn.execute(text("""
+                create table tendencias_musicais_app_spotifydata (
+                    id integer primary key, playlist_id_id text, main_artist_id_id text,
+                    song_name text, position integer, popularity integer, source_date datetime
+                )
+            """))
+
+        self.artists_df = pd.DataFrame([
+            {'artist_id': 'a1', 'name': 'one', 'music_genre_1': 'pop', 'music_genre_2': '', 'music_genre_3': ''},
+            {'artist_id': 'a2', 'name': 'two', 'music_genre_1': 'rock', 'music_genre_2': '', 'music_genre_3': ''},
+        ])
+        self.spotify_df = pd.DataFrame([
+            {'playlist_id_id': 'p1', 'main_artist_id_id': 'a1', 'song_name': 'x', 'position': 1,
+             'popularity': 90, 'source_date': datetime(2020, 8, 1, 12), 'not_in_table': 'dropped'},
+            {'playlist_id_id': 'p1', 'main_artist_id_id': 'a2', 'song_name': 'y', 'position': 2,
+             'popularity': None, 'source_date': datetime(2020, 8, 1, 12), 'not_in_table': 'dropped'},
+        ])
+
+    def count_rows(self, table_name):
+        with self.engine.connect() as conn:
+            return conn.execute(text('select count(*) from {0}'.format(table_name))).scalar()
+
+    def test_reload_is_idempotent(self):
+        frame_table = {
+            'tendencias_musicais_app_artists': [self.artists_df],
+            'tendencias_musicais_app_spotifydata': [self.spotify_df],
+        }
+        bulk_load_frames(frame_table, self.engine)
+        bulk_load_frames(frame_table, self.engine)
+
+        self.assertEqual(self.count_rows('tendencias_musicais_app_artists'), 2)
+        self.assertEqual(self.count_rows('tendencias_musicais_app_spotifydata'), 2)
+
+    def test_single_transaction(self):
+        broken_df = pd.DataFrame([{'playlist_id_id': 'p1', 'position': 'not a number'}])
+        frame_table = {
+            'tendencias_musicais_app_artists': [self.artists_df],
+            'missing_table': [broken_df],
+        }
+        with self.assertRaises(Exception):
+            bulk_load_frames(frame_table, self.engine)
+
+        self.assertEqual(self.count_rows('tendencias_musicais_app_artists'), 0)
+
+
+class TestLoadManifest(unittest.TestCase):
+
+    def test_only_new_files_are_listed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            load_manifest = LoadManifest(os.path.join(tmp_dir, 'cache.sqlite3'))
+            storage_path = os.path.join(tmp_dir, 'storage')
+            os.makedirs(storage_path)
+            for file_name in ['spotify_a_1.csv', 'spotify_b_2.csv', 'billboard_hot_100_1.csv']:
+                pd.DataFrame([{'x': file_name}]).to_csv(os.path.join(storage_path, file_name), index=False)
+
+            new_file_list = get_new_storage_files(['spotify', 'billboard'], load_manifest, storage_path)
+            self.assertEqual([x['file_name'] for x in new_file_list], ['spotify_a_1.csv', 'spotify_b_2.csv'])
+
+            load_manifest.record_loads([dict(new_file_list[0], row_count=1)])
+            new_file_list = get_new_storage_files(['spotify'], load_manifest, storage_path)
+            self.assertEqual([x['file_name'] for x in new_file_list], ['spotify_b_2.csv'])
+
+            load_manifest.connection.close()
+
+
+
+class TestLoadDeltaFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage_path = os.path.join(self.tmp_dir.name, 'storage')
+        os.makedirs(self.storage_path)
+        self.load_manifest = LoadManifest(os.path.join(self.tmp_dir.name, 'cache.sqlite3'))
+        self.snapshot_deltas = SnapshotDeltaIndex(
+            os.path.join(self.tmp_dir.name, 'cache.sqlite3'), search_path_list=[self.storage_path]
+        )
+        self.engine = create_engine('sqlite://')
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                create table tendencias_musicais_app_spotifydata (
+                    id integer primary key, playlist_id_id text, track_id text, position integer,
+                    popularity integer, source_date datetime
+                )
+            """))
+
+    def tearDown(self):
+        self.snapshot_deltas.connection.close()
+        self.load_manifest.connection.close()
+        self.tmp_dir.cleanup()
+
+    def store_snapshot(self, track_id_list, snapshot_date):
+        data_df = apply_source_schema(pd.DataFrame({
+            'playlist_id_id': 'p1',
+            'track_id': track_id_list,
+            'popularity': 80,
+            'position': range(1, len(track_id_list) + 1),
+            'source_date': snapshot_date,
+        }), 'spotify')
+        frame_type, frame_df = self.snapshot_deltas.encode('spotify', 'playlist_BRA', data_df)
+        file_path = write_frame(frame_df, os.path.join(self.storage_path, 'spotify_playlist_BRA_{0}'.format(
+            snapshot_date.strftime('%Y%m%d%H%M%S')
+        )), 'parquet')
+        self.snapshot_deltas.record('spotify', 'playlist_BRA', snapshot_date, frame_type, file_path, data_df)
+
+        return frame_type, file_path
+
+    def load_sql(self):
+        with mock.patch('utilities.load_to_sql.get_storage_path', return_value=self.storage_path), \
+                mock.patch('utilities.load_to_sql.LoadManifest', return_value=self.load_manifest), \
+                mock.patch('utilities.load_to_sql.get_engine', return_value=self.engine), \
+                mock.patch('utilities.snapshot_delta.SnapshotDeltaIndex', return_value=self.snapshot_deltas), \
+                mock.patch('sys.stdout'):
+            music_trends_cli.main(['load-sql', '--type', 'spotify', '--db', 'sqlite'])
+
+    def test_leftover_delta_is_loaded_as_snapshot(self):
+        snapshot_date = datetime(2020, 8, 1, 12)
+        track_id_list = ['t{0}'.format(x) for x in range(10)]
+        self.store_snapshot(track_id_list, snapshot_date)
+        self.load_sql()
+
+        # t0 and t1 swap, t9 leaves and t10 enters: the run fails before its sql load
+        next_list = ['t1', 't0'] + track_id_list[2:9] + ['t10']
+        frame_type, _ = self.store_snapshot(next_list, snapshot_date + timedelta(hours=1))
+        self.assertEqual(frame_type, 'delta')
+        self.load_sql()
+
+        with self.engine.connect() as conn:
+            row_list = conn.execute(text(
+                'select track_id from tendencias_musicais_app_spotifydata where source_date > :date order by position'
+            ), {'date': snapshot_date}).fetchall()
+        self.assertEqual([x[0] for x in row_list], next_list)
+
+    def test_delta_without_chain_fails(self):
+        snapshot_date = datetime(2020, 8, 1, 12)
+        self.store_snapshot(['t1', 't2', 't3'], snapshot_date)
+        self.store_snapshot(['t2', 't1', 't3'], snapshot_date + timedelta(hours=1))
+        # the keyframe was archived and then removed
+        os.remove(os.path.join(self.storage_path, 'spotify_playlist_BRA_20200801120000.parquet'))
+
+        with self.assertRaises(ValueError):
+            self.load_sql()
+
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(text('select count(*) from tendencias_musicais_app_spotifydata')).scalar(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,422 @@
+"""
+Module to handle the state kept on local disk between music trends runs
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from music_trends_constants import LOCAL_CACHE_DB
+
+
+class LocalCache():
+    """
+    DESCRIPTION: Base class for the caches stored in the local sqlite file
+    ATTRIBUTES:
+        - db_path (str)
+        - connection (sqlite3.Connection)
+        - lock (threading.Lock)
+        - schema (str)
+    METHODS:
+        - execute
+        - query
+        - get_meta
+        - set_meta
+    """
+    schema = ''
+
+    def __init__(self, db_path=LOCAL_CACHE_DB):
+        """
+        Constructor method for LocalCache
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                create table if not exists cache_meta (
+                    key text primary key,
+                    value text
+                );
+            """ + self.schema)
+
+
+    def execute(self, statement, params_list):
+        """
+        DESCRIPTION: Run a statement for each params tuple in a single transaction
+        INPUT: statement (str), params_list (list)
+        OUTPUT: None
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(statement, params_list)
+
+
+    def query(self, statement, params=()):
+        """
+        DESCRIPTION: Run a select statement
+        INPUT: statement (str), params (tuple/optional)
+        OUTPUT: rows (list)
+        """
+        with self.lock:
+            return self.connection.execute(statement, params).fetchall()
+
+
+    def get_meta(self, key, default=None):
+        """
+        DESCRIPTION: Read a value from the cache metadata table
+        INPUT: key (str), default (str/optional)
+        OUTPUT: value (str)
+        """
+        rows = self.query('select value from cache_meta where key = ?', (key,))
+        if not rows:
+            return default
+
+        return rows[0][0]
+
+
+    def set_meta(self, key, value):
+        """
+        DESCRIPTION: Write a value to the cache metadata table
+        INPUT: key (str), value (str)
+        OUTPUT: None
+        """
+        self.execute(
+            'insert or replace into cache_meta (key, value) values (?, ?)',
+            [(key, str(value))]
+        )
+
+
+class ArtistIdCache(LocalCache):
+    """
+    DESCRIPTION: Indexed local copy of the artist ids already in the database.
+                 It is synced incrementally from the artists table, using its
+                 serial id as watermark, so only new rows cross the wire.
+    ATTRIBUTES:
+        - db_path (str)
+        - table_name (str)
+    METHODS:
+        - add_artist_ids
+        - filter_unknown
+        - sync_from_db
+    """
+    schema = """
+        create table if not exists artist_ids (
+            artist_id text primary key
+        );
+    """
+    lookup_chunk_size = 500
+
+    def __init__(self, db_path=LOCAL_CACHE_DB, table_name='tendencias_musicais_app_artists'):
+        """
+        Constructor method for ArtistIdCache
+        """
+        super().__init__(db_path)
+        self.table_name = table_name
+
+
+    def add_artist_ids(self, artist_id_list):
+        """
+        DESCRIPTION: Register artist ids as known
+        INPUT: artist_id_list (list)
+        OUTPUT: None
+        """
+        self.execute(
+            'insert or ignore into artist_ids (artist_id) values (?)',
+            [(artist_id,) for artist_id in artist_id_list]
+        )
+
+
+    def filter_unknown(self, artist_id_list):
+        """
+        DESCRIPTION: Keep only the artist ids that are not in the cache, using
+                     the primary key index for the lookups
+        INPUT: artist_id_list (list)
+        OUTPUT: unknown_artist_list (list)
+        """
+        unique_artist_list = list(dict.fromkeys(artist_id_list))
+
+        known_artist_set = set()
+        for i in range(0, len(unique_artist_list), self.lookup_chunk_size):
+            chunk = unique_artist_list[i:i + self.lookup_chunk_size]
+            statement = 'select artist_id from artist_ids where artist_id in ({0})'.format(
+                ','.join('?' * len(chunk))
+            )
+            known_artist_set.update(row[0] for row in self.query(statement, tuple(chunk)))
+
+        unknown_artist_list = [x for x in unique_artist_list if x not in known_artist_set]
+
+        return unknown_artist_list
+
+
+    def sync_from_db(self, engine):
+        """
+        DESCRIPTION: Bring the artist ids inserted in the database since the last
+                     sync into the cache
+        INPUT: engine (sqlalchemy engine)
+        OUTPUT: new_rows (int)
+        """
+        from sqlalchemy import text
+
+        last_id = int(self.get_meta('artists_last_id', 0))
+        query = text("""
+            select id, artist_id
+            from {0}
+            where id > :last_id
+            order by id
+        """.format(self.table_name))
+
+        with engine.connect() as conn:
+            rows = conn.execute(query, {'last_id': last_id}).fetchall()
+
+        if rows:
+            self.add_artist_ids([row[1] for row in rows])
+            self.set_meta('artists_last_id', rows[-1][0])
+
+        return len(rows)
+
+
+class PlaylistStateCache(LocalCache):
+    """
+    DESCRIPTION: Last processed state of each playlist, keyed by playlist id.
+                 Keeps the Spotify snapshot_id and the http ETag so unchanged
+                 playlists can be skipped without downloading them again.
+    ATTRIBUTES:
+        - db_path (str)
+    METHODS:
+        - get_state
+        - set_states
+    """
+    schema = """
+        create table if not exists playlist_state (
+            playlist_id text primary key,
+            snapshot_id text,
+            etag text
+        );
+    """
+
+    def get_state(self, playlist_id):
+        """
+        DESCRIPTION: Get the last stored state of a playlist
+        INPUT: playlist_id (str)
+        OUTPUT: playlist_state (dict)
+        """
+        rows = self.query(
+            'select snapshot_id, etag from playlist_state where playlist_id = ?',
+            (playlist_id,)
+        )
+        if not rows:
+            return {}
+
+        return {'snapshot_id': rows[0][0], 'etag': rows[0][1]}
+
+
+    def set_states(self, playlist_state_table):
+        """
+        DESCRIPTION: Store the state of several playlists
+        INPUT: playlist_state_table (dict of dicts keyed by playlist id)
+        OUTPUT: None
+        """
+        self.execute(
+            'insert or replace into playlist_state (playlist_id, snapshot_id, etag) values (?, ?, ?)',
+            [
+                (playlist_id, state.get('snapshot_id'), state.get('etag'))
+                for playlist_id, state in playlist_state_table.items()
+            ]
+        )
+
+
+class LoadManifest(LocalCache):
+    """
+    DESCRIPTION: Record of the storage files already loaded into the database,
+                 with their checksum, row count and target table, so each load
+                 only reads the new files
+    ATTRIBUTES:
+        - db_path (str)
+    METHODS:
+        - is_loaded
+        - record_loads
+        - get_loaded_file_names
+    """
+    schema = """
+        create table if not exists load_manifest (
+            file_name text primary key,
+            checksum text,
+            row_count integer,
+            target_table text,
+            loaded_at real
+        );
+    """
+
+    def is_loaded(self, file_name, checksum):
+        """
+        DESCRIPTION: Check if a file, with this exact content, was already loaded
+        INPUT: file_name (str), checksum (str)
+        OUTPUT: loaded (bool)
+        """
+        rows = self.query(
+            'select 1 from load_manifest where file_name = ? and checksum = ?',
+            (file_name, checksum)
+        )
+
+        return bool(rows)
+
+
+    def record_loads(self, manifest_entry_list):
+        """
+        DESCRIPTION: Record files as loaded
+        INPUT: manifest_entry_list (list of dicts with file_name, checksum,
+               row_count and target_table)
+        OUTPUT: None
+        """
+        now = time.time()
+        self.execute(
+            """
+            insert or replace into load_manifest
+                (file_name, checksum, row_count, target_table, loaded_at)
+            values (?, ?, ?, ?, ?)
+            """,
+            [
+                (x['file_name'], x['checksum'], x['row_count'], x['target_table'], now)
+                for x in manifest_entry_list
+            ]
+        )
+
+
+    def get_loaded_file_names(self):
+        """
+        DESCRIPTION: Get the names of all the loaded files
+        INPUT: None
+        OUTPUT: file_name_set (set)
+        """
+        return {row[0] for row in self.query('select file_name from load_manifest')}
+
+
+class TrackEnrichmentCache(LocalCache):
+    """
+    DESCRIPTION: Enrichment of the tracks (audio features, album and isrc)
+                 keyed by track id, and of their albums keyed by album id, so
+                 each track and album is fetched once in its lifetime whatever
+                 the number of snapshots it appears in
+    ATTRIBUTES:
+        - db_path (str)
+    METHODS:
+        - filter_unknown
+        - add_records
+        - get_records
+    """
+    schema = """
+        create table if not exists track_enrichment (
+            track_id text primary key,
+            record text,
+            fetched_at real
+        );
+        create table if not exists album_enrichment (
+            album_id text primary key,
+            record text,
+            fetched_at real
+        );
+    """
+    lookup_chunk_size = 500
+    key_column_table = {
+        'track_enrichment': 'track_id',
+        'album_enrichment': 'album_id',
+    }
+
+    def filter_unknown(self, id_list, table_name='track_enrichment'):
+        """
+        DESCRIPTION: Keep only the ids that are not in the cache
+        INPUT: id_list (list), table_name (str/optional)
+        OUTPUT: unknown_id_list (list)
+        """
+        known_id_set = set(self.get_records(id_list, table_name))
+
+        return [x for x in dict.fromkeys(id_list) if x not in known_id_set]
+
+
+    def add_records(self, record_table, table_name='track_enrichment'):
+        """
+        DESCRIPTION: Store the records of several ids
+        INPUT: record_table (dict of dicts keyed by id), table_name (str/optional)
+        OUTPUT: None
+        """
+        now = time.time()
+        self.execute(
+            'insert or replace into {0} ({1}, record, fetched_at) values (?, ?, ?)'.format(
+                table_name, self.key_column_table[table_name]
+            ),
+            [(key, json.dumps(record), now) for key, record in record_table.items()]
+        )
+
+
+    def get_records(self, id_list, table_name='track_enrichment'):
+        """
+        DESCRIPTION: Get the stored records of several ids, using the primary
+                     key index for the lookups
+        INPUT: id_list (list), table_name (str/optional)
+        OUTPUT: record_table (dict of dicts keyed by id, only the ids found)
+        """
+        unique_id_list = list(dict.fromkeys(id_list))
+        key_column = self.key_column_table[table_name]
+
+        record_table = {}
+        for i in range(0, len(unique_id_list), self.lookup_chunk_size):
+            chunk = unique_id_list[i:i + self.lookup_chunk_size]
+            statement = 'select {0}, record from {1} where {0} in ({2})'.format(
+                key_column, table_name, ','.join('?' * len(chunk))
+            )
+            record_table.update((row[0], json.loads(row[1])) for row in self.query(statement, tuple(chunk)))
+
+        return record_table
+
+
+class SpotifyTokenCache(LocalCache):
+    """
+    DESCRIPTION: Spotify access tokens with their expiry time, keyed by client
+                 id, so the processes of a run (and the next runs) reuse a token
+                 until it expires instead of authenticating each time
+    ATTRIBUTES:
+        - db_path (str)
+    METHODS:
+        - get_token
+        - set_token
+    """
+    schema = """
+        create table if not exists spotify_token (
+            client_id text primary key,
+            access_token text,
+            expires_at real
+        );
+    """
+
+    def get_token(self, client_id, margin=0):
+        """
+        DESCRIPTION: Get the stored token of a client if it is still valid for
+                     at least margin seconds
+        INPUT: client_id (str), margin (number/optional)
+        OUTPUT: access_token (str) or None
+        """
+        rows = self.query(
+            'select access_token from spotify_token where client_id = ? and expires_at > ?',
+            (client_id, time.time() + margin)
+        )
+        if not rows:
+            return None
+
+        return rows[0][0]
+
+
+    def set_token(self, client_id, access_token, expires_in):
+        """
+        DESCRIPTION: Store the token of a client
+        INPUT: client_id (str), access_token (str), expires_in (number, seconds)
+        OUTPUT: None
+        """
+        self.execute(
+            'insert or replace into spotify_token (client_id, access_token, expires_at) values (?, ?, ?)',
+            [(client_id, access_token, time.time() + expires_in)]
+        )
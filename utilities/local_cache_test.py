@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+from sqlalchemy import create_engine, text
+
+from utilities.local_cache import ArtistIdCache
+
+
+class TestArtistIdCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ArtistIdCache(os.path.join(self.tmp_dir.name, 'cache.sqlite3'))
+        self.engine = create_engine('sqlite://')
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                'create table tendencias_musicais_app_artists (id integer primary key, artist_id text)'
+            ))
+
+    def tearDown(self):
+        self.cache.connection.close()
+        self.tmp_dir.cleanup()
+
+    def insert_artists(self, artist_id_list):
+        with self.engine.begin() as conn:
+            for artist_id in artist_id_list:
+                conn.execute(
+                    text('insert into tendencias_musicais_app_artists (artist_id) values (:a)'),
+                    {'a': artist_id}
+                )
+
+    def test_sync_is_incremental(self):
+        self.insert_artists(['a', 'b'])
+        self.assertEqual(self.cache.sync_from_db(self.engine), 2)
+        self.assertEqual(self.cache.sync_from_db(self.engine), 0)
+
+        self.insert_artists(['c'])
+        self.assertEqual(self.cache.sync_from_db(self.engine), 1)
+
+    def test_filter_unknown(self):
+        self.insert_artists(['a', 'b'])
+        self.cache.sync_from_db(self.engine)
+
+        received = self.cache.filter_unknown(['c', 'a', 'd', 'c', 'b'])
+
+        self.assertEqual(received, ['c', 'd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
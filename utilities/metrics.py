@@ -0,0 +1,263 @@
+"""
+Module to collect the metrics of a pipeline run (http calls, rows, bytes,
+retries and stage durations) and export them as json and as a Prometheus
+textfile
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from music_trends_constants import METRICS_LATENCY_BUCKETS
+
+METRIC_PREFIX = 'music_trends_'
+
+
+def get_label_key(label_table):
+    """
+    DESCRIPTION: get a hashable key from the labels of a metric
+    INPUT: label_table (dict)
+    OUTPUT: label_key (tuple)
+    """
+    return tuple(sorted((str(name), str(value)) for name, value in label_table.items()))
+
+
+def format_labels(label_key, extra_label_list=()):
+    """
+    DESCRIPTION: format labels in the Prometheus text format
+    INPUT: label_key (tuple), extra_label_list (list of (name, value)/optional)
+    OUTPUT: label_str (str)
+    """
+    label_list = list(label_key) + list(extra_label_list)
+    if not label_list:
+        return ''
+
+    return '{' + ','.join(
+        '{0}="{1}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in label_list
+    ) + '}'
+
+
+def write_atomic(file_path, content):
+    """
+    DESCRIPTION: write a text file through a temporary file and a rename
+    INPUT: file_path (str), content (str)
+    OUTPUT: None
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    tmp_path = '{0}.{1}.tmp'.format(file_path, os.getpid())
+    with open(tmp_path, 'w') as output_file:
+        output_file.write(content)
+    os.replace(tmp_path, file_path)
+
+
+class MetricsRegistry():
+    """
+    DESCRIPTION: Thread safe registry of counters, gauges and histograms,
+                 each one identified by its name and labels
+    ATTRIBUTES:
+        - buckets (tuple)
+        - counters (dict)
+        - gauges (dict)
+        - histograms (dict)
+    METHODS:
+        - reset
+        - inc
+        - set_gauge
+        - observe
+        - timer
+        - get_report
+        - get_prometheus_text
+        - write_json
+        - write_prometheus_textfile
+    """
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        """
+        Constructor method for MetricsRegistry
+        """
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+
+    def reset(self):
+        """
+        DESCRIPTION: Drop every metric, e.g. at the start of a run
+        INPUT: None
+        OUTPUT: None
+        """
+        with self.lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+
+    def inc(self, name, value=1, **labels):
+        """
+        DESCRIPTION: Add to a counter
+        INPUT: name (str), value (number/optional), labels (keyword args)
+        OUTPUT: None
+        """
+        key = (name, get_label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def set_gauge(self, name, value, **labels):
+        """
+        DESCRIPTION: Set the value of a gauge
+        INPUT: name (str), value (number), labels (keyword args)
+        OUTPUT: None
+        """
+        with self.lock:
+            self.gauges[(name, get_label_key(labels))] = value
+
+
+    def observe(self, name, value, **labels):
+        """
+        DESCRIPTION: Add an observation to a histogram
+        INPUT: name (str), value (number), labels (keyword args)
+        OUTPUT: None
+        """
+        key = (name, get_label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {'bucket_counts': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+                self.histograms[key] = histogram
+
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    histogram['bucket_counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        DESCRIPTION: Context manager observing the seconds spent in its block
+        INPUT: name (str), labels (keyword args)
+        OUTPUT: None
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+
+    def get_report(self):
+        """
+        DESCRIPTION: Get every metric as json friendly lists
+        INPUT: None
+        OUTPUT: report (dict)
+        """
+        with self.lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(label_key), 'value': value}
+                    for (name, label_key), value in sorted(self.counters.items())
+                ],
+                'gauges': [
+                    {'name': name, 'labels': dict(label_key), 'value': value}
+                    for (name, label_key), value in sorted(self.gauges.items())
+                ],
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(label_key),
+                        'buckets': dict(zip([str(x) for x in self.buckets], histogram['bucket_counts'])),
+                        'sum': histogram['sum'],
+                        'count': histogram['count'],
+                    }
+                    for (name, label_key), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+
+    def get_prometheus_text(self):
+        """
+        DESCRIPTION: Get every metric in the Prometheus text exposition format
+        INPUT: None
+        OUTPUT: prometheus_text (str)
+        """
+        line_list = []
+        with self.lock:
+            for metric_type, metric_table in [('counter', self.counters), ('gauge', self.gauges)]:
+                typed_name_set = set()
+                for (name, label_key), value in sorted(metric_table.items()):
+                    if name not in typed_name_set:
+                        line_list.append('# TYPE {0}{1} {2}'.format(METRIC_PREFIX, name, metric_type))
+                        typed_name_set.add(name)
+                    line_list.append('{0}{1}{2} {3}'.format(
+                        METRIC_PREFIX, name, format_labels(label_key), value
+                    ))
+
+            typed_name_set = set()
+            for (name, label_key), histogram in sorted(self.histograms.items()):
+                if name not in typed_name_set:
+                    line_list.append('# TYPE {0}{1} histogram'.format(METRIC_PREFIX, name))
+                    typed_name_set.add(name)
+
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(self.buckets, histogram['bucket_counts']):
+                    cumulative_count += bucket_count
+                    line_list.append('{0}{1}_bucket{2} {3}'.format(
+                        METRIC_PREFIX, name, format_labels(label_key, [('le', str(upper_bound))]), cumulative_count
+                    ))
+                line_list.append('{0}{1}_bucket{2} {3}'.format(
+                    METRIC_PREFIX, name, format_labels(label_key, [('le', '+Inf')]), histogram['count']
+                ))
+                line_list.append('{0}{1}_sum{2} {3}'.format(
+                    METRIC_PREFIX, name, format_labels(label_key), histogram['sum']
+                ))
+                line_list.append('{0}{1}_count{2} {3}'.format(
+                    METRIC_PREFIX, name, format_labels(label_key), histogram['count']
+                ))
+
+        return '\n'.join(line_list) + '\n'
+
+
+    def write_json(self, file_path, run_report=None):
+        """
+        DESCRIPTION: Write the metrics, together with a run report, as json
+        INPUT: file_path (str), run_report (dict/optional)
+        OUTPUT: None
+        """
+        report = dict(run_report or {})
+        report['metrics'] = self.get_report()
+        write_atomic(file_path, json.dumps(report, indent=4, default=str))
+
+
+    def write_prometheus_textfile(self, file_path):
+        """
+        DESCRIPTION: Write the metrics as a textfile for the node exporter
+                     textfile collector. It is replaced atomically, so the
+                     collector never reads half a file
+        INPUT: file_path (str)
+        OUTPUT: None
+        """
+        write_atomic(file_path, self.get_prometheus_text())
+
+
+# registry shared by every module of the process
+METRICS = MetricsRegistry()
+
+
+def record_http_call(client, endpoint, status, seconds, response_bytes=0):
+    """
+    DESCRIPTION: record an http call in the shared registry: count by status,
+                 latency histogram and bytes received
+    INPUT: client (str), endpoint (str), status (int or str), seconds (float),
+           response_bytes (int/optional)
+    OUTPUT: None
+    """
+    METRICS.inc('http_requests_total', client=client, endpoint=endpoint, status=status)
+    METRICS.observe('http_request_seconds', seconds, client=client, endpoint=endpoint)
+    if response_bytes:
+        METRICS.inc('http_response_bytes_total', response_bytes, client=client, endpoint=endpoint)
@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+import unittest
+
+from utilities.metrics import MetricsRegistry
+from utilities.stage_scheduler import StageScheduler
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_prometheus_text(self):
+        metrics = MetricsRegistry(buckets=(0.1, 1))
+        metrics.inc('http_requests_total', client='spotify', endpoint='playlists', status=200)
+        metrics.inc('http_requests_total', client='spotify', endpoint='playlists', status=200)
+        metrics.observe('http_request_seconds', 0.05, client='spotify')
+        metrics.observe('http_request_seconds', 0.5, client='spotify')
+        metrics.observe('http_request_seconds', 5, client='spotify')
+
+        prometheus_line_list = metrics.get_prometheus_text().splitlines()
+        self.assertIn('# TYPE music_trends_http_requests_total counter', prometheus_line_list)
+        self.assertIn(
+            'music_trends_http_requests_total{client="spotify",endpoint="playlists",status="200"} 2',
+            prometheus_line_list
+        )
+        self.assertIn('music_trends_http_request_seconds_bucket{client="spotify",le="1"} 2', prometheus_line_list)
+        self.assertIn('music_trends_http_request_seconds_bucket{client="spotify",le="+Inf"} 3', prometheus_line_list)
+        self.assertIn('music_trends_http_request_seconds_count{client="spotify"} 3', prometheus_line_list)
+
+    def test_scheduler_records_and_profiles_stages(self):
+        metrics = MetricsRegistry()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            scheduler = StageScheduler(metrics=metrics, profile_path=os.path.join(tmp_dir, 'profile'))
+            scheduler.add_stage('first', lambda: sum(range(1000)))
+            scheduler.add_stage('second', lambda: None, depends_on=['first'])
+            run_report = scheduler.run()
+
+            metrics.write_json(os.path.join(tmp_dir, 'run.json'), run_report)
+            with open(os.path.join(tmp_dir, 'run.json')) as report_file:
+                report = json.load(report_file)
+
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp_dir, 'profile'))), ['first.prof', 'second.prof'])
+
+        self.assertEqual(report['critical_path'], ['first', 'second'])
+        stage_gauge_list = [x for x in report['metrics']['gauges'] if x['name'] == 'stage_duration_seconds']
+        self.assertEqual(sorted(x['labels']['stage'] for x in stage_gauge_list), ['first', 'second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Module to handle the registry of playlists fetched by the music trends runs
+"""
+import json
+import os
+import zlib
+
+from music_trends_constants import PLAYLIST_REGISTRY_PATH, TOP_50_PLAYLIST_ID_TABLE
+
+
+def parse_shard(shard_str):
+    """
+    DESCRIPTION: parse a shard given as 'i/N' (shard i of N, starting at 0)
+    INPUT: shard_str (str)
+    OUTPUT: (shard_index, shard_count) (tuple of ints)
+    """
+    try:
+        shard_index, shard_count = [int(x) for x in shard_str.split('/')]
+    except ValueError:
+        raise ValueError('shard must be given as i/N, got {0}'.format(shard_str))
+
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError('shard index must be in [0, {0}), got {1}'.format(shard_count, shard_index))
+
+    return shard_index, shard_count
+
+
+def get_shard_index(playlist_id, shard_count):
+    """
+    DESCRIPTION: get the shard of a playlist. The crc32 of the id is stable
+                 between processes and hosts (unlike hash()), so every worker
+                 agrees on the partition without talking to the others
+    INPUT: playlist_id (str), shard_count (int)
+    OUTPUT: shard_index (int)
+    """
+    return zlib.crc32(playlist_id.encode('utf-8')) % shard_count
+
+
+class PlaylistRegistry():
+    """
+    DESCRIPTION: Registry of the playlists and markets to fetch, read from a
+                 json file so it can grow to hundreds of markets and chart
+                 types without code changes
+    ATTRIBUTES:
+        - registry_path (str)
+        - entry_list (list of dicts)
+    METHODS:
+        - load
+        - get_entries
+        - get_playlists_table
+    """
+    def __init__(self, registry_path=PLAYLIST_REGISTRY_PATH):
+        """
+        Constructor method for PlaylistRegistry
+        """
+        self.registry_path = registry_path
+        self.entry_list = self.load()
+
+
+    def load(self):
+        """
+        DESCRIPTION: Read the registry file, or build the registry from
+                     TOP_50_PLAYLIST_ID_TABLE when there is no file
+        INPUT: None
+        OUTPUT: entry_list (list of dicts)
+        """
+        if self.registry_path is None or not os.path.exists(self.registry_path):
+            return [
+                {
+                    'playlist_name': playlist_name,
+                    'playlist_id': playlist_id,
+                    'market': playlist_name.split('_', 1)[-1],
+                    'chart_type': 'top_50',
+                }
+                for playlist_name, playlist_id in TOP_50_PLAYLIST_ID_TABLE.items()
+            ]
+
+        with open(self.registry_path) as registry_file:
+            registry_json = json.load(registry_file)
+
+        return [x for x in registry_json['playlists'] if x.get('enabled', True)]
+
+
+    def get_entries(self, shard_index=0, shard_count=1, chart_type=None):
+        """
+        DESCRIPTION: Get the registry entries of one shard
+        INPUT: shard_index (int/optional), shard_count (int/optional), chart_type (str/optional)
+        OUTPUT: entry_list (list of dicts)
+        """
+        return [
+            x for x in self.entry_list
+            if get_shard_index(x['playlist_id'], shard_count) == shard_index
+            and (chart_type is None or x['chart_type'] == chart_type)
+        ]
+
+
+    def get_playlists_table(self, shard_index=0, shard_count=1, chart_type=None):
+        """
+        DESCRIPTION: Get the {playlist_name: playlist_id} table of one shard, the
+                     structure expected by SpotifyAPI
+        INPUT: shard_index (int/optional), shard_count (int/optional), chart_type (str/optional)
+        OUTPUT: playlists_table (dict)
+        """
+        return {
+            x['playlist_name']: x['playlist_id']
+            for x in self.get_entries(shard_index, shard_count, chart_type)
+        }
@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import unittest
+
+from utilities.playlist_registry import PlaylistRegistry, parse_shard
+
+
+class TestPlaylistRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.registry_path = os.path.join(self.tmp_dir.name, 'registry.json')
+        entry_list = [
+            {'playlist_name': 'playlist_{0}'.format(i), 'playlist_id': 'id_{0}'.format(i),
+             'market': 'M{0}'.format(i), 'chart_type': 'top_50'}
+            for i in range(300)
+        ]
+        entry_list[0]['enabled'] = False
+        with open(self.registry_path, 'w') as registry_file:
+            json.dump({'playlists': entry_list}, registry_file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_shards_partition_the_registry(self):
+        registry = PlaylistRegistry(self.registry_path)
+        shard_table_list = [registry.get_playlists_table(i, 4) for i in range(4)]
+
+        merged_name_list = sorted(name for table in shard_table_list for name in table)
+        self.assertEqual(merged_name_list, sorted(registry.get_playlists_table()))
+        self.assertEqual(len(merged_name_list), 299)
+        self.assertTrue(all(len(table) > 50 for table in shard_table_list))
+        self.assertEqual(shard_table_list[2], PlaylistRegistry(self.registry_path).get_playlists_table(2, 4))
+
+    def test_default_registry_and_parse_shard(self):
+        registry = PlaylistRegistry(os.path.join(self.tmp_dir.name, 'missing.json'))
+
+        self.assertEqual(registry.get_playlists_table()['playlist_BRA'], '37i9dQZEVXbMXbN3EUUhlg')
+        self.assertEqual(parse_shard('1/4'), (1, 4))
+        self.assertRaises(ValueError, parse_shard, '4/4')
+        self.assertRaises(ValueError, parse_shard, 'all')
+
+
+if __name__ == '__main__':
+    unittest.main()
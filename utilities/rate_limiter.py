@@ -0,0 +1,193 @@
+"""
+Module to pace the outbound calls of an api with a token bucket shared by the
+threads of a process and, through a locked state file, by the processes of a
+run. The rate adapts to the throttling answers of the api (AIMD)
+"""
+import json
+import os
+import random
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    # no file locks (windows): the bucket is shared by the threads only
+    fcntl = None
+
+from music_trends_constants import SPOTIFY_RATE_LIMIT
+
+
+def get_backoff_seconds(attempt, base=1.0, cap=30.0):
+    """
+    DESCRIPTION: get the wait before a retry: exponential in the attempt, capped,
+                 with full jitter so the clients do not retry together
+    INPUT: attempt (int, 0 for the first retry), base (float/optional), cap (float/optional)
+    OUTPUT: seconds (float)
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(retry_after, default=None):
+    """
+    DESCRIPTION: get the seconds of a Retry-After header (only the delay-seconds form)
+    INPUT: retry_after (str or None), default (float/optional)
+    OUTPUT: seconds (float)
+    """
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimiter():
+    """
+    DESCRIPTION: Token bucket with AIMD adaptation. Each call takes a token; the
+                 bucket refills at the current rate up to its capacity. Each
+                 success raises the rate by a small step up to max_rate, and a
+                 throttled answer cuts it by a factor down to min_rate and
+                 blocks every caller until its Retry-After. With a state_path
+                 the bucket lives in a json file locked with fcntl, so all the
+                 processes using it share the same budget
+    ATTRIBUTES:
+        - state_path (str or None)
+        - capacity (float)
+        - min_rate, max_rate (float, calls per second)
+        - increase_step (float), decrease_factor (float)
+        - state (dict): tokens, rate, updated_at and blocked_until
+    METHODS:
+        - update_state
+        - apply_update
+        - acquire
+        - on_success
+        - on_throttle
+        - get_rate
+    """
+    def __init__(self, rate=SPOTIFY_RATE_LIMIT['rate'], capacity=SPOTIFY_RATE_LIMIT['capacity'],
+                 min_rate=SPOTIFY_RATE_LIMIT['min_rate'], max_rate=SPOTIFY_RATE_LIMIT['max_rate'],
+                 increase_step=SPOTIFY_RATE_LIMIT['increase_step'],
+                 decrease_factor=SPOTIFY_RATE_LIMIT['decrease_factor'], state_path=None):
+        """
+        Constructor method for RateLimiter
+        """
+        self.capacity = float(capacity)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.state = {'tokens': self.capacity, 'rate': float(rate), 'updated_at': time.time(), 'blocked_until': 0.0}
+        if state_path is not None:
+            state_dir = os.path.dirname(state_path)
+            if state_dir:
+                os.makedirs(state_dir, exist_ok=True)
+
+
+    def update_state(self, update_function):
+        """
+        DESCRIPTION: Refill the bucket and apply a change to its state, under the
+                     thread lock and, with a state file, the file lock
+        INPUT: update_function (function of (state, now) returning a result)
+        OUTPUT: result (returned by update_function)
+        """
+        with self.lock:
+            if self.state_path is None:
+                return self.apply_update(self.state, update_function)
+
+            with open(self.state_path, 'a+') as state_file:
+                if fcntl is not None:
+                    fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    try:
+                        self.state.update(json.loads(state_file.read()))
+                    except ValueError:
+                        pass
+                    result = self.apply_update(self.state, update_function)
+                    state_file.seek(0)
+                    state_file.truncate()
+                    state_file.write(json.dumps(self.state))
+                    state_file.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(state_file, fcntl.LOCK_UN)
+
+            return result
+
+
+    def apply_update(self, state, update_function):
+        """
+        DESCRIPTION: Refill the tokens for the time elapsed, then apply a change
+        INPUT: state (dict), update_function (function)
+        OUTPUT: result (returned by update_function)
+        """
+        now = time.time()
+        elapsed = max(now - state['updated_at'], 0.0)
+        state['tokens'] = min(self.capacity, state['tokens'] + elapsed * state['rate'])
+        state['updated_at'] = now
+
+        return update_function(state, now)
+
+
+    def acquire(self):
+        """
+        DESCRIPTION: Wait until a call is allowed and take its token
+        INPUT: None
+        OUTPUT: waited (float, seconds)
+        """
+        def take_token(state, now):
+            if now < state['blocked_until']:
+                return state['blocked_until'] - now
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return 0.0
+            return (1 - state['tokens']) / state['rate']
+
+        waited = 0.0
+        while True:
+            wait_seconds = self.update_state(take_token)
+            if wait_seconds <= 0:
+                return waited
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+
+    def on_success(self):
+        """
+        DESCRIPTION: Additive increase of the rate after an accepted call
+        INPUT: None
+        OUTPUT: None
+        """
+        def increase(state, now):
+            state['rate'] = min(self.max_rate, state['rate'] + self.increase_step)
+
+        self.update_state(increase)
+
+
+    def on_throttle(self, retry_after=None):
+        """
+        DESCRIPTION: Multiplicative decrease of the rate after a throttled call,
+                     emptying the bucket and blocking every caller until the
+                     Retry-After of the answer. The calls already in flight
+                     that are throttled in the same window do not cut the
+                     rate again
+        INPUT: retry_after (float/optional, seconds)
+        OUTPUT: None
+        """
+        def decrease(state, now):
+            if now >= state['blocked_until']:
+                state['rate'] = max(self.min_rate, state['rate'] * self.decrease_factor)
+            state['tokens'] = 0.0
+            if retry_after:
+                state['blocked_until'] = max(state['blocked_until'], now + retry_after)
+
+        self.update_state(decrease)
+
+
+    def get_rate(self):
+        """
+        DESCRIPTION: Get the current rate
+        INPUT: None
+        OUTPUT: rate (float, calls per second)
+        """
+        return self.update_state(lambda state, now: state['rate'])
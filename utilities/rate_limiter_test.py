@@ -0,0 +1,66 @@
+import os
+import tempfile
+import time
+import unittest
+
+from utilities.rate_limiter import RateLimiter, get_backoff_seconds, parse_retry_after
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_bucket_pacing(self):
+        rate_limiter = RateLimiter(rate=20, capacity=2, max_rate=20)
+        start = time.perf_counter()
+        for _ in range(6):
+            rate_limiter.acquire()
+
+        # 2 calls from the bucket, then 4 at 20 per second
+        self.assertGreaterEqual(time.perf_counter() - start, 0.18)
+
+    def test_aimd(self):
+        rate_limiter = RateLimiter(rate=10, min_rate=1, max_rate=11, increase_step=0.5, decrease_factor=0.5)
+        rate_limiter.on_success()
+        self.assertEqual(rate_limiter.get_rate(), 10.5)
+        rate_limiter.on_success()
+        rate_limiter.on_success()
+        self.assertEqual(rate_limiter.get_rate(), 11)
+
+        rate_limiter.on_throttle(0.2)
+        self.assertEqual(rate_limiter.get_rate(), 5.5)
+        start = time.perf_counter()
+        rate_limiter.acquire()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.19)
+
+        for _ in range(10):
+            rate_limiter.on_throttle()
+        self.assertEqual(rate_limiter.get_rate(), 1)
+
+    def test_shared_state_file(self):
+        state_path = os.path.join(self.tmp_dir.name, 'rate_limit.json')
+        rate_limiter_1 = RateLimiter(rate=1, capacity=3, state_path=state_path)
+        rate_limiter_2 = RateLimiter(rate=1, capacity=3, state_path=state_path)
+
+        for rate_limiter in [rate_limiter_1, rate_limiter_2, rate_limiter_1]:
+            self.assertLess(rate_limiter.acquire(), 0.1)
+        # the bucket is empty for both
+        rate_limiter_2.on_throttle(0.3)
+        start = time.perf_counter()
+        rate_limiter_1.acquire()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.29)
+
+    def test_retry_helpers(self):
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', 1.0), 1.0)
+        self.assertEqual(parse_retry_after(None, 2.0), 2.0)
+        for attempt in range(10):
+            self.assertLessEqual(get_backoff_seconds(attempt, 0.5, 4.0), 4.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
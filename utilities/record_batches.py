@@ -0,0 +1,22 @@
+"""
+Module to split record streams into fixed-size batches
+"""
+import itertools
+
+
+def iter_record_batches(records, batch_size):
+    """
+    DESCRIPTION: split any iterable of records into lists of at most batch_size
+                 records, consuming it lazily
+    INPUT: records (iterable), batch_size (int)
+    OUTPUT: record_batch (generator of lists)
+    """
+    if batch_size < 1:
+        raise ValueError('batch_size must be positive')
+
+    records = iter(records)
+    while True:
+        record_batch = list(itertools.islice(records, batch_size))
+        if not record_batch:
+            return
+        yield record_batch
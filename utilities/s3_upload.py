@@ -0,0 +1,208 @@
+"""
+Module to handle the upload of the storage files to S3
+"""
+import gzip
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from music_trends_constants import S3_BUCKET, S3_COMPRESSION, S3_MAX_WORKERS
+from utilities.metrics import METRICS
+
+
+def compress_gzip(data):
+    """
+    DESCRIPTION: gzip the data with a fixed mtime, so the same content always
+                 gives the same bytes (and the same hash)
+    INPUT: data (bytes)
+    OUTPUT: compressed_data (bytes)
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as gzip_file:
+        gzip_file.write(data)
+
+    return buffer.getvalue()
+
+
+def compress_zstd(data):
+    """
+    DESCRIPTION: compress the data with zstandard
+    INPUT: data (bytes)
+    OUTPUT: compressed_data (bytes)
+    """
+    if zstandard is None:
+        raise ImportError('zstd compression needs the zstandard package')
+
+    return zstandard.ZstdCompressor().compress(data)
+
+
+COMPRESSION_TABLE = {
+    'gzip': {'extension': '.gz', 'compress': compress_gzip},
+    'zstd': {'extension': '.zst', 'compress': compress_zstd},
+}
+
+
+class S3Uploader():
+    """
+    DESCRIPTION: Concurrent uploader of the storage files. Files are uploaded by a
+                 pool of workers, each with multipart concurrency, under date
+                 partitioned keys. Objects already in the bucket with the same
+                 content hash are skipped, so an interrupted upload can just be
+                 run again.
+    ATTRIBUTES:
+        - bucket (str)
+        - s3_client (boto3 client)
+        - transfer_config (TransferConfig)
+        - max_workers (int)
+        - compression (str): None, gzip or zstd
+        - source_name_list (list)
+    METHODS:
+        - get_object_key
+        - get_payload
+        - is_uploaded
+        - upload_file
+        - upload_files
+    """
+    def __init__(self, bucket=S3_BUCKET, s3_client=None, max_workers=S3_MAX_WORKERS,
+                 compression=S3_COMPRESSION, source_name_list=()):
+        """
+        Constructor method for S3Uploader
+        """
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.s3_client = s3_client if s3_client is not None else boto3.client('s3')
+        self.transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=4,
+            use_threads=True
+        )
+        self.max_workers = max_workers
+        if compression is not None and compression not in COMPRESSION_TABLE:
+            raise ValueError('compression must be one of {0}'.format(list(COMPRESSION_TABLE)))
+        self.compression = compression
+        self.source_name_list = sorted(source_name_list, key=len, reverse=True)
+
+
+    def get_object_key(self, file_name):
+        """
+        DESCRIPTION: Build the date partitioned key of a storage file, named as
+                     {source}_{key}_{YYYYmmddHHMMSS}.{extension}
+        INPUT: file_name (str)
+        OUTPUT: object_key (str)
+        """
+        source_name = next(
+            (x for x in self.source_name_list if file_name.startswith(x + '_')),
+            file_name.split('_', 1)[0]
+        )
+        timestamp = os.path.splitext(file_name)[0].rsplit('_', 1)[-1]
+        if len(timestamp) >= 8 and timestamp[:8].isdigit():
+            date_str = '{0}-{1}-{2}'.format(timestamp[:4], timestamp[4:6], timestamp[6:8])
+        else:
+            date_str = 'unknown'
+
+        object_key = '{0}/date={1}/{2}'.format(source_name, date_str, file_name)
+        if self.compression is not None:
+            object_key += COMPRESSION_TABLE[self.compression]['extension']
+
+        return object_key
+
+
+    def get_payload(self, file_path):
+        """
+        DESCRIPTION: Read (and compress) a file and get the hash of the payload
+        INPUT: file_path (str)
+        OUTPUT: payload (bytes), checksum (str)
+        """
+        with open(file_path, 'rb') as upload_file:
+            payload = upload_file.read()
+
+        if self.compression is not None:
+            payload = COMPRESSION_TABLE[self.compression]['compress'](payload)
+
+        return payload, hashlib.sha256(payload).hexdigest()
+
+
+    def is_uploaded(self, object_key, checksum):
+        """
+        DESCRIPTION: Check if the bucket already has the object with this content
+        INPUT: object_key (str), checksum (str)
+        OUTPUT: uploaded (bool)
+        """
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket, Key=object_key)
+        except ClientError as error:
+            if error.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+        return response.get('Metadata', {}).get('sha256') == checksum
+
+
+    def upload_file(self, file_path):
+        """
+        DESCRIPTION: Upload one file, unless its content is already in the bucket
+        INPUT: file_path (str)
+        OUTPUT: status (str): uploaded or skipped
+        """
+        object_key = self.get_object_key(os.path.basename(file_path))
+        payload, checksum = self.get_payload(file_path)
+
+        if self.is_uploaded(object_key, checksum):
+            METRICS.inc('s3_files_total', status='skipped')
+            return 'skipped'
+
+        self.s3_client.upload_fileobj(
+            io.BytesIO(payload),
+            self.bucket,
+            object_key,
+            ExtraArgs={'Metadata': {'sha256': checksum}},
+            Config=self.transfer_config
+        )
+        METRICS.inc('s3_files_total', status='uploaded')
+        METRICS.inc('bytes_total', len(payload), stage='s3_upload', source=object_key.split('/', 1)[0])
+
+        return 'uploaded'
+
+
+    def upload_files(self, file_path_list):
+        """
+        DESCRIPTION: Upload several files concurrently
+        INPUT: file_path_list (list)
+        OUTPUT: upload_status_table (dict of status by file path)
+        """
+        with ThreadPoolExecutor(max_workers=max(self.max_workers, 1)) as executor:
+            status_list = list(executor.map(self.upload_file, file_path_list))
+
+        return dict(zip(file_path_list, status_list))
+
+
+def upload_storage_files(storage_path, source_name_list=(), s3_uploader=None):
+    """
+    DESCRIPTION: upload every file of a storage directory, skipping the ones
+                 whose content is already in the bucket
+    INPUT: storage_path (str), source_name_list (list/optional),
+           s3_uploader (S3Uploader/optional, a new one by default)
+    OUTPUT: upload_status_table (dict of status by file path)
+    """
+    if not os.path.exists(storage_path):
+        return {}
+
+    if s3_uploader is None:
+        s3_uploader = S3Uploader(source_name_list=source_name_list)
+    file_path_list = [
+        os.path.join(storage_path, file_name)
+        for file_name in sorted(os.listdir(storage_path))
+    ]
+
+    return s3_uploader.upload_files(file_path_list)
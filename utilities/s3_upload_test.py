@@ -0,0 +1,65 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+from utilities.s3_upload import S3Uploader
+
+
+@unittest.skipIf(mock_aws is None, 'moto is not installed')
+class TestS3Uploader(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        self.s3_client = boto3.client('s3', region_name='us-east-1')
+        self.s3_client.create_bucket(Bucket='test-bucket')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path_list = []
+        for file_name in ['dj_mag_top100djs_20200801120000.csv', 'spotify_playlist_BRA_20200801120000.csv']:
+            file_path = os.path.join(self.tmp_dir.name, file_name)
+            with open(file_path, 'w') as upload_file:
+                upload_file.write('artist,position\nsomeone,1\n')
+            self.file_path_list.append(file_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        self.mock.stop()
+
+    def test_upload_is_partitioned_and_deduplicated(self):
+        s3_uploader = S3Uploader(
+            bucket='test-bucket',
+            s3_client=self.s3_client,
+            source_name_list=['dj_mag', 'spotify']
+        )
+
+        first_status = s3_uploader.upload_files(self.file_path_list)
+        second_status = s3_uploader.upload_files(self.file_path_list)
+
+        self.assertEqual(set(first_status.values()), {'uploaded'})
+        self.assertEqual(set(second_status.values()), {'skipped'})
+        object_key_list = [x['Key'] for x in self.s3_client.list_objects_v2(Bucket='test-bucket')['Contents']]
+        self.assertEqual(sorted(object_key_list), [
+            'dj_mag/date=2020-08-01/dj_mag_top100djs_20200801120000.csv',
+            'spotify/date=2020-08-01/spotify_playlist_BRA_20200801120000.csv',
+        ])
+
+    def test_gzip_compression(self):
+        s3_uploader = S3Uploader(bucket='test-bucket', s3_client=self.s3_client, compression='gzip')
+
+        s3_uploader.upload_files(self.file_path_list[:1])
+        self.assertEqual(s3_uploader.upload_files(self.file_path_list[:1]), {self.file_path_list[0]: 'skipped'})
+
+        object_key = s3_uploader.get_object_key(os.path.basename(self.file_path_list[0]))
+        body = self.s3_client.get_object(Bucket='test-bucket', Key=object_key)['Body'].read()
+        self.assertEqual(gzip.decompress(body), b'artist,position\nsomeone,1\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
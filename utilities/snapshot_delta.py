@@ -0,0 +1,273 @@
+"""
+Module to store the chart snapshots as row-level deltas: each snapshot is
+compared with the previous one of the same source and key, and only the rows
+that entered, left or changed are stored, with a full snapshot (keyframe)
+from time to time so a snapshot is rebuilt from a short chain of files
+"""
+import os
+import pandas as pd
+
+from music_trends_constants import LOCAL_CACHE_DB, SNAPSHOT_DELTA_KEY_TABLE, SNAPSHOT_KEYFRAME_INTERVAL
+from utilities.local_cache import LocalCache
+from utilities.storage_formats import read_frame
+
+DELTA_TYPE_COLUMN = 'delta_type'
+# column set from the snapshot date when a snapshot is rebuilt, so it is not compared
+SNAPSHOT_DATE_COLUMN = 'source_date'
+# column giving the order of the rows of a rebuilt snapshot
+SNAPSHOT_ORDER_COLUMN = 'position'
+
+
+def is_delta_frame(data_df):
+    """
+    DESCRIPTION: check if a stored frame is a delta
+    INPUT: data_df (DataFrame)
+    OUTPUT: is_delta (bool)
+    """
+    return DELTA_TYPE_COLUMN in data_df.columns
+
+
+def restore_column_types(data_df, reference_df):
+    """
+    DESCRIPTION: cast the columns of a frame to the types of a reference frame
+                 (the categories are rebuilt from the values of the frame)
+    INPUT: data_df (DataFrame), reference_df (DataFrame)
+    OUTPUT: data_df (DataFrame)
+    """
+    for column in reference_df.columns:
+        if column not in data_df.columns:
+            continue
+        column_type = reference_df[column].dtype
+        if isinstance(column_type, pd.CategoricalDtype):
+            data_df[column] = data_df[column].astype(object).astype('category')
+        elif data_df[column].dtype != column_type:
+            data_df[column] = data_df[column].astype(column_type)
+
+    return data_df
+
+
+def encode_snapshot_delta(previous_df, current_df, key_columns):
+    """
+    DESCRIPTION: get the rows of a snapshot that entered or changed since the
+                 previous one (with their new values) and the rows that left
+                 it (with their last values), with their delta_type
+    INPUT: previous_df (DataFrame), current_df (DataFrame), key_columns (list)
+    OUTPUT: delta_df (DataFrame, None when the snapshots can not be compared:
+            other columns, no key columns or a key repeated in a snapshot)
+    """
+    if set(previous_df.columns) != set(current_df.columns) or not set(key_columns) <= set(current_df.columns) \
+            or previous_df.duplicated(key_columns).any() or current_df.duplicated(key_columns).any():
+        return None
+
+    value_columns = [x for x in current_df.columns if x not in key_columns and x != SNAPSHOT_DATE_COLUMN]
+    previous_indexed_df = previous_df.astype({x: object for x in key_columns}).set_index(key_columns)
+    current_indexed_df = current_df.astype({x: object for x in key_columns}).set_index(key_columns)
+
+    common_index = current_indexed_df.index.intersection(previous_indexed_df.index)
+    current_values_df = current_indexed_df.loc[common_index, value_columns].astype(object)
+    previous_values_df = previous_indexed_df.loc[common_index, value_columns].astype(object)
+    is_same_df = (current_values_df == previous_values_df) | (current_values_df.isnull() & previous_values_df.isnull())
+    changed_index = common_index[~is_same_df.all(axis=1).to_numpy()]
+
+    delta_df = pd.concat([
+        current_indexed_df.loc[current_indexed_df.index.difference(previous_indexed_df.index)].assign(
+            **{DELTA_TYPE_COLUMN: 'entry'}
+        ),
+        current_indexed_df.loc[changed_index].assign(**{DELTA_TYPE_COLUMN: 'change'}),
+        previous_indexed_df.loc[previous_indexed_df.index.difference(current_indexed_df.index)].assign(
+            **{DELTA_TYPE_COLUMN: 'exit'}
+        ),
+    ]).reset_index()
+
+    return restore_column_types(delta_df[list(current_df.columns) + [DELTA_TYPE_COLUMN]], current_df)
+
+
+def apply_snapshot_delta(previous_df, delta_df, key_columns, snapshot_date=None):
+    """
+    DESCRIPTION: rebuild a snapshot from the previous one and its delta
+    INPUT: previous_df (DataFrame), delta_df (DataFrame), key_columns (list),
+           snapshot_date (datetime/optional, source_date of the rebuilt snapshot)
+    OUTPUT: snapshot_df (DataFrame)
+    """
+    previous_key_index = pd.MultiIndex.from_frame(previous_df[key_columns].astype(object))
+    delta_key_index = pd.MultiIndex.from_frame(delta_df[key_columns].astype(object))
+
+    snapshot_df = pd.concat([
+        previous_df[~previous_key_index.isin(delta_key_index)],
+        delta_df[delta_df[DELTA_TYPE_COLUMN] != 'exit'].drop(columns=[DELTA_TYPE_COLUMN]),
+    ], ignore_index=True)
+    if snapshot_date is not None and SNAPSHOT_DATE_COLUMN in snapshot_df.columns:
+        snapshot_df[SNAPSHOT_DATE_COLUMN] = pd.Series(
+            pd.Timestamp(snapshot_date), index=snapshot_df.index
+        ).astype(previous_df[SNAPSHOT_DATE_COLUMN].dtype)
+    if SNAPSHOT_ORDER_COLUMN in snapshot_df.columns:
+        snapshot_df = snapshot_df.sort_values(SNAPSHOT_ORDER_COLUMN, kind='stable', ignore_index=True)
+
+    return restore_column_types(snapshot_df, previous_df)
+
+
+class SnapshotDeltaIndex(LocalCache):
+    """
+    DESCRIPTION: Chain of the stored snapshots (keyframes and deltas) of each
+                 source and key. It encodes the new snapshots against the last
+                 one (kept in memory, or rebuilt from the files) and rebuilds
+                 any snapshot from its last keyframe and the deltas after it.
+                 The files are looked for in each path of search_path_list,
+                 directly or in the date partition of the archive
+    ATTRIBUTES:
+        - search_path_list (list)
+        - keyframe_interval (int)
+        - key_table (dict of the key columns of each source)
+        - head_table (dict of the last snapshot of each source and key)
+    METHODS:
+        - get_chain
+        - find_file
+        - reconstruct
+        - reconstruct_file
+        - encode
+        - record
+    """
+    schema = """
+        create table if not exists snapshot_chain (
+            source_name text,
+            key text,
+            snapshot_date text,
+            frame_type text,
+            file_name text,
+            primary key (source_name, key, snapshot_date)
+        );
+        create index if not exists snapshot_chain_file on snapshot_chain (file_name);
+    """
+
+    def __init__(self, db_path=LOCAL_CACHE_DB, search_path_list=(),
+                 keyframe_interval=SNAPSHOT_KEYFRAME_INTERVAL, key_table=SNAPSHOT_DELTA_KEY_TABLE):
+        """
+        Constructor method for SnapshotDeltaIndex
+        """
+        super().__init__(db_path)
+        self.search_path_list = list(search_path_list)
+        self.keyframe_interval = keyframe_interval
+        self.key_table = key_table
+        self.head_table = {}
+
+
+    def get_chain(self, source_name, key, snapshot_date=None):
+        """
+        DESCRIPTION: Get the files needed to rebuild a snapshot: its last
+                     keyframe and the deltas after it
+        INPUT: source_name (str), key (str), snapshot_date (datetime/optional, the last one by default)
+        OUTPUT: chain_list (list of (snapshot_date, frame_type, file_name), oldest first)
+        """
+        statement = 'select snapshot_date, frame_type, file_name from snapshot_chain ' \
+                    'where source_name = ? and key = ?'
+        params = (source_name, key)
+        if snapshot_date is not None:
+            statement += ' and snapshot_date <= ?'
+            params += (pd.Timestamp(snapshot_date).isoformat(),)
+        row_list = self.query(statement + ' order by snapshot_date desc', params)
+
+        chain_list = []
+        for row in row_list:
+            chain_list.append(tuple(row))
+            if row[1] == 'keyframe':
+                return chain_list[::-1]
+
+        return []
+
+
+    def find_file(self, file_name, snapshot_date):
+        """
+        DESCRIPTION: Find a stored file in the storage or in the archive
+        INPUT: file_name (str), snapshot_date (str or datetime)
+        OUTPUT: file_path (str, None when it is not found)
+        """
+        for search_path in self.search_path_list:
+            for file_path in [
+                    os.path.join(search_path, file_name),
+                    os.path.join(search_path, pd.Timestamp(snapshot_date).strftime('%Y%m%d'), file_name),
+            ]:
+                if os.path.exists(file_path):
+                    return file_path
+
+        return None
+
+
+    def reconstruct(self, source_name, key, snapshot_date=None):
+        """
+        DESCRIPTION: Rebuild a snapshot from its chain of files
+        INPUT: source_name (str), key (str), snapshot_date (datetime/optional, the last one by default)
+        OUTPUT: snapshot_df (DataFrame, None when a file of its chain is missing)
+        """
+        snapshot_df = None
+        for chain_date, frame_type, file_name in self.get_chain(source_name, key, snapshot_date):
+            file_path = self.find_file(file_name, chain_date)
+            if file_path is None:
+                return None
+
+            frame_df = read_frame(file_path)
+            if frame_type == 'keyframe':
+                snapshot_df = frame_df
+            else:
+                snapshot_df = apply_snapshot_delta(
+                    snapshot_df, frame_df, self.key_table[source_name], pd.Timestamp(chain_date)
+                )
+
+        return snapshot_df
+
+
+    def reconstruct_file(self, file_name):
+        """
+        DESCRIPTION: Rebuild the snapshot stored in a file (keyframe or delta)
+        INPUT: file_name (str)
+        OUTPUT: snapshot_df (DataFrame, None when the file or its chain is unknown)
+        """
+        row_list = self.query(
+            'select source_name, key, snapshot_date from snapshot_chain where file_name = ?', (file_name,)
+        )
+        if not row_list:
+            return None
+
+        source_name, key, snapshot_date = row_list[0]
+        return self.reconstruct(source_name, key, snapshot_date)
+
+
+    def encode(self, source_name, key, data_df):
+        """
+        DESCRIPTION: Get the frame to store for a new snapshot: a delta against
+                     the last snapshot of its source and key, or a keyframe
+                     when there is none, when the chain is keyframe_interval
+                     long or when the delta is not smaller than the snapshot
+        INPUT: source_name (str), key (str), data_df (DataFrame)
+        OUTPUT: frame_type (str, keyframe or delta), frame_df (DataFrame)
+        """
+        chain_list = self.get_chain(source_name, key)
+        if not chain_list or len(chain_list) >= self.keyframe_interval:
+            return 'keyframe', data_df
+
+        previous_df = self.head_table.get((source_name, key))
+        if previous_df is None:
+            previous_df = self.reconstruct(source_name, key)
+        if previous_df is None:
+            return 'keyframe', data_df
+
+        delta_df = encode_snapshot_delta(previous_df, data_df, self.key_table[source_name])
+        if delta_df is None or len(delta_df) >= len(data_df):
+            return 'keyframe', data_df
+
+        return 'delta', delta_df
+
+
+    def record(self, source_name, key, snapshot_date, frame_type, file_path, data_df):
+        """
+        DESCRIPTION: Add a stored frame to the chain of its source and key, and
+                     keep its full snapshot for the next encoding
+        INPUT: source_name (str), key (str), snapshot_date (datetime), frame_type (str),
+               file_path (str), data_df (DataFrame, the full snapshot)
+        OUTPUT: None
+        """
+        self.execute(
+            'insert or replace into snapshot_chain '
+            '(source_name, key, snapshot_date, frame_type, file_name) values (?, ?, ?, ?, ?)',
+            [(source_name, key, pd.Timestamp(snapshot_date).isoformat(), frame_type, os.path.basename(file_path))]
+        )
+        self.head_table[(source_name, key)] = data_df
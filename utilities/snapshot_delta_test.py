@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+import pandas as pd
+
+from data_cleaning.schemas import apply_source_schema
+from utilities.snapshot_delta import SnapshotDeltaIndex, apply_snapshot_delta, encode_snapshot_delta
+from utilities.snapshot_store import normalize_snapshot_frame
+from utilities.storage_formats import write_frame
+
+
+def make_snapshot(track_id_list, source_date, popularity_table=None):
+    popularity_table = popularity_table or {}
+    return apply_source_schema(pd.DataFrame({
+        'playlist_id_id': 'playlist_1',
+        'track_id': track_id_list,
+        'main_artist_id_id': ['artist_{0}'.format(x) for x in track_id_list],
+        'song_name': ['song {0}'.format(x) for x in track_id_list],
+        'popularity': [popularity_table.get(x, 80) for x in track_id_list],
+        'position': range(1, len(track_id_list) + 1),
+        'source_date': source_date,
+    }), 'spotify')
+
+
+class TestSnapshotDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage_path = os.path.join(self.tmp_dir.name, 'storage')
+        self.archive_path = os.path.join(self.tmp_dir.name, 'archive')
+        os.makedirs(self.storage_path)
+        self.snapshot_deltas = SnapshotDeltaIndex(
+            os.path.join(self.tmp_dir.name, 'cache.sqlite3'),
+            search_path_list=[self.storage_path, self.archive_path], keyframe_interval=3
+        )
+        self.start_date = datetime(2020, 8, 1)
+
+    def tearDown(self):
+        self.snapshot_deltas.connection.close()
+        self.tmp_dir.cleanup()
+
+    def assert_same_snapshot(self, snapshot_df, expected_df):
+        pd.testing.assert_frame_equal(normalize_snapshot_frame(snapshot_df), normalize_snapshot_frame(expected_df))
+
+    def test_encode_and_apply(self):
+        track_id_list = ['t{0}'.format(x) for x in range(50)]
+        previous_df = make_snapshot(track_id_list, self.start_date)
+        # t0 and t1 leave, t50 and t51 enter at the bottom, t2 gains popularity
+        current_df = make_snapshot(track_id_list[2:] + ['t50', 't51'], self.start_date + timedelta(hours=1), {'t2': 90})
+
+        delta_df = encode_snapshot_delta(previous_df, current_df, ['track_id'])
+        self.assertEqual(
+            delta_df.groupby('delta_type', observed=True).size().to_dict(), {'entry': 2, 'exit': 2, 'change': 48}
+        )
+        self.assert_same_snapshot(
+            apply_snapshot_delta(previous_df, delta_df, ['track_id'], self.start_date + timedelta(hours=1)),
+            current_df
+        )
+
+        # only the popularity of one track changes
+        next_df = make_snapshot(track_id_list[2:] + ['t50', 't51'], self.start_date + timedelta(hours=2), {'t3': 10})
+        delta_df = encode_snapshot_delta(current_df, next_df, ['track_id'])
+        self.assertEqual(delta_df['track_id'].astype(str).tolist(), ['t2', 't3'])
+
+        self.assertIsNone(encode_snapshot_delta(previous_df.drop(columns=['popularity']), current_df, ['track_id']))
+
+    def test_chain_and_reconstruction(self):
+        track_id_list = ['t{0}'.format(x) for x in range(20)]
+        snapshot_list = []
+        frame_type_list = []
+        for hour in range(5):
+            snapshot_date = self.start_date + timedelta(hours=hour)
+            # two tracks swap their positions and the last one is replaced
+            track_id_list = [track_id_list[1], track_id_list[0]] + track_id_list[2:-1] + ['n{0}'.format(hour)]
+            data_df = make_snapshot(track_id_list, snapshot_date)
+            frame_type, frame_df = self.snapshot_deltas.encode('spotify', 'playlist_1', data_df)
+            file_path = write_frame(
+                frame_df, os.path.join(self.storage_path, 'spotify_playlist_1_{0}'.format(
+                    snapshot_date.strftime('%Y%m%d%H%M%S')
+                )), 'parquet'
+            )
+            self.snapshot_deltas.record('spotify', 'playlist_1', snapshot_date, frame_type, file_path, data_df)
+            snapshot_list.append((snapshot_date, data_df, os.path.basename(file_path)))
+            frame_type_list.append(frame_type)
+
+        self.assertEqual(frame_type_list, ['keyframe', 'delta', 'delta', 'keyframe', 'delta'])
+
+        # the archived files are found in their date partition
+        os.makedirs(os.path.join(self.archive_path, '20200801'))
+        for _, _, file_name in snapshot_list[:2]:
+            shutil.move(
+                os.path.join(self.storage_path, file_name), os.path.join(self.archive_path, '20200801', file_name)
+            )
+
+        for snapshot_date, data_df, file_name in snapshot_list:
+            self.assert_same_snapshot(self.snapshot_deltas.reconstruct('spotify', 'playlist_1', snapshot_date), data_df)
+            self.assert_same_snapshot(self.snapshot_deltas.reconstruct_file(file_name), data_df)
+
+        os.remove(os.path.join(self.archive_path, '20200801', snapshot_list[0][2]))
+        self.assertIsNone(self.snapshot_deltas.reconstruct('spotify', 'playlist_1', snapshot_list[1][0]))
+        self.assertIsNone(self.snapshot_deltas.reconstruct_file('unknown.parquet'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+"""
+Module to keep the history of the chart snapshots in a local parquet store,
+partitioned by source, market and month (hive layout), so the history of a
+track or artist only reads the partitions and columns it needs
+"""
+import os
+import pandas as pd
+
+from music_trends_constants import PARQUET_COMPRESSION, SNAPSHOT_ENTITY_COLUMNS, SNAPSHOT_ROW_GROUP_SIZE, \
+    SNAPSHOT_STORE_PATH
+
+COMPACTED_FILE_NAME = 'compacted.parquet'
+
+
+def get_partition_month(snapshot_date):
+    """
+    DESCRIPTION: get the month partition of a snapshot date
+    INPUT: snapshot_date (datetime or str)
+    OUTPUT: month (str, YYYY-MM)
+    """
+    return pd.Timestamp(snapshot_date).strftime('%Y-%m')
+
+
+def normalize_snapshot_frame(data_df):
+    """
+    DESCRIPTION: cast a snapshot to the types kept in the store (categories and
+                 text to strings, integers to int64, dates to microseconds), so
+                 every file of a partition has the same schema whatever the
+                 downcasts of its run were
+    INPUT: data_df (DataFrame)
+    OUTPUT: data_df (DataFrame)
+    """
+    data_df = data_df.copy()
+    for column in data_df.columns:
+        column_type = data_df[column].dtype
+        if isinstance(column_type, pd.CategoricalDtype) or pd.api.types.is_object_dtype(column_type) \
+                or pd.api.types.is_string_dtype(column_type):
+            data_df[column] = data_df[column].astype(object).where(data_df[column].notnull(), None)
+            data_df[column] = data_df[column].astype('string')
+        elif pd.api.types.is_integer_dtype(column_type):
+            data_df[column] = data_df[column].astype('int64')
+        elif pd.api.types.is_datetime64_any_dtype(column_type):
+            data_df[column] = data_df[column].astype('datetime64[us]')
+
+    return data_df
+
+
+class SnapshotStore():
+    """
+    DESCRIPTION: Parquet store of the chart snapshots, laid out as
+                 {store_path}/source={source}/market={market}/month={YYYY-MM}/
+                 with one file per snapshot. Old months can be compacted into
+                 one file sorted by the entity ids, so their row groups
+                 statistics let the readers skip most of the data
+    ATTRIBUTES:
+        - store_path (str)
+    METHODS:
+        - get_partition_path
+        - write_snapshot
+        - history
+        - compact_partition
+        - compact
+    """
+    def __init__(self, store_path=SNAPSHOT_STORE_PATH):
+        """
+        Constructor method for SnapshotStore
+        """
+        self.store_path = store_path
+
+
+    def get_partition_path(self, source_name, market, snapshot_date):
+        """
+        DESCRIPTION: Get the directory of a partition
+        INPUT: source_name (str), market (str), snapshot_date (datetime)
+        OUTPUT: partition_path (str)
+        """
+        return os.path.join(
+            self.store_path,
+            'source={0}'.format(source_name),
+            'market={0}'.format(market),
+            'month={0}'.format(get_partition_month(snapshot_date))
+        )
+
+
+    def write_snapshot(self, source_name, market, data_df, snapshot_date):
+        """
+        DESCRIPTION: Write a snapshot to its partition. Writing the same snapshot
+                     again replaces its file
+        INPUT: source_name (str), market (str), data_df (DataFrame), snapshot_date (datetime)
+        OUTPUT: file_path (str) or None when the snapshot is empty
+        """
+        if data_df.empty:
+            return None
+
+        partition_path = self.get_partition_path(source_name, market, snapshot_date)
+        os.makedirs(partition_path, exist_ok=True)
+        file_path = os.path.join(
+            partition_path,
+            'snapshot_{0}.parquet'.format(pd.Timestamp(snapshot_date).strftime('%Y%m%d%H%M%S'))
+        )
+        # hidden while it is written, so the readers do not list it
+        tmp_path = os.path.join(partition_path, '.{0}.tmp'.format(os.path.basename(file_path)))
+        normalize_snapshot_frame(data_df).to_parquet(
+            tmp_path, engine='pyarrow', compression=PARQUET_COMPRESSION, index=False
+        )
+        os.replace(tmp_path, file_path)
+
+        return file_path
+
+
+    def history(self, entity_id, market=None, since=None, until=None, columns=None, source_name='spotify'):
+        """
+        DESCRIPTION: Get the rows of a track or artist in the snapshots. Only the
+                     partitions of the market and months asked are listed, and
+                     the id and date filters and the columns are pushed down to
+                     the parquet reader
+        INPUT: entity_id (str, track or artist id), market (str/optional, all by default),
+               since (datetime/optional), until (datetime/optional),
+               columns (list/optional, all by default), source_name (str/optional)
+        OUTPUT: history_df (DataFrame sorted by source_date, with the market column)
+        """
+        import pyarrow.dataset as ds
+
+        source_path = os.path.join(self.store_path, 'source={0}'.format(source_name))
+        if not os.path.exists(source_path):
+            return pd.DataFrame(columns=(columns or []) + ['market'])
+
+        dataset = ds.dataset(source_path, format='parquet', partitioning='hive')
+
+        entity_filter = None
+        for column in SNAPSHOT_ENTITY_COLUMNS[source_name]:
+            if column in dataset.schema.names:
+                column_filter = ds.field(column) == entity_id
+                entity_filter = column_filter if entity_filter is None else entity_filter | column_filter
+        if entity_filter is None:
+            raise ValueError('no entity column of {0} in the snapshots'.format(source_name))
+
+        filter_expression = entity_filter
+        if market is not None:
+            filter_expression = filter_expression & (ds.field('market') == market)
+        if since is not None:
+            filter_expression = filter_expression & (ds.field('month') >= get_partition_month(since)) \
+                & (ds.field('source_date') >= pd.Timestamp(since).to_pydatetime())
+        if until is not None:
+            filter_expression = filter_expression & (ds.field('month') <= get_partition_month(until)) \
+                & (ds.field('source_date') <= pd.Timestamp(until).to_pydatetime())
+
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns) + ['source_date', 'market']))
+
+        history_df = dataset.to_table(columns=columns, filter=filter_expression).to_pandas()
+        history_df = history_df.drop(columns=['month'], errors='ignore')
+
+        return history_df.sort_values(['source_date', 'market'], ignore_index=True)
+
+
+    def compact_partition(self, partition_path, source_name):
+        """
+        DESCRIPTION: Merge the files of a partition into one, sorted by the
+                     entity ids and split in row groups
+        INPUT: partition_path (str), source_name (str)
+        OUTPUT: None
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        file_name_list = sorted(x for x in os.listdir(partition_path) if x.endswith('.parquet'))
+        if file_name_list == [COMPACTED_FILE_NAME] or not file_name_list:
+            return
+
+        table = pa.concat_tables(
+            [pq.read_table(os.path.join(partition_path, x)) for x in file_name_list],
+            promote_options='default'
+        )
+        sort_column_list = [x for x in SNAPSHOT_ENTITY_COLUMNS[source_name] if x in table.schema.names][:1]
+        table = table.sort_by([(x, 'ascending') for x in sort_column_list + ['source_date']])
+
+        tmp_path = os.path.join(partition_path, '.{0}.tmp'.format(COMPACTED_FILE_NAME))
+        pq.write_table(table, tmp_path, compression=PARQUET_COMPRESSION, row_group_size=SNAPSHOT_ROW_GROUP_SIZE)
+        os.replace(tmp_path, os.path.join(partition_path, COMPACTED_FILE_NAME))
+        for file_name in file_name_list:
+            if file_name != COMPACTED_FILE_NAME:
+                os.remove(os.path.join(partition_path, file_name))
+
+
+    def compact(self, before):
+        """
+        DESCRIPTION: Compact every partition of the months before a date (the
+                     months still receiving snapshots are left as they are)
+        INPUT: before (datetime)
+        OUTPUT: compacted_path_list (list)
+        """
+        before_month = get_partition_month(before)
+        compacted_path_list = []
+        if not os.path.exists(self.store_path):
+            return compacted_path_list
+
+        for source_dir in sorted(os.listdir(self.store_path)):
+            source_name = source_dir.split('=', 1)[-1]
+            source_path = os.path.join(self.store_path, source_dir)
+            for market_dir in sorted(os.listdir(source_path)):
+                market_path = os.path.join(source_path, market_dir)
+                for month_dir in sorted(os.listdir(market_path)):
+                    if month_dir.split('=', 1)[-1] >= before_month:
+                        continue
+
+                    partition_path = os.path.join(market_path, month_dir)
+                    self.compact_partition(partition_path, source_name)
+                    compacted_path_list.append(partition_path)
+
+        return compacted_path_list
+
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+import pandas as pd
+
+from data_cleaning.schemas import apply_source_schema
+from utilities.snapshot_store import SnapshotStore
+
+
+def make_snapshot(track_id_list, source_date):
+    return apply_source_schema(pd.DataFrame({
+        'playlist_id_id': 'playlist_1',
+        'track_id': track_id_list,
+        'main_artist_id_id': ['artist_{0}'.format(x[-1]) for x in track_id_list],
+        'song_name': ['song {0}'.format(x) for x in track_id_list],
+        'popularity': 80,
+        'position': range(1, len(track_id_list) + 1),
+        'source_date': source_date,
+    }), 'spotify')
+
+
+class TestSnapshotStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_store = SnapshotStore(self.tmp_dir.name)
+        for snapshot_date, market, track_id_list in [
+                (datetime(2020, 7, 30), 'BRA', ['t1a', 't2b']),
+                (datetime(2020, 8, 1), 'BRA', ['t2b', 't1a', 't3a']),
+                (datetime(2020, 8, 1), 'USA', ['t1a']),
+                (datetime(2020, 8, 2), 'BRA', ['t3a', 't2b']),
+        ]:
+            self.snapshot_store.write_snapshot(
+                'spotify', market, make_snapshot(track_id_list, snapshot_date), snapshot_date
+            )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_partition_layout(self):
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmp_dir.name, 'source=spotify', 'market=BRA', 'month=2020-08', 'snapshot_20200801000000.parquet'
+        )))
+
+    def test_history(self):
+        history_df = self.snapshot_store.history('t1a', market='BRA', columns=['position'])
+        self.assertEqual(history_df['position'].tolist(), [1, 2])
+        self.assertEqual(list(history_df.columns), ['position', 'source_date', 'market'])
+
+        history_df = self.snapshot_store.history('t1a', since=datetime(2020, 8, 1))
+        self.assertEqual(history_df['market'].tolist(), ['BRA', 'USA'])
+
+        # by artist
+        history_df = self.snapshot_store.history('artist_a', market='BRA', since=datetime(2020, 8, 2))
+        self.assertEqual(history_df['track_id'].tolist(), ['t3a'])
+
+        self.assertTrue(self.snapshot_store.history('t1a', source_name='billboard').empty)
+
+    def test_compact(self):
+        before_df = self.snapshot_store.history('t2b')
+        compacted_path_list = self.snapshot_store.compact(datetime(2020, 9, 1))
+
+        self.assertEqual(len(compacted_path_list), 3)
+        self.assertEqual(
+            os.listdir(os.path.join(self.tmp_dir.name, 'source=spotify', 'market=BRA', 'month=2020-08')),
+            ['compacted.parquet']
+        )
+        pd.testing.assert_frame_equal(self.snapshot_store.history('t2b'), before_df)
+
+
+if __name__ == '__main__':
+    unittest.main()
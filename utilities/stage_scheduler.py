@@ -0,0 +1,193 @@
+"""
+Module to run the pipeline stages as a dependency graph
+"""
+import cProfile
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class StageScheduler():
+    """
+    DESCRIPTION: Small DAG scheduler. Each stage runs in a thread pool as soon as
+                 all the stages it depends on are done, so independent stages
+                 run concurrently. The timings of each run are kept to report
+                 the critical path, and recorded in a metrics registry when one
+                 is given. With a profile_path each stage runs under cProfile
+                 and its stats are dumped to <profile_path>/<stage>.prof
+    ATTRIBUTES:
+        - max_workers (int)
+        - metrics (MetricsRegistry)
+        - profile_path (str)
+        - stages (dict)
+        - timings (dict)
+    METHODS:
+        - add_stage
+        - run
+        - run_profiled
+        - get_critical_path
+        - get_report
+        - print_report
+    """
+    def __init__(self, max_workers=4, metrics=None, profile_path=None):
+        """
+        Constructor method for StageScheduler
+        """
+        self.max_workers = max_workers
+        self.metrics = metrics
+        self.profile_path = profile_path
+        self.stages = {}
+        self.timings = {}
+
+
+    def add_stage(self, name, function, depends_on=()):
+        """
+        DESCRIPTION: Register a stage in the graph
+        INPUT: name (str), function (callable with no args), depends_on (list/optional)
+        OUTPUT: None
+        """
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError('stage {0} depends on unknown stage {1}'.format(name, dependency))
+
+        self.stages[name] = {'function': function, 'depends_on': list(depends_on)}
+
+
+    def run(self):
+        """
+        DESCRIPTION: Run all the stages respecting their dependencies. If a stage
+                     fails, no new stage is started and the error is raised once
+                     the running ones finish.
+        INPUT: None
+        OUTPUT: report (dict)
+        """
+        self.timings = {}
+        run_start = time.perf_counter()
+        pending = dict(self.stages)
+        done = set()
+        running = {}
+        first_error = None
+
+        def run_stage(name, function):
+            start = time.perf_counter() - run_start
+            status = 'error'
+            try:
+                if self.profile_path:
+                    self.run_profiled(name, function)
+                else:
+                    function()
+                status = 'ok'
+            finally:
+                end = time.perf_counter() - run_start
+                self.timings[name] = {'start': start, 'end': end}
+                if self.metrics is not None:
+                    self.metrics.set_gauge('stage_duration_seconds', end - start, stage=name)
+                    self.metrics.inc('stage_runs_total', stage=name, status=status)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if first_error is None:
+                    ready_list = [
+                        name for name, stage in pending.items()
+                        if all(dependency in done for dependency in stage['depends_on'])
+                    ]
+                    for name in ready_list:
+                        stage = pending.pop(name)
+                        future = executor.submit(run_stage, name, stage['function'])
+                        running[future] = name
+                elif not running:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None and first_error is None:
+                        first_error = error
+                    done.add(name)
+
+        if first_error is not None:
+            raise first_error
+
+        return self.get_report(time.perf_counter() - run_start)
+
+
+    def run_profiled(self, name, function):
+        """
+        DESCRIPTION: Run a stage under cProfile and dump its stats. The profiler
+                     only sees the thread of the stage; if another profiler is
+                     already active (python 3.12+ allows one at a time) the
+                     stage runs without it
+        INPUT: name (str), function (callable with no args)
+        OUTPUT: None
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            function()
+            return
+
+        try:
+            function()
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_path, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_path, '{0}.prof'.format(name)))
+
+
+    def get_critical_path(self):
+        """
+        DESCRIPTION: Walk back from the last stage to finish, always through the
+                     dependency that finished last
+        INPUT: None
+        OUTPUT: critical_path (list)
+        """
+        if not self.timings:
+            return []
+
+        name = max(self.timings, key=lambda x: self.timings[x]['end'])
+        critical_path = [name]
+        while self.stages[name]['depends_on']:
+            name = max(self.stages[name]['depends_on'], key=lambda x: self.timings[x]['end'])
+            critical_path.append(name)
+
+        return critical_path[::-1]
+
+
+    def get_report(self, total_seconds):
+        """
+        DESCRIPTION: Build the timing breakdown of the last run
+        INPUT: total_seconds (float)
+        OUTPUT: report (dict)
+        """
+        stages = {
+            name: dict(timing, seconds=timing['end'] - timing['start'])
+            for name, timing in sorted(self.timings.items(), key=lambda x: x[1]['start'])
+        }
+        critical_path = self.get_critical_path()
+
+        return {
+            'total_seconds': total_seconds,
+            'stages': stages,
+            'critical_path': critical_path,
+            'critical_path_seconds': sum(stages[name]['seconds'] for name in critical_path),
+        }
+
+
+    @staticmethod
+    def print_report(report):
+        """
+        DESCRIPTION: Print the timing breakdown of a run
+        INPUT: report (dict)
+        OUTPUT: None
+        """
+        print('total: {0:.2f}s'.format(report['total_seconds']))
+        for name, timing in report['stages'].items():
+            marker = '*' if name in report['critical_path'] else ' '
+            print('{0} {1:<24} {2:>8.2f}s -> {3:>8.2f}s ({4:.2f}s)'.format(
+                marker, name, timing['start'], timing['end'], timing['seconds']
+            ))
+        print('critical path: {0} ({1:.2f}s)'.format(
+            ' -> '.join(report['critical_path']), report['critical_path_seconds']
+        ))
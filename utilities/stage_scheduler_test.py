@@ -0,0 +1,43 @@
+import time
+import unittest
+
+from utilities.stage_scheduler import StageScheduler
+
+
+class TestStageScheduler(unittest.TestCase):
+
+    def test_independent_stages_run_concurrently(self):
+        scheduler = StageScheduler(max_workers=4)
+        scheduler.add_stage('fetch_a', lambda: time.sleep(0.2))
+        scheduler.add_stage('fetch_b', lambda: time.sleep(0.05))
+        scheduler.add_stage('clean_b', lambda: time.sleep(0.05), depends_on=['fetch_b'])
+        scheduler.add_stage('store', lambda: None, depends_on=['fetch_a', 'clean_b'])
+
+        report = scheduler.run()
+
+        self.assertLess(report['total_seconds'], 0.3)
+        self.assertLess(report['stages']['clean_b']['end'], report['stages']['fetch_a']['end'])
+        self.assertEqual(report['critical_path'], ['fetch_a', 'store'])
+
+    def test_failed_stage_stops_dependents(self):
+        calls = []
+
+        def fail():
+            raise RuntimeError('source down')
+
+        scheduler = StageScheduler()
+        scheduler.add_stage('fetch', fail)
+        scheduler.add_stage('store', lambda: calls.append('store'), depends_on=['fetch'])
+
+        with self.assertRaises(RuntimeError):
+            scheduler.run()
+        self.assertEqual(calls, [])
+
+    def test_unknown_dependency(self):
+        scheduler = StageScheduler()
+        with self.assertRaises(ValueError):
+            scheduler.add_stage('store', lambda: None, depends_on=['fetch'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+"""
+Module to handle the file formats used in the local storage
+"""
+import hashlib
+import os
+
+from music_trends_constants import PARQUET_COMPRESSION, PARQUET_MAX_PENDING_ROWS
+
+
+def write_parquet(data_df, file_path):
+    """
+    DESCRIPTION: write a dataframe as a compressed, typed parquet file
+    INPUT: data_df (DataFrame), file_path (str)
+    OUTPUT: None
+    """
+    data_df.to_parquet(file_path, engine='pyarrow', compression=PARQUET_COMPRESSION, index=False)
+
+
+def read_parquet(file_path):
+    """
+    DESCRIPTION: read a parquet file
+    INPUT: file_path (str)
+    OUTPUT: data_df (DataFrame)
+    """
+    import pandas as pd
+
+    return pd.read_parquet(file_path, engine='pyarrow')
+
+
+def write_csv(data_df, file_path):
+    """
+    DESCRIPTION: write a dataframe as csv
+    INPUT: data_df (DataFrame), file_path (str)
+    OUTPUT: None
+    """
+    data_df.to_csv(file_path, index=False)
+
+
+def read_csv(file_path):
+    """
+    DESCRIPTION: read a csv file
+    INPUT: file_path (str)
+    OUTPUT: data_df (DataFrame)
+    """
+    import pandas as pd
+
+    return pd.read_csv(file_path)
+
+
+class ParquetFrameWriter():
+    """
+    DESCRIPTION: Append dataframes to a parquet file, one row group per frame.
+                 The schema is taken from the first frames and the next ones
+                 are cast to it. A column without any value (null type) has
+                 no type yet, so the frames are held until a later frame
+                 gives it one, or until max_pending_rows rows are held, when
+                 the columns still untyped are written as strings
+    ATTRIBUTES:
+        - file_path (str)
+        - max_pending_rows (int)
+        - schema (pyarrow.Schema)
+        - pending_table_list (list of pyarrow.Table not written yet)
+        - writer (pyarrow.parquet.ParquetWriter)
+    METHODS:
+        - write
+        - merge_schema
+        - open_writer
+        - close
+    """
+    def __init__(self, file_path, max_pending_rows=PARQUET_MAX_PENDING_ROWS):
+        """
+        Constructor method for ParquetFrameWriter
+        """
+        self.file_path = file_path
+        self.max_pending_rows = max_pending_rows
+        self.schema = None
+        self.pending_table_list = []
+        self.writer = None
+
+
+    def write(self, data_df):
+        """
+        DESCRIPTION: Append a dataframe to the file
+        INPUT: data_df (DataFrame)
+        OUTPUT: None
+        """
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(data_df, preserve_index=False)
+        if self.writer is not None:
+            if not table.schema.equals(self.schema):
+                table = table.select(self.schema.names).cast(self.schema)
+            self.writer.write_table(table)
+            return
+
+        self.schema = table.schema if self.schema is None else self.merge_schema(table.schema)
+        self.pending_table_list.append(table)
+        has_null_type = any(pa.types.is_null(x.type) for x in self.schema)
+        if not has_null_type or sum(x.num_rows for x in self.pending_table_list) >= self.max_pending_rows:
+            self.open_writer()
+
+
+    def merge_schema(self, schema):
+        """
+        DESCRIPTION: Give the columns of the schema still without a type the
+                     type they have in a new frame
+        INPUT: schema (pyarrow.Schema)
+        OUTPUT: schema (pyarrow.Schema)
+        """
+        import pyarrow as pa
+
+        field_list = []
+        for field in self.schema:
+            if pa.types.is_null(field.type) and field.name in schema.names:
+                field = field.with_type(schema.field(field.name).type)
+            field_list.append(field)
+
+        return pa.schema(field_list, metadata=self.schema.metadata)
+
+
+    def open_writer(self, is_final=False):
+        """
+        DESCRIPTION: Open the parquet file with the schema known so far and
+                     write the frames held until then
+        INPUT: is_final (bool/optional): no frame comes next, so the columns
+               without any value keep the null type
+        OUTPUT: None
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not is_final:
+            self.schema = pa.schema(
+                [x.with_type(pa.string()) if pa.types.is_null(x.type) else x for x in self.schema],
+                metadata=self.schema.metadata
+            )
+        self.writer = pq.ParquetWriter(self.file_path, self.schema, compression=PARQUET_COMPRESSION)
+        for table in self.pending_table_list:
+            if not table.schema.equals(self.schema):
+                table = table.select(self.schema.names).cast(self.schema)
+            self.writer.write_table(table)
+        self.pending_table_list = []
+
+
+    def close(self):
+        """
+        DESCRIPTION: Write the frames still held and the parquet footer, and
+                     close the file
+        INPUT: None
+        OUTPUT: None
+        """
+        if self.writer is None and self.pending_table_list:
+            self.open_writer(is_final=True)
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class CsvFrameWriter():
+    """
+    DESCRIPTION: Append dataframes to a csv file, the header is written once
+    ATTRIBUTES:
+        - file_path (str)
+        - has_header (bool)
+    METHODS:
+        - write
+        - close
+    """
+    def __init__(self, file_path):
+        """
+        Constructor method for CsvFrameWriter
+        """
+        self.file_path = file_path
+        self.has_header = False
+
+
+    def write(self, data_df):
+        """
+        DESCRIPTION: Append a dataframe to the file
+        INPUT: data_df (DataFrame)
+        OUTPUT: None
+        """
+        data_df.to_csv(
+            self.file_path,
+            mode='a' if self.has_header else 'w',
+            header=not self.has_header,
+            index=False
+        )
+        self.has_header = True
+
+
+    def close(self):
+        """
+        DESCRIPTION: Nothing to flush, every write closes the file
+        INPUT: None
+        OUTPUT: None
+        """
+
+
+STORAGE_FORMAT_TABLE = {
+    'parquet': {
+        'extension': '.parquet',
+        'write': write_parquet,
+        'read': read_parquet,
+        'writer': ParquetFrameWriter,
+    },
+    'csv': {
+        'extension': '.csv',
+        'write': write_csv,
+        'read': read_csv,
+        'writer': CsvFrameWriter,
+    },
+}
+
+
+def get_file_storage_format(file_path):
+    """
+    DESCRIPTION: get the storage format of a file from its extension
+    INPUT: file_path (str)
+    OUTPUT: storage_format (str), None if the extension is unknown
+    """
+    extension = os.path.splitext(file_path)[1]
+    for storage_format, format_info in STORAGE_FORMAT_TABLE.items():
+        if format_info['extension'] == extension:
+            return storage_format
+
+    return None
+
+
+def write_frame(data_df, file_path_base, storage_format):
+    """
+    DESCRIPTION: write a dataframe in the given storage format
+    INPUT: data_df (DataFrame), file_path_base (str, without extension), storage_format (str)
+    OUTPUT: file_path (str)
+    """
+    format_info = STORAGE_FORMAT_TABLE[storage_format]
+    file_path = file_path_base + format_info['extension']
+    format_info['write'](data_df, file_path)
+
+    return file_path
+
+
+def open_frame_writer(file_path_base, storage_format):
+    """
+    DESCRIPTION: open an appending writer in the given storage format, used to
+                 store a stream of record batches without holding them all
+    INPUT: file_path_base (str, without extension), storage_format (str)
+    OUTPUT: frame_writer (ParquetFrameWriter or CsvFrameWriter)
+    """
+    format_info = STORAGE_FORMAT_TABLE[storage_format]
+
+    return format_info['writer'](file_path_base + format_info['extension'])
+
+
+def read_frame(file_path):
+    """
+    DESCRIPTION: read a stored file, whatever its storage format
+    INPUT: file_path (str)
+    OUTPUT: data_df (DataFrame)
+    """
+    storage_format = get_file_storage_format(file_path)
+    if storage_format is None:
+        raise ValueError('unknown storage format for file {0}'.format(file_path))
+
+    return STORAGE_FORMAT_TABLE[storage_format]['read'](file_path)
+
+
+def get_file_checksum(file_path):
+    """
+    DESCRIPTION: get the sha256 of a file content
+    INPUT: file_path (str)
+    OUTPUT: checksum (str)
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as stored_file:
+        for block in iter(lambda: stored_file.read(1024 * 1024), b''):
+            sha256.update(block)
+
+    return sha256.hexdigest()
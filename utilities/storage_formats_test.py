@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+
+from utilities.storage_formats import open_frame_writer, read_frame
+
+
+class TestStorageFormats(unittest.TestCase):
+
+    def test_frame_writers_append_batches(self):
+        batch_list = [
+            pd.DataFrame({'position': [1, 2], 'song_name': ['a', 'b']}),
+            pd.DataFrame({'position': [3], 'song_name': [None]}),
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for storage_format in ['parquet', 'csv']:
+                frame_writer = open_frame_writer(os.path.join(tmp_dir, 'spotify'), storage_format)
+                for data_df in batch_list:
+                    frame_writer.write(data_df)
+                frame_writer.close()
+
+                received = read_frame(frame_writer.file_path)
+                self.assertEqual(list(received['position']), [1, 2, 3])
+                self.assertEqual(list(received['song_name'][:2]), ['a', 'b'])
+
+    def test_parquet_writer_types_null_columns(self):
+        batch_list = [
+            pd.DataFrame({'position': [1, 2], 'isrc': [None, None], 'tempo': [None, None]}),
+            pd.DataFrame({'position': [3], 'isrc': ['isrc_3'], 'tempo': [None]}),
+            pd.DataFrame({'position': [4], 'isrc': [None], 'tempo': [120.5]}),
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            frame_writer = open_frame_writer(os.path.join(tmp_dir, 'spotify'), 'parquet')
+            for data_df in batch_list:
+                frame_writer.write(data_df)
+            frame_writer.close()
+            received = read_frame(frame_writer.file_path)
+
+            # a column without any value in the whole file keeps the null type
+            frame_writer = open_frame_writer(os.path.join(tmp_dir, 'artists'), 'parquet')
+            frame_writer.write(pd.DataFrame({'artist_id': ['a'], 'music_genre_3': [None]}))
+            frame_writer.close()
+            self.assertEqual(read_frame(frame_writer.file_path)['music_genre_3'].isnull().tolist(), [True])
+
+        self.assertEqual(list(received['position']), [1, 2, 3, 4])
+        self.assertEqual(list(received['isrc'][2:3]), ['isrc_3'])
+        self.assertEqual(received['tempo'].dtype, 'float64')
+        self.assertEqual(received['tempo'].iloc[3], 120.5)
+
+    def test_parquet_writer_holds_null_columns_up_to_a_limit(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            frame_writer = open_frame_writer(os.path.join(tmp_dir, 'spotify'), 'parquet')
+            frame_writer.max_pending_rows = 2
+            frame_writer.write(pd.DataFrame({'position': [1, 2], 'isrc': [None, None]}))
+            frame_writer.write(pd.DataFrame({'position': [3], 'isrc': ['isrc_3']}))
+            frame_writer.close()
+
+            received = read_frame(frame_writer.file_path)
+
+        self.assertEqual(received['isrc'].isnull().tolist(), [True, True, False])
+        self.assertEqual(received['isrc'].iloc[2], 'isrc_3')
+
+
+if __name__ == '__main__':
+    unittest.main()